@@ -0,0 +1,255 @@
+import argparse
+import time
+
+from sqlalchemy import text
+
+from process.preprocess_data_sensors import UNIQUE_ID_TRACK, _labsticc_speed_select
+from process.utils import create_engine_from_config
+
+# Benchmark du calcul des vitesses des capteurs labsticc (preprocess_data_sensors)
+#
+# Compare, sur les mêmes points agrégés à la seconde :
+# - "before" : l'ancienne version (CREATE TABLE, puis UPDATE de unique_id_track, UPDATE de speed_m_s
+#   et UPDATE de speed_m_s_smooth sur toute la table)
+# - "after" : le calcul en une seule passe à la création de la table (_labsticc_speed_select)
+#
+# Pour chaque version : durée, taille de la table et de ses index (pg_total_relation_size).
+# Les deux tables sont ensuite comparées ligne à ligne.
+
+# Colonnes des points agrégés à la seconde (table labsticc_sensors_unique)
+UNIQUE_COLUMNS = ('id, id_track, sensor_name, thermo_name, the_geom, "timestamp", '
+                  'temperature, humidity, accuracy, elevation')
+
+
+def _before_queries(unique_table, output_table):
+    """
+    Requêtes de l'ancienne version : table des vitesses puis trois UPDATE sur toute la table
+
+    Args:
+        unique_table: table des points agrégés à la seconde
+        output_table: table créée
+
+    Returns:
+        list: requêtes SQL, dans l'ordre d'exécution
+    """
+    return [
+        f"""
+        CREATE TEMPORARY TABLE {output_table} AS
+        WITH unique_rows AS (
+            SELECT {UNIQUE_COLUMNS},
+                   ROW_NUMBER() OVER (PARTITION BY sensor_name, thermo_name, the_geom, "timestamp" ORDER BY id) AS row_num
+            FROM {unique_table}
+            WHERE thermo_name NOT ILIKE '%reference%'),
+        ranked_data AS (
+            SELECT {UNIQUE_COLUMNS},
+                   LAG(the_geom) OVER (PARTITION BY sensor_name, thermo_name, id_track ORDER BY "timestamp") AS prev_the_geom,
+                   LAG("timestamp") OVER (PARTITION BY sensor_name, thermo_name, id_track ORDER BY "timestamp") AS prev_timestamp
+            FROM unique_rows
+            WHERE row_num = 1),
+        speed_data AS (
+            SELECT {UNIQUE_COLUMNS}, prev_the_geom,
+                   CASE
+                       WHEN prev_the_geom IS NOT NULL AND prev_timestamp IS NOT NULL
+                           AND EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp)) > 0
+                       THEN ST_Distance(the_geom, prev_the_geom, TRUE) / EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp))
+                       ELSE NULL
+                   END AS speed_m_s
+            FROM ranked_data),
+        filtered_data AS (
+            SELECT *
+            FROM speed_data
+            WHERE NOT (ST_Equals(the_geom, prev_the_geom) AND (speed_m_s = 0 OR speed_m_s IS NULL)))
+        SELECT {UNIQUE_COLUMNS}, speed_m_s
+        FROM filtered_data
+        """,
+        f"ALTER TABLE {output_table} ADD COLUMN unique_id_track TEXT",
+        f"UPDATE {output_table} SET unique_id_track = {UNIQUE_ID_TRACK}",
+        f"""
+        CREATE INDEX ON {output_table} (unique_id_track);
+        CREATE INDEX ON {output_table} ("timestamp");
+        CREATE INDEX ON {output_table} USING GIST (the_geom);
+        CREATE INDEX ON {output_table} (id);
+        """,
+        f"""
+        UPDATE {output_table} AS target
+        SET speed_m_s = speed_data.speed_m_s
+        FROM (
+            SELECT id,
+                   CASE
+                       WHEN prev_the_geom IS NOT NULL AND prev_timestamp IS NOT NULL
+                           AND EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp)) > 0
+                       THEN ST_Distance(the_geom, prev_the_geom, TRUE) / EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp))
+                       ELSE NULL
+                   END AS speed_m_s
+            FROM (
+                SELECT id, the_geom, "timestamp",
+                       LAG(the_geom) OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_the_geom,
+                       LAG("timestamp") OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_timestamp
+                FROM {output_table}
+            ) AS ranked_data
+        ) AS speed_data
+        WHERE target.id = speed_data.id
+        """,
+        f"ALTER TABLE {output_table} ADD COLUMN speed_m_s_smooth DOUBLE PRECISION",
+        f"""
+        UPDATE {output_table} AS target
+        SET speed_m_s_smooth = speed_smooth.speed_m_s_smooth
+        FROM (
+            SELECT id,
+                   AVG(speed_m_s) OVER (PARTITION BY unique_id_track ORDER BY "timestamp"
+                                        ROWS BETWEEN 4 PRECEDING AND CURRENT ROW) AS speed_m_s_smooth
+            FROM {output_table}
+        ) AS speed_smooth
+        WHERE target.id = speed_smooth.id
+        """,
+    ]
+
+
+def _after_queries(unique_table, output_table):
+    """
+    Requêtes de la version en une seule passe (voir preprocess_data_sensors._labsticc_speed_select)
+    """
+    return [
+        f"CREATE TEMPORARY TABLE {output_table} AS {_labsticc_speed_select(unique_table)}",
+        f"""
+        CREATE INDEX ON {output_table} (unique_id_track);
+        CREATE INDEX ON {output_table} ("timestamp");
+        CREATE INDEX ON {output_table} USING GIST (the_geom);
+        CREATE INDEX ON {output_table} (id);
+        """,
+    ]
+
+
+def create_unique_table(conn, nb_rows, track_size, from_raw=False):
+    """
+    Crée la table temporaire bench_labsticc_unique des points agrégés à la seconde
+
+    Args:
+        conn: connexion SQLAlchemy
+        nb_rows: nombre de points synthétiques
+        track_size: nombre de points par trace synthétique
+        from_raw: agrège veloclimat.labsticc_sensors_raw (comme clean_labsticc_sensors_data)
+                  au lieu de générer des points synthétiques
+    """
+    conn.execute(text("DROP TABLE IF EXISTS bench_labsticc_unique"))
+    if from_raw:
+        print("\n📊 Agrégation de veloclimat.labsticc_sensors_raw à la seconde...")
+        conn.execute(text("""
+                CREATE TEMPORARY TABLE bench_labsticc_unique AS
+                SELECT
+                    max(id) as id,
+                    sensor_name,
+                    thermo_name,
+                    id_track,
+                    DATE_TRUNC('second', "timestamp") as "timestamp",
+                    avg(temperature) as temperature,
+                    avg(humidity) as humidity,
+                    st_centroid(st_collect(THE_GEOM)) as THE_GEOM,
+                    avg(accuracy) as accuracy,
+                    avg(elevation) as elevation
+                FROM veloclimat.labsticc_sensors_raw
+                WHERE accuracy <= 25 AND thermo_name NOT ILIKE '%reference%' and temperature is not null
+                GROUP BY DATE_TRUNC('second', "timestamp"), sensor_name, thermo_name, id_track
+                """))
+    else:
+        # Traces de track_size points, une seconde d'écart ; un point sur cinq est immobile
+        print(f"\n📊 Création des données synthétiques ({nb_rows} points, {track_size} points par trace)...")
+        conn.execute(text("""
+                CREATE TEMPORARY TABLE bench_labsticc_unique AS
+                SELECT i AS id,
+                       i / :track_size AS id_track,
+                       'sensor_' || (i / :track_size) % 10 AS sensor_name,
+                       'thermo_' || (i / :track_size) % 3 AS thermo_name,
+                       ST_SetSRID(ST_MakePoint(-1.68 + floor((i % :track_size) * 0.8) * 0.00005, 48.11), 4326) AS the_geom,
+                       to_timestamp(1751000000 + i) AS "timestamp",
+                       20 + random() * 5 AS temperature,
+                       50 + random() * 10 AS humidity,
+                       random() * 25 AS accuracy,
+                       30 + random() * 10 AS elevation
+                FROM generate_series(1, :nb_rows) AS i
+                """), {"nb_rows": nb_rows, "track_size": track_size})
+    conn.execute(text("ANALYZE bench_labsticc_unique"))
+    conn.commit()
+
+
+def run_version(conn, name, queries, output_table):
+    """
+    Exécute les requêtes d'une version et mesure sa durée et la taille de la table produite
+
+    Returns:
+        tuple: (durée en secondes, taille en octets)
+    """
+    conn.execute(text(f"DROP TABLE IF EXISTS {output_table}"))
+    start = time.perf_counter()
+    for query in queries:
+        conn.execute(text(query))
+    conn.commit()
+    duration = time.perf_counter() - start
+
+    size, pretty_size, nb_rows = conn.execute(text(f"""
+            SELECT pg_total_relation_size('{output_table}'),
+                   pg_size_pretty(pg_total_relation_size('{output_table}')),
+                   (SELECT COUNT(*) FROM {output_table})
+            """)).one()
+    print(f"   {name:6s}: {duration:.2f}s, {pretty_size} ({nb_rows} lignes)")
+    return duration, size
+
+
+def compare_outputs(conn):
+    """
+    Nombre de lignes différentes entre les deux versions (id, speed_m_s, speed_m_s_smooth, unique_id_track)
+    """
+    return conn.execute(text("""
+            SELECT COUNT(*)
+            FROM bench_before AS b
+            FULL JOIN bench_after AS a USING (id)
+            WHERE a.id IS NULL OR b.id IS NULL
+               OR round(a.speed_m_s::numeric, 9) IS DISTINCT FROM round(b.speed_m_s::numeric, 9)
+               OR round(a.speed_m_s_smooth::numeric, 9) IS DISTINCT FROM round(b.speed_m_s_smooth::numeric, 9)
+               OR a.unique_id_track IS DISTINCT FROM b.unique_id_track
+            """)).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du calcul des vitesses des capteurs labsticc")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="nombre de points synthétiques")
+    parser.add_argument("--track-size", type=int, default=3600, help="nombre de points par trace synthétique")
+    parser.add_argument("--from-raw", action="store_true",
+                        help="mesure sur veloclimat.labsticc_sensors_raw au lieu de données synthétiques")
+    args = parser.parse_args()
+
+    engine = create_engine_from_config("config.json")
+    try:
+        with engine.connect() as conn:
+            create_unique_table(conn, args.rows, args.track_size, args.from_raw)
+
+            print("\n" + "=" * 70)
+            print("⏱️  Calcul des vitesses : avant / après")
+            print("=" * 70)
+            before = run_version(conn, "before", _before_queries("bench_labsticc_unique", "bench_before"),
+                                 "bench_before")
+            after = run_version(conn, "after", _after_queries("bench_labsticc_unique", "bench_after"),
+                                "bench_after")
+
+            nb_differences = compare_outputs(conn)
+            if nb_differences:
+                print(f"⚠️ {nb_differences} lignes différentes entre les deux versions")
+            else:
+                print("✅ Résultats identiques")
+            print(f"\n✅ Gain : x{before[0] / after[0]:.1f} en durée, x{before[1] / after[1]:.1f} en taille")
+
+            conn.execute(text("DROP TABLE IF EXISTS bench_before, bench_after, bench_labsticc_unique"))
+            conn.commit()
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,133 @@
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from process.interpolation import MF_TIME_STEP_SECONDS, lookup_station_slots, station_time_condition
+from process.utils import create_engine_from_config
+
+# Benchmark de la jointure points capteurs -> relevé Météo-France sur 6 minutes
+#
+# Compare sur un jeu de données synthétique :
+# - la jointure par intervalle d'origine ("range")
+# - la jointure sur le pas de 6 minutes calculé ("snapped")
+# - la recherche en mémoire triée (searchsorted)
+
+# Période synthétique : une campagne de 7 jours
+CAMPAIGN_SECONDS = 7 * 24 * 3600
+NB_STATIONS = 30
+
+
+def benchmark_sql(conn, nb_rows):
+    """
+    Compare les jointures "range" et "snapped" dans PostgreSQL sur des tables temporaires synthétiques
+
+    Args:
+        conn: connexion SQLAlchemy
+        nb_rows: nombre de points capteurs synthétiques
+
+    Returns:
+        dict: durée en secondes par mode de jointure
+    """
+    print(f"\n📊 Création des données synthétiques ({nb_rows} points)...")
+    conn.execute(text(f"""
+            DROP TABLE IF EXISTS bench_weather_data;
+            CREATE TEMPORARY TABLE bench_weather_data AS
+            SELECT s AS numer_sta,
+                   to_timestamp(1751000000 / {MF_TIME_STEP_SECONDS} * {MF_TIME_STEP_SECONDS} + k * {MF_TIME_STEP_SECONDS}) AS "date",
+                   random() AS t_ground_0
+            FROM generate_series(1, {NB_STATIONS}) AS s,
+                 generate_series(0, {CAMPAIGN_SECONDS // MF_TIME_STEP_SECONDS}) AS k;
+            CREATE INDEX ON bench_weather_data(numer_sta, "date");
+
+            DROP TABLE IF EXISTS bench_points;
+            CREATE TEMPORARY TABLE bench_points AS
+            SELECT i AS id,
+                   1 + (i % {NB_STATIONS}) AS numer_insee,
+                   to_timestamp(1751000000 + random() * {CAMPAIGN_SECONDS}) AS "timestamp"
+            FROM generate_series(1, :nb_rows) AS i;
+
+            ANALYZE bench_weather_data;
+            ANALYZE bench_points;
+            """), {"nb_rows": nb_rows})
+
+    timings = {}
+    for join_mode in ("snapped", "range"):
+        start = time.perf_counter()
+        nb_matches = conn.execute(text(f"""
+                SELECT COUNT(*)
+                FROM bench_points AS a
+                JOIN bench_weather_data AS b
+                    ON b.numer_sta = a.numer_insee AND {station_time_condition("b", "a", join_mode)}
+                """)).scalar()
+        timings[join_mode] = time.perf_counter() - start
+        print(f"   {join_mode:8s}: {timings[join_mode]:.2f}s ({nb_matches} correspondances)")
+
+    conn.execute(text("DROP TABLE IF EXISTS bench_points, bench_weather_data"))
+    conn.commit()
+    return timings
+
+
+def benchmark_numpy(nb_rows, seed=0):
+    """
+    Mesure la recherche en mémoire triée (searchsorted) sur des tableaux synthétiques
+
+    Args:
+        nb_rows: nombre de points capteurs synthétiques
+        seed: graine du générateur aléatoire
+
+    Returns:
+        float: durée en secondes
+    """
+    rng = np.random.default_rng(seed)
+    origin = 1751000000 // MF_TIME_STEP_SECONDS * MF_TIME_STEP_SECONDS
+    nb_slots = CAMPAIGN_SECONDS // MF_TIME_STEP_SECONDS + 1
+
+    station_ids = np.repeat(np.arange(1, NB_STATIONS + 1), nb_slots)
+    station_epochs = np.tile(origin + np.arange(nb_slots) * MF_TIME_STEP_SECONDS, NB_STATIONS)
+
+    query_stations = rng.integers(1, NB_STATIONS + 1, nb_rows)
+    query_epochs = origin + rng.random(nb_rows) * CAMPAIGN_SECONDS
+
+    start = time.perf_counter()
+    index = lookup_station_slots(station_ids, station_epochs, query_stations, query_epochs)
+    duration = time.perf_counter() - start
+    print(f"   searchsorted: {duration:.2f}s ({np.count_nonzero(index >= 0)} correspondances)")
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la jointure points -> relevés Météo-France")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="nombre de points synthétiques")
+    parser.add_argument("--no-sql", action="store_true", help="ne mesure que la version NumPy")
+    args = parser.parse_args()
+
+    print("\n" + "=" * 70)
+    print(f"⏱️  Benchmark sur {args.rows} points, {NB_STATIONS} stations")
+    print("=" * 70)
+
+    print("\n📊 Recherche en mémoire...")
+    benchmark_numpy(args.rows)
+
+    if args.no_sql:
+        return True
+
+    engine = create_engine_from_config("config.json")
+    try:
+        with engine.connect() as conn:
+            timings = benchmark_sql(conn, args.rows)
+            print(f"\n✅ Gain snapped / range : x{timings['range'] / timings['snapped']:.1f}")
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
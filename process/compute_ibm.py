@@ -1,7 +1,15 @@
+import argparse
 import re
-from sqlalchemy import text
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
-from process.utils import create_engine_from_config
+import numpy as np
+from sqlalchemy import (TIMESTAMP, Date, FrameClause, FrameClauseType, Numeric, Text, and_, any_, bindparam, case, cast,
+                        column, delete, extract, func, literal_column, select, table, text, true, tuple_)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from process.sources import SourceSpec
+from process.utils import copy_to_table, create_engine_from_config, create_table_as
 
 
 # Script pour calculer l'Indice Biométéorologique (IBM)
@@ -46,106 +54,546 @@ from process.utils import create_engine_from_config
 # ('Nord', '59', 18.0, 33.0, 2026);
 
 
+# Dernier id lu dans chaque table source par le calcul incrémental de chaque table IBM
+IBM_WATERMARK_TABLE = "veloclimat.ibm_watermarks"
+
+# Stations Météo-France et seuils d'alerte canicule par département
+STATIONS = table("weather_stations_mf", column("numer_insee"), column("the_geom"), schema="veloclimat")
+THRESHOLDS = table("seuils_ibm_canicule", column("code_departement"), column("ibm_min_nuit"),
+                   column("ibm_max_jour"), column("annee_seuil"), schema="veloclimat")
+
+# Tables sources de l'IBM calculé par main()
+IBM_SOURCE_TABLES = ["veloclimat.labsticc_sensors_preprocess", "veloclimat.veloclimatmeter_meteo_preprocess"]
+
+# Tables de sortie par défaut de main() : IBM global (complet ou incrémental) et IBM par groupe
+IBM_OUTPUT_TABLE = "veloclimat.ibm_combined"
+IBM_GROUP_OUTPUT_TABLE = "veloclimat.ibm_combined_groups"
+
+
+def _table(table_name, *columns):
+    """
+    Table (schema.table) connue par son nom et ses colonnes, pour les requêtes SQLAlchemy Core
+    """
+    schema, _, name = table_name.rpartition(".")
+    return table(name, *[column(col) for col in columns], schema=schema or None)
+
+
+def _validate_table_name(table_name):
+    for part in table_name.split('.'):
+        if not part.isidentifier():
+            raise ValueError(f"Nom de table invalide: {table_name}")
+
+
 def _is_subquery(input_table):
     """
     Détecte si input_table est un subquery (SELECT) ou une simple table
 
     Args:
-        input_table: chaîne représentant la table ou subquery
+        input_table: table, liste de tables, SourceSpec ou subquery
 
     Returns:
-        bool: True si c'est un subquery, False si c'est une table simple
+        bool: True si c'est un subquery, False sinon
     """
-    return "select" in input_table.lower() or "(" in input_table
+    return isinstance(input_table, str) and ("select" in input_table.lower() or "(" in input_table)
 
 
-def _validate_input_table(input_table):
+def _subquery_source(input_table):
     """
-    Valide le nom de table ou subquery
+    Valide et nettoie un subquery, puis l'entoure de parenthèses et d'un alias si besoin
 
     Args:
-        input_table: chaîne représentant la table ou subquery
+        input_table: subquery avec les colonnes 'temperature' et 'timestamp'
+                     ex: "(SELECT temperature, timestamp FROM table1 UNION ALL SELECT temperature, timestamp FROM table2) AS combined"
 
     Returns:
-        Tuple (valid: bool, error_message: str)
-    """
-    # Si c'est un subquery
-    if _is_subquery(input_table):
-        # Vérifier les mots-clés SQL basiques
-        stripped = input_table.strip().lower()
-        if not (stripped.startswith("select") or stripped.startswith("(")):
-            return False, "Subquery doit commencer par SELECT ou ("
-        if "temperature" not in input_table.lower():
-            return False, "Subquery doit contenir une colonne 'temperature'"
-        if "timestamp" not in input_table.lower():
-            return False, "Subquery doit contenir une colonne 'timestamp'"
-        return True, ""
-
-    # Si c'est une table simple
-    table_parts = input_table.split('.')
-    for part in table_parts:
-        if not part.isidentifier():
-            return False, f"Nom de table invalide: {input_table}"
+        str: source utilisable dans une clause FROM
+    """
+    stripped = input_table.strip().lower()
+    if not (stripped.startswith("select") or stripped.startswith("(")):
+        raise ValueError("Subquery doit commencer par SELECT ou (")
+    for col in ("temperature", "timestamp"):
+        if col not in stripped:
+            raise ValueError(f"Subquery doit contenir une colonne '{col}'")
 
-    return True, ""
+    # Réduire les espaces multiples à un seul
+    source = re.sub(r'\s+', ' ', input_table.strip())
+    if not re.search(r'\)\s+as\s+(\w+)$', source, re.IGNORECASE):
+        source = f"({source}) AS source_data"
+    return source
 
 
-def _clean_subquery(input_table):
+def _subquery_extremes(engine, source, time_window=None):
     """
-    supprime espaces inutiles, indentation
+    Tn/Tx journaliers d'un subquery, en une seule requête
+
+    Le subquery n'est pas découpé par table ni par intervalle : préférer une liste de tables
+    pour paralléliser la lecture (voir daily_extremes).
 
     Args:
-        input_table: subquery brute
+        engine: engine SQLAlchemy
+        source: subquery nettoyé (voir _subquery_source)
+        time_window: tuple optionnel (début, fin) limitant les mesures à [début, fin)
 
     Returns:
-        str: subquery nettoyée
+        dict: {jour: (tn, tx)}
     """
-    # Réduire les espaces multiples à un seul
-    cleaned = re.sub(r'\s+', ' ', input_table.strip())
-    return cleaned
+    timestamp, temperature = literal_column('"timestamp"'), literal_column("temperature")
+    statement = (select(func.date(timestamp), func.min(temperature), func.max(temperature))
+                 .select_from(text(source))
+                 .group_by(func.date(timestamp)))
+    if time_window is not None:
+        statement = statement.where(
+            timestamp >= bindparam("window_start", time_window[0], type_=TIMESTAMP(timezone=True)),
+            timestamp < bindparam("window_end", time_window[1], type_=TIMESTAMP(timezone=True)))
+    with engine.connect() as conn:
+        return {day: (tn, tx) for day, tn, tx in conn.execute(statement)}
+
+
+def _rolling_mean(expression, calendar_days=False, **window):
+    """
+    Moyenne glissante sur 3 jours (veille, jour, lendemain), arrondie à 2 décimales
+
+    Args:
+        expression: valeur journalière à moyenner
+        calendar_days: si False, la fenêtre porte sur les lignes (ROWS BETWEEN 1 PRECEDING AND 1 FOLLOWING)
+                       et moyenne les jours disponibles. Si True, elle porte sur les dates (RANGE de 1 jour)
+                       et la moyenne vaut NULL si la veille ou le lendemain n'ont pas de mesures.
+        **window: partition_by / order_by de la fenêtre
+    """
+    if not calendar_days:
+        return func.round(cast(func.avg(expression).over(rows=(-1, 1), **window), Numeric), literal_column("2"))
+
+    frame = FrameClause(timedelta(days=1), timedelta(days=1), FrameClauseType.PRECEDING, FrameClauseType.FOLLOWING)
+    mean = func.avg(expression).over(range_=frame, **window)
+    nb_days = func.count().over(range_=frame, **window)
+    return case((nb_days == literal_column("3"), func.round(cast(mean, Numeric), literal_column("2"))))
+
+
+def _ibm_select(daily):
+    """
+    Requête de l'IBM (moyenne glissante sur 3 jours) à partir des Tn/Tx journaliers
+
+    Args:
+        daily: table ou sous-requête avec les colonnes day, tn et tx
+    """
+    return select(
+        daily.c.day,
+        daily.c.tn,
+        daily.c.tx,
+        _rolling_mean((daily.c.tn + daily.c.tx) / literal_column("2"), order_by=daily.c.day).label("ibm"),
+    )
+
+
+def _department(numer_insee):
+    """
+    Code du département d'une station Météo-France (2 premiers chiffres du numéro INSEE sur 8 chiffres)
+
+    Approximation : un point reçoit le département de la station la plus proche (voir _chunk_select),
+    pas celui où il se trouve. Près d'une limite départementale, ses Tn/Tx peuvent être comparés
+    aux seuils du département voisin.
+    """
+    return func.left(func.lpad(cast(numer_insee, Text), literal_column("8"), literal_column("'0'")),
+                     literal_column("2"))
+
+
+def _chunk_select(spec_table, spec, by_station):
+    """
+    Tn/Tx journaliers d'une table sur un intervalle [:start, :end) de "timestamp" (par station si by_station)
+
+    La même requête est exécutée pour chaque intervalle : seuls les paramètres liés changent.
+    """
+    timestamp = spec_table.c[spec.time_column]
+    day = func.date(timestamp)
+    conditions = [timestamp >= bindparam("start"), timestamp < bindparam("end")]
+    if spec.time_filter(spec_table) is not None:
+        conditions.append(spec.time_filter(spec_table))
+
+    if by_station:
+        # Station Météo-France la plus proche de chaque point
+        mf = STATIONS.alias("mf")
+        station = (select(mf.c.numer_insee)
+                   .order_by(mf.c.the_geom.op("<->")(spec_table.c.the_geom))
+                   .limit(literal_column("1"))
+                   .lateral("st"))
+        return (select(station.c.numer_insee, day.label("day"),
+                       func.min(spec_table.c.temperature), func.max(spec_table.c.temperature))
+                .select_from(spec_table.join(station, true()))
+                .where(and_(*conditions))
+                .group_by(station.c.numer_insee, day))
+
+    return (select(day.label("day"), func.min(spec_table.c.temperature), func.max(spec_table.c.temperature))
+            .where(and_(*conditions))
+            .group_by(day))
+
+
+def refresh_ibm(conn, source, output_table):
+    """
+    Met à jour l'IBM de façon incrémentale
+
+    Les Tn/Tx journaliers sont conservés dans {output_table}_daily. Seules les lignes de chaque table source
+    dont l'id dépasse le dernier id lu (IBM_WATERMARK_TABLE) sont agrégées et fusionnées (LEAST/GREATEST)
+    avec les jours existants. L'IBM n'est recalculé que pour les jours modifiés et leurs voisins
+    (jour précédent et jour suivant de la table journalière).
+    Relire des lignes déjà agrégées ne change pas les Tn/Tx : la mise à jour peut être relancée sans risque.
+    Les watermarks portent sur toutes les lignes des tables sources : une fenêtre de temps (time_window)
+    n'est pas acceptée, les lignes écartées ne seraient jamais relues.
+
+    Args:
+        conn: connexion SQLAlchemy
+        source: table, liste de tables ou SourceSpec avec les colonnes id, temperature et "timestamp"
+        output_table: table IBM (day, tn, tx, ibm)
+
+    Returns:
+        int: nombre de jours dont l'IBM a été recalculé
+    """
+    spec = SourceSpec.from_input(source, ["id", "temperature"])
+    if spec.time_window is not None:
+        raise ValueError("le mode incrémental ne peut pas être limité à une fenêtre de temps (time_window)")
+    daily_table_name = f"{output_table}_daily"
+    daily_table = _table(daily_table_name, "day", "tn", "tx")
+    ibm_table = _table(output_table, "day", "tn", "tx", "ibm")
+
+    # Verrou tenu jusqu'au COMMIT : deux mises à jour de la même table IBM ne se chevauchent pas
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:output_table))"), {"output_table": output_table})
+
+    # Une table existante d'un autre schéma (IBM par groupe) ne doit pas recevoir l'IBM global
+    output_columns = conn.execute(text("""
+            SELECT array_agg(attname::text ORDER BY attnum)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass(:output_table) AND attnum > 0 AND NOT attisdropped
+            """), {"output_table": output_table}).scalar()
+    if output_columns is not None and output_columns != ["day", "tn", "tx", "ibm"]:
+        raise ValueError(f"{output_table} n'est pas une table IBM globale (day, tn, tx, ibm) : "
+                         f"colonnes {', '.join(output_columns)}")
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {daily_table_name} (
+                day DATE PRIMARY KEY,
+                tn DOUBLE PRECISION,
+                tx DOUBLE PRECISION
+            );
+
+            CREATE TABLE IF NOT EXISTS {output_table} (
+                day DATE PRIMARY KEY,
+                tn DOUBLE PRECISION,
+                tx DOUBLE PRECISION,
+                ibm NUMERIC
+            );
+
+            CREATE TABLE IF NOT EXISTS {IBM_WATERMARK_TABLE} (
+                output_table TEXT NOT NULL,
+                source_table TEXT NOT NULL,
+                last_id BIGINT NOT NULL,
+                updated_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (output_table, source_table)
+            );
+            """))
+
+    touched_days = set()
+    watermarks = {}
+    for source_table, spec_table, _ in spec.selects(conn):
+        last_id = conn.execute(text(f"""
+                SELECT last_id FROM {IBM_WATERMARK_TABLE}
+                WHERE output_table = :output_table AND source_table = :source_table
+                """), {"output_table": output_table, "source_table": source_table}).scalar() or 0
+        max_id = conn.execute(select(func.max(spec_table.c.id))).scalar()
+        if max_id is None or max_id <= last_id:
+            print(f"⏭️  Aucune nouvelle ligne dans {source_table}")
+            continue
+
+        # Tn/Tx des jours touchés par les nouvelles lignes, fusionnés avec les jours existants
+        day = func.date(spec_table.c[spec.time_column])
+        new_days = (select(day, func.min(spec_table.c.temperature), func.max(spec_table.c.temperature))
+                    .where(spec_table.c.id > bindparam("last_id"), spec_table.c.id <= bindparam("max_id"))
+                    .group_by(day))
+        upsert = insert(daily_table).from_select(["day", "tn", "tx"], new_days)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["day"],
+            set_={"tn": func.least(daily_table.c.tn, upsert.excluded.tn),
+                  "tx": func.greatest(daily_table.c.tx, upsert.excluded.tx)},
+        ).returning(daily_table.c.day)
+        touched_days.update(conn.execute(upsert, {"last_id": last_id, "max_id": max_id}).scalars().all())
+        watermarks[source_table] = max_id
+
+    # Jours modifiés et leurs voisins dans la fenêtre glissante
+    touched_days = sorted(touched_days)
+    affected_days = [] if not touched_days else conn.execute(text(f"""
+            SELECT day
+            FROM (
+                SELECT day, LAG(day) OVER (ORDER BY day) AS previous_day, LEAD(day) OVER (ORDER BY day) AS next_day
+                FROM {daily_table_name}
+            ) AS neighbours
+            WHERE day = ANY(:days) OR previous_day = ANY(:days) OR next_day = ANY(:days)
+            """), {"days": touched_days}).scalars().all()
+
+    if affected_days:
+        days = any_(bindparam("days", type_=ARRAY(Date)))
+        ibm = _ibm_select(daily_table).subquery("ibm")
+        conn.execute(delete(ibm_table).where(ibm_table.c.day == days), {"days": affected_days})
+        conn.execute(insert(ibm_table).from_select(["day", "tn", "tx", "ibm"],
+                                                   select(ibm).where(ibm.c.day == days)),
+                     {"days": affected_days})
+
+    for source_table, max_id in watermarks.items():
+        conn.execute(text(f"""
+                INSERT INTO {IBM_WATERMARK_TABLE} (output_table, source_table, last_id)
+                VALUES (:output_table, :source_table, :max_id)
+                ON CONFLICT (output_table, source_table) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = now()
+                """), {"output_table": output_table, "source_table": source_table, "max_id": max_id})
+    conn.commit()
+
+    print(f"✅ {len(touched_days)} jours mis à jour, IBM recalculé pour {len(affected_days)} jours")
+    return len(affected_days)
+
+
+def _time_chunks(conn, spec_table, spec, chunk_days):
+    """
+    Découpe la période couverte par une table en intervalles [début, fin) de chunk_days jours
+
+    MIN/MAX("timestamp") sont lus dans l'index sur "timestamp".
+    """
+    timestamp = spec_table.c[spec.time_column]
+    start, end = conn.execute(select(func.min(timestamp), func.max(timestamp))).one()
+    chunks = []
+    while start is not None and start <= end:
+        chunks.append((start, start + timedelta(days=chunk_days)))
+        start += timedelta(days=chunk_days)
+    return chunks
 
 
-def calculate_ibm(config_path, input_table, output_table=None):
+def _partial_extremes(engine, statement, start, end):
+    """
+    Tn/Tx journaliers d'un intervalle [start, end), sur une connexion du pool
+
+    Returns:
+        list: lignes (jour, tn, tx) ou (numer_insee, jour, tn, tx)
+    """
+    with engine.connect() as conn:
+        return conn.execute(statement, {"start": start, "end": end}).fetchall()
+
+
+def daily_extremes(engine, source, by_station=False, workers=4, chunk_days=7):
+    """
+    Tn/Tx journaliers de plusieurs tables sources, calculés en parallèle puis fusionnés
+
+    Chaque table est découpée en intervalles de chunk_days jours sur "timestamp" (index ou partitions) :
+    chaque intervalle est agrégé sur sa propre connexion. Les résultats partiels (une ligne par jour,
+    ou par station et par jour) sont fusionnés en prenant le minimum des Tn et le maximum des Tx.
+
+    Args:
+        engine: engine SQLAlchemy
+        source: SourceSpec (colonnes temperature, "timestamp" et the_geom si by_station) ou liste de tables
+        by_station: rattache chaque point à la station Météo-France la plus proche
+        workers: nombre d'intervalles agrégés en même temps
+        chunk_days: taille des intervalles en jours
+
+    Returns:
+        dict: {jour ou (numer_insee, jour): (tn, tx)}
+    """
+    spec = SourceSpec.from_input(source, ["temperature", "the_geom"] if by_station else ["temperature"])
+    with engine.connect() as conn:
+        units = []
+        for _, spec_table, _ in spec.selects(conn):
+            statement = _chunk_select(spec_table, spec, by_station)
+            units += [(statement, start, end) for start, end in _time_chunks(conn, spec_table, spec, chunk_days)]
+
+    extremes = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_partial_extremes, engine, statement, start, end)
+                   for statement, start, end in units]
+        for future in as_completed(futures):
+            for *key, tn, tx in future.result():
+                key = tuple(key) if by_station else key[0]
+                previous_tn, previous_tx = extremes.get(key, (None, None))
+                extremes[key] = (min((v for v in (previous_tn, tn) if v is not None), default=None),
+                                 max((v for v in (previous_tx, tx) if v is not None), default=None))
+
+    print(f"📊 {len(units)} intervalles agrégés sur {len(spec.tables)} tables")
+    return extremes
+
+
+def _write_extremes(conn, extremes, by_station):
+    """
+    Écrit les Tn/Tx journaliers fusionnés dans une table temporaire
+
+    Returns:
+        Table ou sous-requête (day, tn, tx) ou (code_departement, numer_insee, day, tn, tx)
+    """
+    table_name = "pg_temp.ibm_daily_temps"
+    keys = list(extremes)
+    values = np.array([extremes[key] for key in keys], dtype=np.float64).reshape(-1, 2)
+    columns = {}
+    types = {"day": "date"}
+    if by_station:
+        columns["numer_insee"] = np.array([key[0] for key in keys], dtype=np.int64)
+        columns["day"] = np.array([key[1] for key in keys], dtype="datetime64[D]")
+        types["numer_insee"] = "integer"
+    else:
+        columns["day"] = np.array(keys, dtype="datetime64[D]")
+    columns["tn"] = values[:, 0]
+    columns["tx"] = values[:, 1]
+    copy_to_table(conn, table_name, columns, types=types)
+
+    if by_station:
+        daily = _table(table_name, "numer_insee", "day", "tn", "tx")
+        return select(_department(daily.c.numer_insee).label("code_departement"), daily.c.numer_insee,
+                      daily.c.day, daily.c.tn, daily.c.tx).subquery("station_daily")
+    return _table(table_name, "day", "tn", "tx")
+
+
+def _create_ibm_table(conn, daily_temps, output_table):
+    """
+    Recrée la table IBM à partir des Tn/Tx journaliers (table ou sous-requête : day, tn, tx)
+    """
+    print(f"📊 Calcul de l'IBM en cours...")
+    create_table_as(conn, output_table, _ibm_select(daily_temps).order_by(daily_temps.c.day))
+    conn.commit()
+    print(f"✅ Indice Biométéorologique créé avec succès dans {output_table} !")
+
+
+def _create_ibm_group_table(conn, station_daily, output_table):
+    """
+    Recrée la table IBM par département et par station Météo-France, avec les alertes canicule
+
+    Les Tn/Tx journaliers des stations et des départements sont calculés en une seule lecture
+    (GROUPING SETS) des Tn/Tx par station, puis pour chaque groupe :
+    - ibm : moyenne glissante sur 3 jours de (tn + tx) / 2
+    - ibm_n / ibm_x : moyennes glissantes sur 3 jours de tn et de tx
+    - alerte_nuit / alerte_jour : ibm_n / ibm_x atteignent les seuils du département (THRESHOLDS,
+      seuils de l'année du jour ou, à défaut, les plus récents)
+    - alerte_canicule : les deux seuils sont atteints
+
+    Le département d'un point est celui de sa station Météo-France la plus proche (voir _department).
+
+    Args:
+        conn: connexion SQLAlchemy
+        station_daily: sous-requête (code_departement, numer_insee, day, tn, tx), voir _write_extremes
+        output_table: table de sortie
+    """
+    # Tn / Tx par jour, par département et par station
+    daily_temps = (
+        select(
+            case((func.grouping(station_daily.c.numer_insee) == literal_column("1"), literal_column("'departement'")),
+                 else_=literal_column("'station'")).label("niveau"),
+            station_daily.c.code_departement,
+            station_daily.c.numer_insee,
+            station_daily.c.day,
+            func.min(station_daily.c.tn).label("tn"),
+            func.max(station_daily.c.tx).label("tx"),
+        )
+        .group_by(func.grouping_sets(
+            tuple_(station_daily.c.code_departement, station_daily.c.day),
+            tuple_(station_daily.c.code_departement, station_daily.c.numer_insee, station_daily.c.day)))
+        .subquery("daily_temps")
+    )
+
+    # Moyennes glissantes sur 3 jours calendaires de chaque groupe (NULL si la veille ou le lendemain manquent)
+    window = {"partition_by": [daily_temps.c.niveau, daily_temps.c.code_departement, daily_temps.c.numer_insee],
+              "order_by": daily_temps.c.day}
+    ibm = select(
+        daily_temps,
+        _rolling_mean((daily_temps.c.tn + daily_temps.c.tx) / literal_column("2"), calendar_days=True,
+                      **window).label("ibm"),
+        _rolling_mean(daily_temps.c.tn, calendar_days=True, **window).label("ibm_n"),
+        _rolling_mean(daily_temps.c.tx, calendar_days=True, **window).label("ibm_x"),
+    ).subquery("ibm")
+
+    # Seuils du département : ceux de l'année du jour ou, à défaut, les plus récents
+    thresholds = (
+        select(THRESHOLDS.c.ibm_min_nuit, THRESHOLDS.c.ibm_max_jour)
+        .where(THRESHOLDS.c.code_departement == ibm.c.code_departement)
+        .order_by((THRESHOLDS.c.annee_seuil <= extract("year", ibm.c.day)).desc(), THRESHOLDS.c.annee_seuil.desc())
+        .limit(literal_column("1"))
+        .lateral("t")
+    )
+    alert_night = ibm.c.ibm_n >= thresholds.c.ibm_min_nuit
+    alert_day = ibm.c.ibm_x >= thresholds.c.ibm_max_jour
+    statement = (
+        select(
+            ibm,
+            thresholds.c.ibm_min_nuit.label("seuil_ibm_n"),
+            thresholds.c.ibm_max_jour.label("seuil_ibm_x"),
+            alert_night.label("alerte_nuit"),
+            alert_day.label("alerte_jour"),
+            and_(alert_night, alert_day).label("alerte_canicule"),
+        )
+        .select_from(ibm.outerjoin(thresholds, true()))
+        .order_by(ibm.c.niveau, ibm.c.code_departement, ibm.c.numer_insee, ibm.c.day)
+    )
+
+    print(f"📊 Calcul de l'IBM par département et par station en cours...")
+    create_table_as(conn, output_table, statement)
+    conn.commit()
+    print(f"✅ Indice Biométéorologique créé avec succès dans {output_table} !")
+
+    alerts = conn.execute(text(f"""
+            SELECT code_departement, COUNT(*) FILTER (WHERE alerte_canicule) AS nb_jours_alerte,
+                   MIN(day) FILTER (WHERE alerte_canicule) AS premier_jour
+            FROM {output_table}
+            WHERE niveau = 'departement'
+            GROUP BY code_departement
+            ORDER BY code_departement
+            """)).mappings().fetchall()
+    for alert in alerts:
+        if alert["nb_jours_alerte"]:
+            print(f"⚠️ Département {alert['code_departement']}: {alert['nb_jours_alerte']} jours en alerte canicule "
+                  f"(à partir du {alert['premier_jour']})")
+
+
+def calculate_ibm(config_path, input_table, output_table=None, incremental=False,
+                  by_group=False, workers=4, chunk_days=7, time_window=None):
     """
     Calcule l'Indice Biométéorologique (IBM) - moyenne glissante sur 3 jours
 
+    Les Tn/Tx journaliers de chaque table sont calculés en parallèle par intervalles de temps puis
+    fusionnés (voir daily_extremes). Les requêtes sont construites avec SQLAlchemy Core : les tables
+    et les colonnes sont vérifiées dans le catalogue, les valeurs sont des paramètres liés.
+    Une subquery est acceptée telle quelle et agrégée en une seule requête (voir _subquery_extremes).
+
     Args:
         config_path: chemin vers le fichier config.json
-        input_table: nom de la table source (ex: 'schema.table')
-                    OU une subquery SELECT avec colonnes 'temperature' et 'timestamp'
+        input_table: nom de la table source (ex: 'schema.table'), liste de tables
+                    ou SourceSpec (colonnes 'temperature' et 'timestamp')
+                    OU une subquery SELECT avec colonnes 'temperature' et 'timestamp', lue en une seule requête
                     ex: "(SELECT temperature, timestamp FROM table1 UNION ALL SELECT temperature, timestamp FROM table2) AS combined"
-        output_table: nom de la table de sortie. Si None, utilise {input_table}_ibm ou ibm_result si subquery
+        output_table: nom de la table de sortie. Si None, utilise {input_table}_ibm pour une table unique,
+                      veloclimat.ibm_result sinon
+        incremental: met à jour la table de sortie à partir des nouvelles lignes seulement (voir refresh_ibm).
+                    Les tables sources doivent alors avoir une colonne id ; time_window n'est pas accepté.
+        by_group: calcule l'IBM par département et par station Météo-France avec les alertes canicule
+                  (voir _create_ibm_group_table). Les tables sources doivent avoir une colonne the_geom.
+                  Chaque point est rattaché au département de sa station la plus proche.
+        workers: nombre d'intervalles agrégés en même temps
+        chunk_days: taille des intervalles en jours
+        time_window: tuple optionnel (début, fin) limitant les mesures à [début, fin)
 
     Returns:
         Tuple (success: bool, message: str)
     """
+    if incremental and by_group:
+        return False, "Erreur : le mode incrémental ne calcule que l'IBM global"
+    if incremental and time_window is not None:
+        return False, "Erreur : le mode incrémental ne peut pas être limité à une fenêtre de temps"
 
-
-    # Valider input_table
-    is_valid, error_msg = _validate_input_table(input_table)
-    if not is_valid:
-        return False, f"Erreur : {error_msg}"
-
-    # Nettoyer input_table si c'est un subquery
     is_subquery = _is_subquery(input_table)
-    if is_subquery:
-        input_table = _clean_subquery(input_table)
-        print(f"📋 Subquery détectée et nettoyée")
-    else:
-        print(f"📊 Table source détectée: {input_table}")
+    if is_subquery and (incremental or by_group):
+        return False, "Erreur : une subquery n'est acceptée que pour l'IBM global complet"
 
-    # Déterminer la table de sortie
-    if output_table is None:
+    columns = ["temperature"] + (["id"] if incremental else []) + (["the_geom"] if by_group else [])
+    try:
         if is_subquery:
-            output_table = "veloclimat.ibm_result"
+            spec = None
+            input_table = _subquery_source(input_table)
+            print(f"📋 Subquery détectée et nettoyée")
         else:
-            output_table = f"{input_table}_ibm"
+            spec = SourceSpec.from_input(input_table, columns, time_window=time_window)
+            print(f"📊 Tables sources: {', '.join(spec.tables)}")
 
-    # Valider output_table
-    output_parts = output_table.split('.')
-    for part in output_parts:
-        if not part.isidentifier():
-            return False, f"Erreur : nom de table de sortie invalide: {output_table}"
+        # Déterminer la table de sortie
+        if output_table is None:
+            output_table = f"{spec.tables[0]}_ibm" if spec and len(spec.tables) == 1 else "veloclimat.ibm_result"
+        _validate_table_name(output_table)
+    except ValueError as e:
+        return False, f"Erreur : {e}"
 
     # Créer l'engine
     engine = create_engine_from_config(config_path)
@@ -156,66 +604,26 @@ def calculate_ibm(config_path, input_table, output_table=None):
             conn.execute(text("SELECT 1"))
             print("✅ Connexion à PostgreSQL réussie !")
 
-            # Drop table if exists
-            print(f"🗑️  Suppression de la table {output_table} si elle existe...")
-            conn.execute(text(f"DROP TABLE IF EXISTS {output_table}"))
-            conn.commit()
-
-            # Construire la source de données
-            # Si c'est un subquery
             if is_subquery:
-                # Vérifier si déjà entouré de parenthèses avec alias
-                if input_table.strip().startswith("(") and " as " in input_table.lower():
-                    source = input_table
-                else:
-                    # Extraire l'alias s'il existe
-                    alias_match = re.search(r'\)\s+as\s+(\w+)', input_table, re.IGNORECASE)
-                    if alias_match:
-                        source = input_table
-                    else:
-                        # Ajouter les parenthèses et un alias générique
-                        source = f"({input_table}) AS source_data"
+                # Subquery : Tn/Tx journaliers en une seule requête
+                extremes = _subquery_extremes(engine, input_table, time_window)
+                _create_ibm_table(conn, _write_extremes(conn, extremes, False), output_table)
+            elif incremental:
+                # Vérifier les tables et les colonnes dans le catalogue
+                spec.reflect(conn)
+                print(f"📊 Mise à jour incrémentale de l'IBM...")
+                refresh_ibm(conn, spec, output_table)
             else:
-                source = input_table
-
-            # Requête SQL pour calculer l'IBM (moyenne glissante sur 3 jours)
-            query = f"""
-            CREATE TABLE {output_table} AS
-            WITH daily_temps AS (
-                -- Extraire les Tn (min) et Tx (max) par jour
-                SELECT
-                    DATE("timestamp") AS day,
-                    MIN(temperature) AS tn,
-                    MAX(temperature) AS tx
-                FROM {source}
-                GROUP BY DATE("timestamp")
-            ),
-            daily_mean AS (
-                -- Calculer la moyenne (tn + tx)/2 pour chaque jour
-                SELECT
-                    day,
-                    tn,
-                    tx,
-                    (tn + tx) / 2 AS daily_avg
-                FROM daily_temps
-            )
-            -- Calculer la moyenne glissante sur 3 jours (IBM)
-            SELECT
-                day,
-                tn,
-                tx,
-                ROUND(AVG(daily_avg) OVER (
-                    ORDER BY day
-                    ROWS BETWEEN 1 PRECEDING AND 1 FOLLOWING
-                )::numeric, 2) AS ibm
-            FROM daily_mean
-            ORDER BY day
-            """
-
-            print(f"📊 Calcul de l'IBM en cours...")
-            conn.execute(text(query))
-            conn.commit()
-            print(f"✅ Indice Biométéorologique créé avec succès dans {output_table} !")
+                spec.reflect(conn)
+
+                # Agrégats journaliers par table et par intervalle, fusionnés dans une table temporaire
+                extremes = daily_extremes(engine, spec, by_group, workers, chunk_days)
+                daily_temps = _write_extremes(conn, extremes, by_group)
+
+                if by_group:
+                    _create_ibm_group_table(conn, daily_temps, output_table)
+                    return True, "Calcul IBM terminé avec succès"
+                _create_ibm_table(conn, daily_temps, output_table)
 
             # Afficher les stats
             result = conn.execute(text(f"""
@@ -247,25 +655,32 @@ def calculate_ibm(config_path, input_table, output_table=None):
     except Exception as e:
         return False, f"❌ Erreur SQL : {e}"
 
-    finally:
-        engine.dispose()
 
+def main():
+    parser = argparse.ArgumentParser(description="Calcul de l'Indice Biométéorologique (IBM)")
+    parser.add_argument("--tables", nargs="+", default=IBM_SOURCE_TABLES, help="tables sources")
+    parser.add_argument("--output", help=f"table de sortie (défaut : {IBM_OUTPUT_TABLE}, "
+                                          f"{IBM_GROUP_OUTPUT_TABLE} avec --by-group)")
+    parser.add_argument("--incremental", action="store_true", help="mise à jour à partir des nouvelles lignes")
+    parser.add_argument("--by-group", action="store_true",
+                        help="IBM par département et par station avec les alertes canicule")
+    parser.add_argument("--workers", type=int, default=4, help="intervalles agrégés en même temps")
+    args = parser.parse_args()
 
-# Run
-if __name__ == "__main__":
-
-    #success, message = calculate_ibm(
-    #    config_path="config.json",
-    #    input_table="veloclimat.labsticc_sensor_preprocess",
-    #    output_table="veloclimat.labsticc_sensor_preprocess_ibm"
-    #)
     success, message = calculate_ibm(
         config_path="config.json",
-        input_table="""(SELECT temperature, "timestamp" FROM veloclimat.labsticc_sensor_preprocess
-                        UNION ALL
-                        SELECT temperature, "timestamp" FROM veloclimat.veloclimatmeter_preprocess) AS combined_data""",
-        output_table="veloclimat.ibm_combined"
+        input_table=args.tables,
+        output_table=args.output or (IBM_GROUP_OUTPUT_TABLE if args.by_group else IBM_OUTPUT_TABLE),
+        incremental=args.incremental,
+        by_group=args.by_group,
+        workers=args.workers
     )
 
     print(message)
-    exit(0 if success else 1)
\ No newline at end of file
+    return success
+
+
+# Run
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
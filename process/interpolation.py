@@ -0,0 +1,711 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import text
+
+from process.station_cache import load_station_series, load_triangulation, locate_points
+from process.utils import copy_to_table
+
+# Moteur d'interpolation barycentrique des températures Météo-France
+#
+# Les scripts interpolate_*_temperature.py construisaient deux polygones 3D par point
+# (ARRAY_AGG / ST_MakePolygon) puis appelaient ST_Z(ST_Intersection(...)) pour obtenir
+# une valeur interpolée linéairement sur le triangle de Delaunay.
+# Ce module lit une seule fois les sommets du triangle et les données des 3 stations
+# pour chaque point, calcule les poids barycentriques en lot avec NumPy et écrit t_inter
+# en bloc dans la base.
+#
+# interpolate() est le point d'entrée unique des trois familles de capteurs (SOURCES) :
+# la table source, la table de sortie et les colonnes conservées sont des paramètres.
+
+# Gradient vertical de température utilisé pour corriger l'altitude (°C/m)
+LAPSE_RATE = 0.0065
+
+# Pas de temps des données Météo-France (6 minutes)
+MF_TIME_STEP_SECONDS = 360
+
+# Table persistante des poids barycentriques point -> triangle
+WEIGHTS_TABLE = "veloclimat.weather_stations_mf_weights"
+
+# Suivi des lots terminés, pour reprendre une interpolation interrompue
+PROGRESS_TABLE = "veloclimat.interpolation_progress"
+
+# Clé de suivi du lot des points sans trace (unique_id_track NULL)
+NULL_TRACK_KEY = "NULL"
+
+# Méthodes d'interpolation (voir interpolate)
+METHODS = ["weights", "numpy", "scipy", "sql"]
+
+# Paramètres d'interpolation des trois familles de capteurs
+SOURCES = {
+    "veloclimatmeter": {
+        "source_table": "veloclimat.veloclimatmeter_meteo_preprocess",
+        "output_table": "veloclimat.veloclimatmeter_temperature_interpolate",
+        "columns": ["unique_id_track", "speed_m_s", "temperature_bot", "temperature_top",
+                    "elevation", "thermo_name", "sensor_name"],
+    },
+    "labsticc_sensors": {
+        "source_table": "veloclimat.labsticc_sensors_preprocess",
+        "output_table": "veloclimat.labsticc_sensors_temperature_interpolate",
+        "columns": ["elevation", "speed_m_s", "thermo_name", "sensor_name", "unique_id_track"],
+    },
+    "labsticc_sensors_reference": {
+        "source_table": "veloclimat.labsticc_sensors_reference_preprocess",
+        "output_table": "veloclimat.labsticc_sensors_reference_temperature_interpolate",
+        "columns": ["unique_id_track", "thermo_name", "sensor_name"],
+    },
+}
+
+
+def station_time_condition(station_alias, point_alias, join_mode="snapped"):
+    """
+    Condition SQL qui associe un point au pas de temps Météo-France qui le contient
+
+    Le pas de temps retenu est le dernier relevé "date" tel que
+    "timestamp" - 6 minutes < "date" <= "timestamp".
+
+    Args:
+        station_alias: alias de la table weather_data_stations_mf
+        point_alias: alias de la table des points capteurs
+        join_mode: "snapped" calcule directement le pas de 6 minutes (jointure par égalité, hash join)
+                   "range" conserve la jointure par intervalle d'origine (boucle imbriquée)
+
+    Returns:
+        str: condition SQL à placer dans la clause ON
+    """
+    if join_mode == "snapped":
+        # Les données Météo-France sont sur une grille fixe de 6 minutes. date_bin conserve le type
+        # de "timestamp" (avec ou sans fuseau) : le résultat ne dépend pas du fuseau de la session
+        return (f'{station_alias}."date" = date_bin(INTERVAL \'{MF_TIME_STEP_SECONDS} seconds\', '
+                f'{point_alias}."timestamp", \'2000-01-01 00:00:00+00\')')
+    if join_mode == "range":
+        return (f'{station_alias}."date" > ({point_alias}."timestamp" - INTERVAL \'6 Minutes\') '
+                f'AND {station_alias}."date" <= {point_alias}."timestamp"')
+    raise ValueError(f"join_mode invalide: {join_mode} (attendu: 'snapped' ou 'range')")
+
+
+def lookup_station_slots(station_ids, station_epochs, query_stations, query_epochs):
+    """
+    Recherche en mémoire du relevé Météo-France associé à chaque point (tri + searchsorted)
+
+    Équivalent NumPy de la jointure par intervalle de 6 minutes, en O(n log m).
+
+    Args:
+        station_ids: tableau (m,) des numéros de station des relevés
+        station_epochs: tableau (m,) des dates des relevés en secondes depuis l'epoch
+        query_stations: tableau (n,) des numéros de station recherchés
+        query_epochs: tableau (n,) des timestamps des points en secondes depuis l'epoch
+
+    Returns:
+        np.ndarray: tableau (n,) des indices des relevés dans les tableaux d'entrée, -1 si absent
+    """
+    # Clé composite station + date : les numéros INSEE (8 chiffres) et les epochs tiennent dans un int64
+    scale = np.int64(10 ** 10)
+    station_keys = np.asarray(station_ids, dtype=np.int64) * scale + np.asarray(station_epochs, dtype=np.int64)
+    query_keys = np.asarray(query_stations, dtype=np.int64) * scale + np.floor(query_epochs).astype(np.int64)
+
+    order = np.argsort(station_keys, kind="stable")
+    sorted_keys = station_keys[order]
+
+    # Dernier relevé <= timestamp
+    position = np.searchsorted(sorted_keys, query_keys, side="right") - 1
+    found = position >= 0
+    position[~found] = 0
+
+    # Le relevé doit appartenir à la même station et être dans les 6 minutes précédentes
+    found &= (query_keys - sorted_keys[position]) < MF_TIME_STEP_SECONDS
+    found &= sorted_keys[position] // scale == query_keys // scale
+
+    return np.where(found, order[position], -1)
+
+
+def barycentric_weights(x, y, vx, vy):
+    """
+    Calcule les poids barycentriques de points dans leurs triangles
+
+    Args:
+        x: tableau (n,) des abscisses des points
+        y: tableau (n,) des ordonnées des points
+        vx: tableau (n, 3) des abscisses des sommets du triangle de chaque point
+        vy: tableau (n, 3) des ordonnées des sommets du triangle de chaque point
+
+    Returns:
+        np.ndarray: tableau (n, 3) des poids w1, w2, w3 (leur somme vaut 1)
+    """
+    x1, x2, x3 = vx[:, 0], vx[:, 1], vx[:, 2]
+    y1, y2, y3 = vy[:, 0], vy[:, 1], vy[:, 2]
+
+    det = (y2 - y3) * (x1 - x3) + (x3 - x2) * (y1 - y3)
+    w1 = ((y2 - y3) * (x - x3) + (x3 - x2) * (y - y3)) / det
+    w2 = ((y3 - y1) * (x - x3) + (x1 - x3) * (y - y3)) / det
+    w3 = 1.0 - w1 - w2
+
+    return np.column_stack([w1, w2, w3])
+
+
+def interpolate_t_inter(weights, t_ground_0, delta_t, time_interp_weight, elevation):
+    """
+    Interpole la température Météo-France pour chaque point
+
+    Même formule que la version SQL :
+    t_inter = z(t_ground_0) + z(delta_t) * time_interp_weight - 0.0065 * elevation
+    où z() est l'interpolation linéaire sur le plan du triangle.
+
+    Args:
+        weights: tableau (n, 3) des poids barycentriques
+        t_ground_0: tableau (n, 3) de t_ground_0 aux 3 stations
+        delta_t: tableau (n, 3) de delta_t aux 3 stations
+        time_interp_weight: tableau (n,) position du point dans le pas de 6 minutes
+        elevation: tableau (n,) altitude du point
+
+    Returns:
+        np.ndarray: tableau (n,) des températures interpolées
+    """
+    return ((weights * t_ground_0).sum(axis=1)
+            + (weights * delta_t).sum(axis=1) * time_interp_weight
+            - LAPSE_RATE * elevation)
+
+
+def select_complete_triangles(ids, id_triangles):
+    """
+    Retourne l'indice de la première ligne de chaque couple (id, id_triangle) complet
+
+    Les lignes doivent être triées par id, id_triangle, id_pt.
+    Un couple est complet lorsque les 3 stations ont une donnée sur le pas de temps.
+    Comme le DISTINCT ON (id) de la version SQL, un seul triangle est conservé par point.
+    """
+    n = len(ids)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = (ids[1:] != ids[:-1]) | (id_triangles[1:] != id_triangles[:-1])
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, n))
+    complete = starts[counts == 3]
+
+    # Un seul triangle par point
+    first = np.ones(len(complete), dtype=bool)
+    first[1:] = ids[complete[1:]] != ids[complete[:-1]]
+    return complete[first]
+
+
+def fetch_triangle_samples(conn, source_table, join_mode="snapped", chunk_filter="TRUE", params=None):
+    """
+    Lit en une seule requête les sommets du triangle et les données des stations pour chaque point
+
+    Args:
+        conn: connexion SQLAlchemy
+        source_table: table des points capteurs (id, the_geom, "timestamp", elevation)
+        join_mode: mode de jointure avec weather_data_stations_mf ("snapped" ou "range")
+        chunk_filter: condition SQL sur l'alias "a" de source_table pour ne lire qu'un lot de points
+        params: paramètres liés utilisés par chunk_filter
+
+    Returns:
+        np.ndarray: tableau (n, 11) trié par id, id_triangle, id_pt avec les colonnes
+        id, id_triangle, id_pt, x, y, vx, vy, elevation, t_ground_0, delta_t, time_interp_weight
+    """
+    query = f"""
+            SELECT a.id, b.id_triangle, pts.id_pt,
+                   ST_X(a.the_geom) AS x, ST_Y(a.the_geom) AS y,
+                   ST_X(pts.the_geom) AS vx, ST_Y(pts.the_geom) AS vy,
+                   a.elevation::float8,
+                   d.t_ground_0::float8,
+                   d.delta_t::float8,
+                   (EXTRACT(EPOCH FROM (a."timestamp" - d."date"))/{MF_TIME_STEP_SECONDS})::float8 AS time_interp_weight
+            FROM {source_table} AS a
+            JOIN veloclimat.weather_stations_mf_delaunay AS b ON ST_Intersects(a.the_geom, b.the_geom)
+            -- Le 4ème point de l'anneau ferme le triangle : il duplique le 1er
+            JOIN veloclimat.weather_stations_mf_delaunay_pts AS pts
+                ON pts.id_triangle = b.id_triangle AND pts.id_pt <= 3
+            JOIN veloclimat.weather_data_stations_mf AS d
+                ON d.numer_sta = pts.numer_insee AND {station_time_condition("d", "a", join_mode)}
+            WHERE {chunk_filter}
+            ORDER BY a.id, b.id_triangle, pts.id_pt
+            """
+    rows = conn.execute(text(query), params or {}).fetchall()
+    return np.array(rows, dtype=np.float64).reshape(-1, 11)
+
+
+def compute_t_inter(samples):
+    """
+    Calcule t_inter à partir des échantillons lus par fetch_triangle_samples
+
+    Args:
+        samples: tableau (n, 11) retourné par fetch_triangle_samples
+
+    Returns:
+        Tuple (ids, id_triangles, t_inter) de tableaux (m,)
+    """
+    first = select_complete_triangles(samples[:, 0], samples[:, 1])
+    rows = first[:, None] + np.arange(3)
+
+    weights = barycentric_weights(samples[first, 3], samples[first, 4],
+                                  samples[rows, 5], samples[rows, 6])
+    t_inter = interpolate_t_inter(weights,
+                                  samples[rows, 8],
+                                  samples[rows, 9],
+                                  samples[first, 10],
+                                  samples[first, 7])
+
+    return samples[first, 0].astype(np.int64), samples[first, 1].astype(np.int64), t_inter
+
+
+def _weights_relation(source_table, join_mode, chunk_filter, weights_table=WEIGHTS_TABLE):
+    """
+    Sous-requête (id, id_triangle, t_inter) : jointure avec la table des poids et somme pondérée
+
+    Les poids sont préparés par prepare_weather_stations_delaunay.prepare_barycentric_weights.
+    """
+    return f"""
+            SELECT a.id, w.id_triangle,
+                   w.w1 * d1.t_ground_0 + w.w2 * d2.t_ground_0 + w.w3 * d3.t_ground_0
+                   + (w.w1 * d1.delta_t + w.w2 * d2.delta_t + w.w3 * d3.delta_t)
+                     * EXTRACT(EPOCH FROM (a."timestamp" - d1."date"))/{MF_TIME_STEP_SECONDS}
+                   - {LAPSE_RATE} * a.elevation AS t_inter
+            FROM {source_table} AS a
+            JOIN {weights_table} AS w ON w.source_table = :source_table AND w.id = a.id
+            JOIN veloclimat.weather_data_stations_mf AS d1
+                ON d1.numer_sta = w.station1 AND {station_time_condition("d1", "a", join_mode)}
+            JOIN veloclimat.weather_data_stations_mf AS d2
+                ON d2.numer_sta = w.station2 AND d2."date" = d1."date"
+            JOIN veloclimat.weather_data_stations_mf AS d3
+                ON d3.numer_sta = w.station3 AND d3."date" = d1."date"
+            WHERE {chunk_filter}
+            """
+
+
+def _polygon_relation(source_table, join_mode, chunk_filter):
+    """
+    Sous-requête (id, id_triangle, t_inter) : méthode de référence PostGIS
+
+    Deux polygones 3D (t_ground_0 et delta_t) sont construits par point et la valeur interpolée
+    est lue avec ST_Z(ST_Intersection(...)).
+    """
+    return f"""
+            WITH stations_data AS (
+                SELECT a.id, pts.id_triangle, pts.id_pt, pts.the_geom AS geom_pt_triangle,
+                       d.t_ground_0, d.delta_t,
+                       EXTRACT(EPOCH FROM (a."timestamp" - d."date"))/{MF_TIME_STEP_SECONDS} AS time_interp_weight
+                FROM {source_table} AS a
+                JOIN veloclimat.weather_stations_mf_delaunay AS b ON ST_Intersects(a.the_geom, b.the_geom)
+                JOIN veloclimat.weather_stations_mf_delaunay_pts AS pts ON pts.id_triangle = b.id_triangle
+                JOIN veloclimat.weather_data_stations_mf AS d
+                    ON d.numer_sta = pts.numer_insee AND {station_time_condition("d", "a", join_mode)}
+                WHERE {chunk_filter}
+            ),
+            triangles AS (
+                SELECT id, id_triangle,
+                       st_setsrid(ST_MakePolygon(ST_MakeLine(ARRAY_AGG(
+                           ST_MakePoint(ST_X(geom_pt_triangle), ST_Y(geom_pt_triangle), t_ground_0)
+                           ORDER BY id_pt DESC))), 4326) AS polygon_t_ground_0,
+                       st_setsrid(ST_MakePolygon(ST_MakeLine(ARRAY_AGG(
+                           ST_MakePoint(ST_X(geom_pt_triangle), ST_Y(geom_pt_triangle), delta_t)
+                           ORDER BY id_pt DESC))), 4326) AS polygon_delta_t,
+                       MAX(time_interp_weight) AS time_interp_weight
+                FROM stations_data
+                GROUP BY id_triangle, id
+                -- Anneau fermé : les 3 stations + le point de fermeture
+                HAVING COUNT(*) = 4
+            )
+            SELECT DISTINCT ON (t.id) t.id, t.id_triangle,
+                   st_z(st_intersection(t.polygon_t_ground_0, a.the_geom))
+                   + st_z(st_intersection(t.polygon_delta_t, a.the_geom)) * t.time_interp_weight
+                   - {LAPSE_RATE} * a.elevation AS t_inter
+            FROM triangles AS t
+            JOIN {source_table} AS a ON a.id = t.id
+            ORDER BY t.id, t.id_triangle
+            """
+
+
+def _write_t_inter(conn, ids, id_triangles, t_inter):
+    """
+    Charge les t_inter d'un lot dans une table temporaire
+
+    Returns:
+        str: sous-requête (id, id_triangle, t_inter) sur la table temporaire
+    """
+    conn.execute(text("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS interpolation_t_inter
+                (id integer, id_triangle integer, t_inter double precision)
+                ON COMMIT DELETE ROWS
+            """))
+    if len(ids):
+        copy_to_table(conn, "interpolation_t_inter",
+                      {"id": ids, "id_triangle": id_triangles, "t_inter": t_inter})
+    return "SELECT id, id_triangle, t_inter FROM interpolation_t_inter"
+
+
+def _numpy_relation(conn, source_table, join_mode, chunk_filter, params):
+    """
+    Calcule t_inter avec NumPy pour un lot et le charge dans une table temporaire
+
+    Returns:
+        str: sous-requête (id, id_triangle, t_inter) sur la table temporaire
+    """
+    samples = fetch_triangle_samples(conn, source_table, join_mode, chunk_filter, params)
+    ids, id_triangles, t_inter = compute_t_inter(samples)
+    return _write_t_inter(conn, ids, id_triangles, t_inter)
+
+
+def compute_t_inter_cached(points, triangulation, series):
+    """
+    Calcule t_inter à partir de la triangulation et des séries Météo-France en mémoire
+
+    Le triangle est trouvé avec find_simplex et le relevé de chaque station avec lookup_station_slots
+    (dernier relevé des 6 minutes précédentes, identique à la jointure "snapped" sur la grille de 6 minutes).
+    Les 3 stations doivent avoir un relevé à la même date.
+
+    Args:
+        points: tableau (n, 5) des colonnes id, x, y, timestamp (secondes depuis l'epoch), elevation
+        triangulation: tuple (delaunay, station_ids) retourné par station_cache.load_triangulation
+        series: dict retourné par station_cache.load_station_series
+
+    Returns:
+        Tuple (ids, id_triangles, t_inter) de tableaux (m,)
+    """
+    id_triangles, stations, weights = locate_points(*triangulation, points[:, 1], points[:, 2])
+    epochs = points[:, 3]
+
+    # Relevé de la première station, puis relevés des deux autres à la même date
+    slots = np.full(stations.shape, -1, dtype=np.int64)
+    slots[:, 0] = lookup_station_slots(series["station_ids"], series["epochs"], stations[:, 0], epochs)
+    date = np.where(slots[:, 0] >= 0, series["epochs"][slots[:, 0]], 0)
+    for vertex in (1, 2):
+        slots[:, vertex] = lookup_station_slots(series["station_ids"], series["epochs"], stations[:, vertex], date)
+        slots[series["epochs"][slots[:, vertex]] != date, vertex] = -1
+
+    found = (id_triangles >= 0) & (slots >= 0).all(axis=1)
+    slots = slots[found]
+    t_inter = interpolate_t_inter(weights[found],
+                                  series["t_ground_0"][slots],
+                                  series["delta_t"][slots],
+                                  (epochs[found] - date[found]) / MF_TIME_STEP_SECONDS,
+                                  points[found, 4])
+
+    return points[found, 0].astype(np.int64), id_triangles[found], t_inter
+
+
+def _scipy_relation(conn, source_table, chunk_filter, params, station_data):
+    """
+    Calcule t_inter d'un lot avec la triangulation et les séries en cache, et le charge dans une table temporaire
+
+    Returns:
+        str: sous-requête (id, id_triangle, t_inter) sur la table temporaire
+    """
+    rows = conn.execute(text(f"""
+            SELECT a.id, ST_X(a.the_geom), ST_Y(a.the_geom), EXTRACT(EPOCH FROM a."timestamp")::float8,
+                   a.elevation::float8
+            FROM {source_table} AS a
+            WHERE {chunk_filter}
+            """), params).fetchall()
+    points = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    ids, id_triangles, t_inter = compute_t_inter_cached(points, *station_data)
+    return _write_t_inter(conn, ids, id_triangles, t_inter)
+
+
+def _list_chunks(conn, source_table, chunk_by, chunk_size, time_window, done=frozenset()):
+    """
+    Découpe la table source en lots
+
+    Les clés déjà traitées (done) sont retirées avant le découpage : un lot ne contient que des
+    clés à traiter, même si les lots sont découpés autrement qu'au premier passage (nouvelles traces).
+    Les points sans trace (unique_id_track NULL) forment un lot à part, de clé NULL_TRACK_KEY.
+    Les fenêtres de temps sont alignées sur des multiples de time_window depuis l'epoch : leurs clés
+    ne dépendent pas du premier "timestamp" de la table.
+
+    Args:
+        done: clés (texte) déjà enregistrées dans PROGRESS_TABLE
+
+    Returns:
+        list: liste de tuples (clés du lot, condition SQL sur l'alias "a", paramètres liés)
+    """
+    if chunk_by == "unique_id_track":
+        tracks = conn.execute(text(f"""
+                SELECT DISTINCT unique_id_track FROM {source_table} ORDER BY 1 NULLS LAST
+                """)).scalars().all()
+        has_null_track = bool(tracks) and tracks[-1] is None and NULL_TRACK_KEY not in done
+        tracks = [track for track in tracks if track is not None and str(track) not in done]
+        chunks = [(tracks[i:i + chunk_size],
+                   "a.unique_id_track = ANY(:chunk_keys)",
+                   {"chunk_keys": tracks[i:i + chunk_size]})
+                  for i in range(0, len(tracks), chunk_size)]
+        if has_null_track:
+            chunks.append(([NULL_TRACK_KEY], "a.unique_id_track IS NULL", {}))
+        return chunks
+
+    if chunk_by == "id_triangle":
+        # Chaque point n'a qu'un triangle dans la table des poids : les lots sont disjoints
+        triangles = conn.execute(text(f"""
+                SELECT DISTINCT id_triangle FROM {WEIGHTS_TABLE}
+                WHERE source_table = :source_table ORDER BY 1
+                """), {"source_table": source_table}).scalars().all()
+        triangles = [triangle for triangle in triangles if str(triangle) not in done]
+        return [([str(t) for t in triangles[i:i + chunk_size]],
+                 f"""a.id IN (SELECT w.id FROM {WEIGHTS_TABLE} AS w
+                              WHERE w.source_table = :source_table AND w.id_triangle = ANY(:chunk_triangles))""",
+                 {"chunk_triangles": triangles[i:i + chunk_size]})
+                for i in range(0, len(triangles), chunk_size)]
+
+    if chunk_by == "timestamp":
+        start, end = conn.execute(text(f'SELECT MIN("timestamp"), MAX("timestamp") FROM {source_table}')).one()
+        chunks = []
+        if start is None:
+            return chunks
+
+        # Début de la fenêtre contenant le premier "timestamp", sur une grille fixe depuis l'epoch (UTC).
+        # Une colonne "timestamp without time zone" donne des dates naïves : elles sont lues comme UTC
+        # (indépendamment du fuseau de la machine) et les bornes restent naïves, du type de la colonne.
+        naive = start.tzinfo is None
+        epoch = (start.replace(tzinfo=timezone.utc) if naive else start).timestamp()
+        window_seconds = time_window.total_seconds()
+        start = datetime.fromtimestamp(epoch // window_seconds * window_seconds, tz=timezone.utc)
+        if naive:
+            start = start.replace(tzinfo=None)
+        while start <= end:
+            key = start.isoformat()
+            if key not in done:
+                chunks.append(([key],
+                               'a."timestamp" >= :chunk_start AND a."timestamp" < :chunk_end',
+                               {"chunk_start": start, "chunk_end": start + time_window}))
+            start += time_window
+        return chunks
+
+    raise ValueError(f"chunk_by invalide: {chunk_by} (attendu: 'unique_id_track', 'id_triangle' ou 'timestamp')")
+
+
+def _process_chunk(conn, source_table, target_table, select_output, method, join_mode,
+                   output_table, chunking, keys, chunk_filter, params, staged, station_data=None):
+    """
+    Interpole un lot de points, l'ajoute à target_table et enregistre ses clés dans PROGRESS_TABLE
+
+    Le lot et son suivi sont validés dans la même transaction.
+
+    Returns:
+        int: nombre de points interpolés
+    """
+    params = {**params, "source_table": source_table}
+
+    if method == "weights":
+        relation = _weights_relation(source_table, join_mode, chunk_filter)
+    elif method == "numpy":
+        relation = _numpy_relation(conn, source_table, join_mode, chunk_filter, params)
+    elif method == "scipy":
+        relation = _scipy_relation(conn, source_table, chunk_filter, params, station_data)
+    else:
+        relation = _polygon_relation(source_table, join_mode, chunk_filter)
+
+    nb_points = conn.execute(text(f"""
+            INSERT INTO {target_table}
+            {select_output}
+            FROM ({relation}) AS i
+            JOIN {source_table} AS a ON a.id = i.id
+            """), params).rowcount
+    conn.execute(text(f"""
+            INSERT INTO {PROGRESS_TABLE} (output_table, chunk_key, staged, chunk_by)
+            SELECT :output_table, unnest(CAST(:chunk_keys AS TEXT[])), :staged, :chunk_by
+            ON CONFLICT DO NOTHING
+            """), {"output_table": output_table, "chunk_keys": list(keys), "staged": staged, "chunk_by": chunking})
+    conn.commit()
+    return nb_points
+
+
+def _run_chunk_worker(engine, number, *args):
+    """
+    Traite un lot sur sa propre connexion du pool
+
+    Returns:
+        Tuple (numéro du lot, nombre de points, durée en secondes)
+    """
+    chunk_start = time.perf_counter()
+    with engine.connect() as worker_conn:
+        nb_points = _process_chunk(worker_conn, *args)
+    return number, nb_points, time.perf_counter() - chunk_start
+
+
+def interpolate(conn, source_table, output_table, columns, method="weights", join_mode="snapped",
+                chunk_by="unique_id_track", chunk_size=100, time_window=timedelta(hours=6), resume=False,
+                workers=1, refresh_cache=False):
+    """
+    Interpole la température Météo-France pour chaque point d'une table capteurs, par lots
+
+    Input:
+    - source_table: données capteurs nettoyées (id, the_geom, "timestamp", temperature, elevation, unique_id_track)
+    - Triangulated weather stations (veloclimat.weather_stations_mf_delaunay)
+    - Points of the Delaunay triangles with station IDs (veloclimat.weather_stations_mf_delaunay_pts)
+    - weather data stations (veloclimat.weather_data_stations_mf)
+
+    Output:
+    - output_table: id, "timestamp", temperature, t_inter, diff_temperature, the_geom, id_triangle
+      et les colonnes demandées de source_table
+
+    Les points sont traités par lots de traces (unique_id_track), de triangles de Delaunay (id_triangle)
+    ou par fenêtre de temps. Chaque lot est validé indépendamment (COMMIT) et enregistré dans
+    PROGRESS_TABLE : avec resume=True, un traitement interrompu reprend au premier lot non terminé.
+    Les clés dépendent du découpage (chunk_by et time_window) : il est enregistré avec les clés
+    et une reprise avec un autre découpage est refusée.
+
+    Avec workers > 1, les lots sont répartis sur un pool de threads, chacun avec sa propre connexion.
+    Ils sont écrits dans une table de travail UNLOGGED ({output_table}_staging) fusionnée dans
+    output_table à la fin.
+
+    Args:
+        conn: connexion SQLAlchemy
+        source_table: table source (ex: 'veloclimat.labsticc_sensors_preprocess')
+        output_table: table de sortie
+        columns: liste des colonnes supplémentaires à conserver depuis source_table
+        method: "weights" (somme pondérée avec la table des poids barycentriques),
+                "numpy" (interpolation barycentrique en lot), "scipy" (triangulation et séries Météo-France
+                en mémoire, voir station_cache) ou "sql" (polygones 3D PostGIS, méthode de référence)
+        join_mode: mode de jointure avec weather_data_stations_mf ("snapped" ou "range")
+        chunk_by: "unique_id_track" (lots de traces), "id_triangle" (lots de triangles, nécessite
+                  la table des poids) ou "timestamp" (fenêtres de temps)
+        chunk_size: nombre de traces ou de triangles par lot
+        time_window: durée d'une fenêtre de temps (chunk_by="timestamp")
+        resume: reprend un traitement interrompu au lieu de recréer output_table
+        workers: nombre de lots traités en parallèle
+        refresh_cache: relit les séries Météo-France au lieu du cache sur disque (method="scipy")
+    """
+    if method not in METHODS:
+        raise ValueError(f"method invalide: {method} (attendu: {', '.join(METHODS)})")
+
+    print(f"\n📊 Interpolation de {source_table} vers {output_table} (méthode {method}, {workers} worker(s))...")
+    start = time.perf_counter()
+
+    staging_table = f"{output_table}_staging"
+    extra_columns = "".join(f", a.{col}" for col in columns)
+    select_output = f"""
+            SELECT a.id, a."timestamp", a.temperature, i.t_inter,
+                   a.temperature - i.t_inter AS diff_temperature,
+                   a.the_geom, i.id_triangle{extra_columns}
+            """
+
+    # Verrou tenu jusqu'au COMMIT : plusieurs interpolations peuvent démarrer en même temps
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"), {"table_name": PROGRESS_TABLE})
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+                output_table TEXT NOT NULL,
+                chunk_key TEXT NOT NULL,
+                -- TRUE tant que le lot est dans la table de travail et pas encore fusionné
+                staged BOOLEAN NOT NULL DEFAULT FALSE,
+                done_at TIMESTAMPTZ DEFAULT now(),
+                -- Découpage des lots (chunk_by, et durée des fenêtres de temps)
+                chunk_by TEXT,
+                PRIMARY KEY (output_table, chunk_key)
+            );
+
+            ALTER TABLE {PROGRESS_TABLE} ADD COLUMN IF NOT EXISTS chunk_by TEXT;
+            """))
+    if not resume:
+        conn.execute(text(f"""
+                DELETE FROM {PROGRESS_TABLE} WHERE output_table = :output_table;
+                DROP TABLE IF EXISTS {output_table}, {staging_table};
+                """), {"output_table": output_table})
+
+    # Table de sortie vide : les lots y sont ajoutés un par un
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {output_table} AS
+            {select_output}
+            FROM {source_table} AS a,
+                 (SELECT NULL::integer AS id_triangle, NULL::double precision AS t_inter) AS i
+            WITH NO DATA;
+
+            CREATE UNLOGGED TABLE IF NOT EXISTS {staging_table} (LIKE {output_table});
+            """))
+
+    # Une table UNLOGGED est vidée après un arrêt brutal du serveur :
+    # ses lots doivent alors être recalculés
+    if not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {staging_table})")).scalar():
+        conn.execute(text(f"DELETE FROM {PROGRESS_TABLE} WHERE output_table = :output_table AND staged"),
+                     {"output_table": output_table})
+    conn.commit()
+
+    # Les clés d'un autre découpage ne correspondent pas aux lots : ils seraient recalculés en double
+    chunking = f"timestamp/{int(time_window.total_seconds())}s" if chunk_by == "timestamp" else chunk_by
+    other_chunking = conn.execute(text(f"""
+            SELECT chunk_by FROM {PROGRESS_TABLE}
+            WHERE output_table = :output_table AND chunk_by IS DISTINCT FROM :chunk_by
+            LIMIT 1
+            """), {"output_table": output_table, "chunk_by": chunking}).first()
+    if other_chunking is not None:
+        conn.rollback()
+        raise ValueError(f"{output_table} a été découpé par {other_chunking[0]} et non par {chunking} : "
+                         f"reprenez avec le même découpage ou relancez sans resume")
+
+    done = set(conn.execute(text(f"SELECT chunk_key FROM {PROGRESS_TABLE} WHERE output_table = :output_table"),
+                            {"output_table": output_table}).scalars().all())
+    chunks = _list_chunks(conn, source_table, chunk_by, chunk_size, time_window, done)
+    print(f"   {len(chunks)} lots à traiter ({len(done)} clés déjà traitées)")
+
+    # Triangulation et séries Météo-France lues une seule fois (cache sur disque), partagées par les lots
+    station_data = ((load_triangulation(conn), load_station_series(conn, refresh=refresh_cache))
+                    if method == "scipy" and chunks else None)
+    conn.commit()
+
+    durations = []
+    if workers <= 1:
+        for number, (keys, chunk_filter, params) in enumerate(chunks, start=1):
+            chunk_start = time.perf_counter()
+            nb_points = _process_chunk(conn, source_table, output_table, select_output, method, join_mode,
+                                       output_table, chunking, keys, chunk_filter, params, False, station_data)
+            durations.append(time.perf_counter() - chunk_start)
+            print(f"   Lot {number}/{len(chunks)}: {nb_points} points en {durations[-1]:.1f}s")
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_chunk_worker, conn.engine, number,
+                                       source_table, staging_table, select_output, method, join_mode,
+                                       output_table, chunking, keys, chunk_filter, params, True, station_data)
+                       for number, (keys, chunk_filter, params) in enumerate(chunks, start=1)]
+            for future in as_completed(futures):
+                number, nb_points, duration = future.result()
+                durations.append(duration)
+                print(f"   Lot {number}/{len(chunks)}: {nb_points} points en {duration:.1f}s")
+
+    # Fusion de la table de travail dans la table de sortie
+    conn.execute(text(f"""
+            INSERT INTO {output_table} SELECT * FROM {staging_table};
+            UPDATE {PROGRESS_TABLE} SET staged = FALSE WHERE output_table = :output_table AND staged;
+            DROP TABLE {staging_table};
+            """), {"output_table": output_table})
+    conn.commit()
+
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {output_table.split('.')[-1]}_id_idx ON {output_table}(id)"))
+    conn.commit()
+
+    if durations:
+        print(f"   Durée par lot: min {min(durations):.1f}s, moyenne {sum(durations) / len(durations):.1f}s, "
+              f"max {max(durations):.1f}s")
+    print(f"✅ Table {output_table} créée en {time.perf_counter() - start:.1f}s")
+
+
+def compare_t_inter(conn, reference_table, candidate_table, tolerance=1e-6):
+    """
+    Compare les t_inter de deux tables d'interpolation (ex: version SQL et version NumPy)
+
+    Args:
+        conn: connexion SQLAlchemy
+        reference_table: table produite par la méthode de référence
+        candidate_table: table à valider
+        tolerance: écart absolu maximum accepté
+
+    Returns:
+        bool: True si les deux tables ont les mêmes points et des t_inter égaux à la tolérance près
+    """
+    row = conn.execute(text(f"""
+            SELECT
+                (SELECT COUNT(*) FROM {reference_table}) AS nb_reference,
+                (SELECT COUNT(*) FROM {candidate_table}) AS nb_candidate,
+                COUNT(*) AS nb_common,
+                MAX(ABS(a.t_inter - b.t_inter)) AS max_diff
+            FROM {reference_table} AS a
+            JOIN {candidate_table} AS b ON a.id = b.id
+            """)).mappings().fetchone()
+
+    max_diff = row['max_diff'] if row['max_diff'] is not None else 0.0
+    print(f"   Points: référence={row['nb_reference']}, candidat={row['nb_candidate']}, communs={row['nb_common']}")
+    print(f"   Écart maximum de t_inter: {max_diff:.3e}")
+
+    return (row['nb_reference'] == row['nb_candidate'] == row['nb_common']
+            and max_diff <= tolerance)
@@ -1,7 +1,108 @@
+import argparse
+import json
+
 from sqlalchemy import text
 
+from process.lcz_raster import DEFAULT_STRIPS, compare_lcz_fractions, join_fractions, lcz_fraction_raster
 from process.utils import create_engine_from_config
 
+# Nombre maximal de sommets des polygones de la couche LCZ préparée
+LCZ_MAX_VERTICES = 64
+
+# Valeurs de lcz_primary et groupes de classes LCZ
+LCZ_CLASSES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 101, 102, 103, 104, 105, 106, 107]
+LCZ_GROUPS = {
+    "urban": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 105],
+    "vegetation": [101, 102, 103, 104],
+    "bare": [106],
+    "water": [107],
+}
+
+# Colonnes de fractions de la table de sortie : {nom de la colonne: classes LCZ sommées}
+LCZ_CLASS_MAP = {
+    **{f"lcz_{lcz}": [lcz] for lcz in LCZ_CLASSES},
+    **{f"lcz_{group}": members for group, members in LCZ_GROUPS.items()},
+}
+
+# Fractions LCZ calculées par main() autour des points interpolés
+LCZ_TARGETS = [
+    {
+        "source_table": "veloclimat.labsticc_sensors_temperature_interpolate",
+        "output_table": "veloclimat.labsticc_sensors_temperature_lcz",
+        "lcz_table": "veloclimat.rsu_lcz",
+        "columns": ["temperature", "t_inter", "timestamp", "diff_temperature", "elevation", "speed_m_s",
+                    "unique_id_track", "thermo_name", "sensor_name"],
+        "buffer_size": 100,
+    },
+    {
+        "source_table": "veloclimat.veloclimatmeter_temperature_interpolate",
+        "output_table": "veloclimat.veloclimatmeter_temperature_lcz",
+        "lcz_table": "veloclimat.rsu_lcz",
+        "columns": ["temperature", "t_inter", "timestamp", "diff_temperature", "temperature_bot",
+                    "temperature_top", "elevation", "speed_m_s", "unique_id_track", "thermo_name", "sensor_name"],
+        "buffer_size": 100,
+    },
+]
+
+
+def prepare_lcz_layer(conn, lcz_table, max_vertices=LCZ_MAX_VERTICES):
+    """
+    Prépare la couche LCZ projetée en 3857 et découpée en petits polygones ({lcz_table}_3857)
+
+    La couche est persistante, avec un index GIST : elle n'est recalculée que lorsque le contenu
+    de lcz_table change (empreinte stockée en commentaire de la table).
+
+    Args:
+        conn: connexion SQLAlchemy
+        lcz_table: table des polygones LCZ (the_geom, lcz_primary)
+        max_vertices: nombre maximal de sommets par polygone découpé (ST_Subdivide)
+
+    Returns:
+        str: nom de la couche LCZ préparée
+    """
+    layer = f"{lcz_table}_3857"
+
+    # Verrou tenu jusqu'au COMMIT : plusieurs calculs peuvent préparer la même couche
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:layer))"), {"layer": layer})
+
+    fingerprint = conn.execute(text(f"""
+            SELECT COUNT(*) || ':' || COALESCE(SUM(hashtext(t::text)::bigint), 0) || ':' || {max_vertices}
+            FROM {lcz_table} AS t
+            """)).scalar()
+    stored = conn.execute(text("SELECT obj_description(to_regclass(:layer), 'pg_class')"),
+                          {"layer": layer}).scalar()
+
+    if stored != fingerprint:
+        print(f"\n📊 Préparation de la couche LCZ {layer}...")
+        conn.execute(text(f"""
+                DROP TABLE IF EXISTS {layer};
+
+                CREATE TABLE {layer} AS
+                SELECT lcz_primary, ST_Subdivide(ST_Transform(the_geom, 3857), {max_vertices}) AS the_geom
+                FROM {lcz_table};
+
+                CREATE INDEX ON {layer} USING GIST (the_geom);
+                ANALYZE {layer};
+
+                COMMENT ON TABLE {layer} IS '{fingerprint}';
+                """))
+    conn.commit()
+    return layer
+
+
+def lcz_column_suffix(radius, radii, output_format="wide"):
+    """
+    Suffixe des colonnes de fractions LCZ d'un rayon (ex: lcz_1_200)
+
+    Les noms de colonnes ne sont suffixés que pour une table large avec plusieurs rayons.
+    """
+    return f"_{radius}" if output_format == "wide" and len(radii) > 1 else ""
+
+
+def _fraction_columns(class_map=LCZ_CLASS_MAP):
+    return ["lcz_primary_max", "lcz_primary_max_2"] + list(class_map)
+
+
 def lcz_fraction(
         conn,
         source_table,
@@ -9,7 +110,13 @@ def lcz_fraction(
         lcz_table,
         columns,
         buffer_size=100,
-        delete_source=False
+        delete_source=False,
+        location_precision=1,
+        method="polygon",
+        resolution=5,
+        nb_strips=DEFAULT_STRIPS,
+        output_format="wide",
+        class_map=None
 ):
     """
     This script is used to compute LCZ fractions around sensor locations based on a buffer.
@@ -22,6 +129,22 @@ def lcz_fraction(
     Output:
     - output_table: LCZ fractions for each sensor location with geometry preserved
 
+    The LCZ polygons are read from a persistent 3857 subdivided copy of lcz_table (prepare_lcz_layer).
+    The point locations are snapped to a grid of location_precision meters and the fractions are
+    computed once per distinct location, then joined back to the points with the requested columns.
+
+    buffer_size can be a list of radii: the candidate LCZ polygons are selected once with the largest
+    radius and reused for the smaller buffers. The output is either wide (one column per class and radius,
+    e.g. lcz_1_100, lcz_1_200) or long (one row per point and radius, with a buffer_size column).
+
+    The fractions of each location are aggregated once into two arrays (LCZ classes sorted by decreasing
+    fraction, and their fractions). The fraction columns are then read from these arrays with class_map,
+    which maps each output column to the LCZ classes it sums (default: LCZ_CLASS_MAP).
+
+    With method="raster", the LCZ layer is rasterized once at the given resolution and the fractions are
+    read from per-class integral images (lcz_raster.lcz_fraction_raster). The buffer disc is approximated
+    by nb_strips rectangles, use compare_lcz_fractions to measure the error against the polygon method.
+
     Args:
         conn: connexion SQLAlchemy
         source_table: Table name containing sensor data (REQUIRED)
@@ -29,8 +152,14 @@ def lcz_fraction(
         lcz_table: LCZ polygons table name (REQUIRED)
         columns: List of columns to keep from source_table (id and the_geom are always included) (REQUIRED)
                  Example: ["temperature", "t_inter", "timestamp"]
-        buffer_size: Buffer size in meters (default: 100)
+        buffer_size: Buffer size in meters, or list of buffer sizes (default: 100)
         delete_source: Delete source table after processing (default: False)
+        location_precision: Grid size in meters used to merge identical locations (default: 1)
+        method: "polygon" (exact intersections) or "raster" (LCZ grid) (default: "polygon")
+        resolution: Cell size in meters of the LCZ grid, raster method only (default: 5)
+        nb_strips: Number of rectangles approximating the buffer disc, raster method only (default: 8)
+        output_format: "wide" or "long" when several buffer sizes are given (default: "wide")
+        class_map: {column name: list of LCZ classes} of the fraction columns (default: LCZ_CLASS_MAP)
     """
     # Validation des paramètres obligatoires
     if not source_table:
@@ -49,121 +178,162 @@ def lcz_fraction(
         print("❌ Erreur : columns est obligatoire et ne peut pas être vide")
         return False
 
+    if method not in ("polygon", "raster"):
+        print(f"❌ Erreur : méthode inconnue {method} (attendu: 'polygon' ou 'raster')")
+        return False
+
+    if output_format not in ("wide", "long"):
+        print(f"❌ Erreur : format inconnu {output_format} (attendu: 'wide' ou 'long')")
+        return False
+
+    radii = sorted(set(buffer_size)) if isinstance(buffer_size, (list, tuple)) else [buffer_size]
+    class_map = class_map or LCZ_CLASS_MAP
+
     print("\n📊 Préparation des données...")
 
+    try:
+        lcz_layer = prepare_lcz_layer(conn, lcz_table)
+        if method == "raster":
+            lcz_fraction_raster(conn, source_table, output_table, lcz_layer, columns, class_map, radii,
+                                resolution, nb_strips, output_format=output_format)
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    if method == "raster":
+        if delete_source:
+            print(f"\n🗑️ Suppression de la table source: {source_table}...")
+            conn.execute(text(f"DROP TABLE IF EXISTS {source_table};"))
+            conn.commit()
+            print(f"✅ Table source supprimée avec succès !")
+        return True
+
     # Generate dynamic index names based on source table
     # Extract schema and table name
     source_parts = source_table.split('.')
     source_table_clean = source_parts[-1]  # Get table name without schema
 
-    lcz_parts = lcz_table.split('.')
-    lcz_table_clean = lcz_parts[-1]
-
-    idx_source_geom = f"idx_{source_table_clean}_geom_3857"
-    idx_lcz_geom = f"idx_{lcz_table_clean}_geom_3857"
     idx_output_point = f"idx_{source_table_clean}_lcz_fractions_point_id"
 
-    # Build the columns list
-    select_columns = ", ".join(columns)
-    select_columns_b = ", ".join([f"b.{col}" for col in columns])
-    output_columns = ", ".join([f"MAX({col}) AS {col}" for col in columns])
+    # Les fractions sont calculées par id, sans les colonnes conservées, qui sont jointes à la fin
+    fractions_table = f"{output_table}_fractions"
+    radii_values = ", ".join(f"({radius})" for radius in radii)
 
-    query = f"""
-            -- INDEX SPATIAUX (à exécuter une fois)
-            CREATE INDEX IF NOT EXISTS {idx_source_geom}
-                ON {source_table}
-                USING GIST(ST_Transform(the_geom, 3857));
+    # Colonnes de fractions lues dans les tableaux agrégés (somme des classes de chaque colonne)
+    class_columns = ",\n                         ".join(
+        " + ".join(f"COALESCE(fractions[array_position(classes, {lcz})], 0)" for lcz in members) + f" AS {column}"
+        for column, members in class_map.items())
 
-            CREATE INDEX IF NOT EXISTS {idx_lcz_geom}
-                ON {lcz_table}
-                USING GIST(ST_Transform(the_geom, 3857));
+    fraction_columns = _fraction_columns(class_map)
+    if output_format == "long":
+        output_columns = ["buffer_size"] + fraction_columns
+        select_fractions = "f.radius AS buffer_size, " + ", ".join(f"f.{column}" for column in fraction_columns)
+        join_locations = "JOIN location_fractions f ON f.x = p.x AND f.y = p.y"
+        where_fractions = ""
+    else:
+        output_columns = [f"{column}{lcz_column_suffix(radius, radii)}" for radius in radii
+                          for column in fraction_columns]
+        # Une jointure par rayon : un point sans LCZ dans un petit buffer a des fractions nulles
+        select_fractions = ",\n                ".join(
+            f"f_{radius}.{column} AS {column}{lcz_column_suffix(radius, radii)}" if column.startswith("lcz_primary")
+            else f"COALESCE(f_{radius}.{column}, 0) AS {column}{lcz_column_suffix(radius, radii)}"
+            for radius in radii for column in fraction_columns)
+        join_locations = "\n                     ".join(
+            f"LEFT JOIN location_fractions f_{radius} "
+            f"ON f_{radius}.x = p.x AND f_{radius}.y = p.y AND f_{radius}.radius = {radius}"
+            for radius in radii)
+        where_fractions = f"WHERE f_{radii[-1]}.x IS NOT NULL"
 
-            DROP TABLE IF EXISTS {output_table};
+    query = f"""
+            DROP TABLE IF EXISTS {fractions_table};
 
-            CREATE TABLE {output_table} AS
-            WITH buffers AS (
+            CREATE UNLOGGED TABLE {fractions_table} AS
+            WITH points AS (
                 SELECT
                     id,
-                    the_geom,
-                    {select_columns},
-                    ST_Buffer(ST_Transform(the_geom, 3857), {buffer_size}) AS buffer_geom
-                FROM {source_table}
+                    ST_X(location) AS x,
+                    ST_Y(location) AS y
+                FROM (
+                    SELECT id, ST_SnapToGrid(ST_Transform(the_geom, 3857), {location_precision}) AS location
+                    FROM {source_table}
+                ) AS foo
             ),
-                 lcz_3857 AS (
+                 locations AS (
+                     SELECT DISTINCT x, y FROM points
+                 ),
+                 -- Polygones LCZ candidats, sélectionnés une seule fois avec le plus grand rayon
+                 candidates AS (
                      SELECT
-                         lcz_primary,
-                         ST_Transform(the_geom, 3857) AS geom_3857
-                     FROM {lcz_table}
+                         l.x,
+                         l.y,
+                         r.lcz_primary,
+                         r.the_geom
+                     FROM locations l
+                              JOIN {lcz_layer} r
+                                   ON ST_DWithin(ST_SetSRID(ST_MakePoint(l.x, l.y), 3857), r.the_geom, {radii[-1]})
+                 ),
+                 buffers AS (
+                     SELECT
+                         l.x,
+                         l.y,
+                         radii.radius,
+                         ST_Buffer(ST_SetSRID(ST_MakePoint(l.x, l.y), 3857), radii.radius) AS buffer_geom
+                     FROM locations l
+                              CROSS JOIN (VALUES {radii_values}) AS radii(radius)
                  ),
                  lcz_intersections AS (
                      SELECT
-                         b.id AS point_id,
-                         b.the_geom,
-                         {select_columns_b},
-                         r.lcz_primary,
-                         ST_Area(ST_Intersection(b.buffer_geom, r.geom_3857)) / ST_Area(b.buffer_geom) AS lcz_fraction
-                     FROM buffers b
-                              JOIN lcz_3857 r ON ST_Intersects(b.buffer_geom, r.geom_3857)
+                         b.x,
+                         b.y,
+                         b.radius,
+                         c.lcz_primary,
+                         ST_Area(ST_Intersection(b.buffer_geom, c.the_geom)) / ST_Area(b.buffer_geom) AS lcz_fraction
+                     FROM candidates c
+                              JOIN buffers b
+                                   ON b.x = c.x AND b.y = c.y AND ST_Intersects(b.buffer_geom, c.the_geom)
                  ),
                  lcz_aggregated AS (
                      SELECT
-                         point_id,
-                         the_geom,
-                         {select_columns},
+                         x,
+                         y,
+                         radius,
                          lcz_primary,
                          SUM(lcz_fraction) AS lcz_fraction_sum
                      FROM lcz_intersections
-                     GROUP BY point_id, the_geom, {select_columns}, lcz_primary
+                     GROUP BY x, y, radius, lcz_primary
                  ),
-                 lcz_with_rank AS (
+                 -- Une seule agrégation par lieu : classes triées par fraction décroissante et leurs fractions
+                 location_arrays AS (
                      SELECT
-                         point_id,
-                         the_geom,
-                         {select_columns},
-                         lcz_primary,
-                         lcz_fraction_sum,
-                         ROW_NUMBER() OVER (PARTITION BY point_id ORDER BY lcz_fraction_sum DESC) AS rn
+                         x,
+                         y,
+                         radius,
+                         array_agg(lcz_primary ORDER BY lcz_fraction_sum DESC) AS classes,
+                         array_agg(lcz_fraction_sum ORDER BY lcz_fraction_sum DESC) AS fractions
                      FROM lcz_aggregated
+                     GROUP BY x, y, radius
+                 ),
+                 location_fractions AS (
+                     SELECT
+                         x,
+                         y,
+                         radius,
+                         classes[1] AS lcz_primary_max,
+                         classes[2] AS lcz_primary_max_2,
+                         {class_columns}
+                     FROM location_arrays
                  )
             SELECT
-                point_id AS id,
-                the_geom,
-                {output_columns},
-                MAX(CASE WHEN rn = 1 THEN lcz_primary END) AS lcz_primary_max,
-                MAX(CASE WHEN rn = 2 THEN lcz_primary END) AS lcz_primary_max_2,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 1), 0) AS lcz_1,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 2), 0) AS lcz_2,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 3), 0) AS lcz_3,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 4), 0) AS lcz_4,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 5), 0) AS lcz_5,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 6), 0) AS lcz_6,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 7), 0) AS lcz_7,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 8), 0) AS lcz_8,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 9), 0) AS lcz_9,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 10), 0) AS lcz_10,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 101), 0) AS lcz_101,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 102), 0) AS lcz_102,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 103), 0) AS lcz_103,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 104), 0) AS lcz_104,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 105), 0) AS lcz_105,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 106), 0) AS lcz_106,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 107), 0) AS lcz_107,
-                -- Create LCZ group
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary IN (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 105)), 0) AS lcz_urban,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary IN (101, 102, 103, 104)), 0) AS lcz_vegetation,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 106), 0) AS lcz_bare,
-                COALESCE(SUM(lcz_fraction_sum) FILTER (WHERE lcz_primary = 107), 0) AS lcz_water
-            FROM lcz_with_rank
-            GROUP BY point_id, the_geom;
-            
-            CREATE INDEX {idx_output_point} ON {output_table}(id);
-            
-            ANALYZE {output_table};
+                p.id,
+                {select_fractions}
+            FROM points p
+                     {join_locations}
+            {where_fractions};
             """
 
     try:
         conn.execute(text(query))
-        conn.commit()
+        join_fractions(conn, source_table, output_table, fractions_table, columns, output_columns, idx_output_point)
         print(f"✅ Fractions de LCZ calculées avec succès !")
 
         # Suppression de la table source si demandé
@@ -183,6 +353,20 @@ def lcz_fraction(
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Fractions LCZ autour des points capteurs")
+    parser.add_argument("--method", choices=["polygon", "raster"], default="polygon",
+                        help="intersections exactes ou grille LCZ")
+    parser.add_argument("--resolution", type=float, default=5, help="taille des cellules de la grille LCZ (m)")
+    parser.add_argument("--buffer-sizes", type=int, nargs="+",
+                        help="rayons des buffers en mètres (défaut: buffer_size de LCZ_TARGETS)")
+    parser.add_argument("--class-map", type=json.loads,
+                        help="colonnes de fractions en JSON, ex: '{\"lcz_urban\": [1, 2, 3]}' (défaut: LCZ_CLASS_MAP)")
+    parser.add_argument("--output-format", choices=["wide", "long"], default="wide",
+                        help="une colonne par classe et par rayon, ou une ligne par point et par rayon")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare la méthode raster à la méthode polygone ({output_table}_raster)")
+    args = parser.parse_args()
+
     # Créer l'engine
     engine = create_engine_from_config("config.json")
 
@@ -192,39 +376,20 @@ def main():
             conn.execute(text("SELECT 1"))
             print("✅ Connexion à PostgreSQL réussie !")
 
-            # Paramètres obligatoires
-            source_table = "veloclimat.labsticc_sensors_temperature_interpolate"
-            output_table = "veloclimat.labsticc_sensors_temperature_lcz"
-            lcz_table = "veloclimat.rsu_lcz"
-            columns_to_keep = ["temperature", "t_inter", "timestamp",
-                               "diff_temperature","elevation","speed_m_s", "unique_id_track", "thermo_name", "sensor_name"]
-
-            success = lcz_fraction(
-                conn,
-                source_table=source_table,
-                output_table=output_table,
-                lcz_table=lcz_table,
-                columns=columns_to_keep,
-                buffer_size=100,
-                delete_source=False
-            )
-
-            # Paramètres obligatoires
-            source_table = "veloclimat.veloclimatmeter_temperature_interpolate"
-            output_table = "veloclimat.veloclimatmeter_temperature_lcz"
-            lcz_table = "veloclimat.rsu_lcz"
-            columns_to_keep = ["temperature", "t_inter", "timestamp", "diff_temperature",
-                               "temperature_bot", "temperature_top","elevation","speed_m_s",  "unique_id_track", "thermo_name", "sensor_name"]
-
-            success = lcz_fraction(
-                conn,
-                source_table=source_table,
-                output_table=output_table,
-                lcz_table=lcz_table,
-                columns=columns_to_keep,
-                buffer_size=100,
-                delete_source=False
-            )
+            success = True
+            for target in LCZ_TARGETS:
+                target = {**target, "output_format": args.output_format, "class_map": args.class_map}
+                if args.buffer_sizes:
+                    target["buffer_size"] = args.buffer_sizes
+                if args.compare:
+                    raster_table = f"{target['output_table']}_raster"
+                    success = lcz_fraction(conn, **target) and success
+                    success = lcz_fraction(conn, **{**target, "output_table": raster_table}, method="raster",
+                                           resolution=args.resolution) and success
+                    compare_lcz_fractions(conn, target["output_table"], raster_table)
+                else:
+                    success = lcz_fraction(conn, **target, method=args.method, resolution=args.resolution) and success
+            return success
 
     except Exception as e:
         print(f"❌ Erreur : {e}")
@@ -0,0 +1,448 @@
+import hashlib
+import json
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import text
+
+from process.utils import CACHE_DIRECTORY, STALE_CACHE_SECONDS, copy_to_table
+
+# Fractions LCZ approchées à partir d'une grille
+#
+# La couche LCZ (projetée en 3857) est rastérisée une seule fois à une résolution donnée :
+# chaque cellule reçoit le numéro de la classe LCZ qui couvre son centre (0 = aucune LCZ).
+# Pour chaque classe, une image intégrale (somme cumulée 2D) est stockée dans un fichier
+# NumPy projeté en mémoire (memmap), de forme (lignes + 1, colonnes + 1, classes + 1).
+# Le nombre de cellules d'une classe dans un rectangle s'obtient alors avec 4 lectures.
+# Le disque du buffer est approché par quelques bandes rectangulaires : le coût par point
+# ne dépend ni du rayon ni du nombre de polygones.
+#
+# La grille est découpée en tuiles de TILE_SIZE mètres : seules les tuiles contenant des points
+# sont rastérisées (étendues du plus grand rayon), avec les seules classes présentes dans la tuile.
+#
+# Les grilles d'une couche LCZ sont gardées en cache tant que son empreinte ne change pas : à l'écriture
+# d'une nouvelle grille, celles des anciennes empreintes sont supprimées après STALE_CACHE_SECONDS
+# (un autre calcul peut encore les lire).
+
+
+# Nombre de bandes rectangulaires approchant le disque du buffer
+DEFAULT_STRIPS = 8
+
+# Côté des tuiles de la grille en mètres : une grille est construite par tuile contenant des points
+TILE_SIZE = 10000
+
+# Taille maximale des images intégrales d'une tuile sur disque (octets)
+MAX_GRID_BYTES = 4 * 10 ** 9
+
+
+def _fill_polygon(grid, rings, value, origin, resolution):
+    """
+    Rastérise un polygone (règle pair-impair sur tous ses anneaux, trous compris)
+
+    Une cellule reçoit value si son centre est dans le polygone.
+
+    Args:
+        grid: grille (lignes, colonnes), la ligne 0 est au sud
+        rings: liste de tableaux (n, 2) des anneaux du polygone
+        value: valeur à écrire
+        origin: coin sud-ouest (xmin, ymin) de la grille
+        resolution: taille d'une cellule en mètres
+    """
+    edges = np.concatenate([np.column_stack([ring[:-1], ring[1:]]) for ring in rings if len(ring) > 1])
+    x0, y0, x1, y1 = edges.T
+    nb_rows, nb_cols = grid.shape
+
+    row_start = max(int(math.ceil((y0.min() - origin[1]) / resolution - 0.5)), 0)
+    row_end = min(int(math.floor((y0.max() - origin[1]) / resolution - 0.5)), nb_rows - 1)
+    if row_end < row_start:
+        return
+    rows = np.arange(row_start, row_end + 1)
+    centers = origin[1] + (rows[:, None] + 0.5) * resolution
+
+    # Abscisses des intersections des arêtes avec la ligne passant par le centre des cellules
+    crossing = (y0 <= centers) != (y1 <= centers)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_crossing = np.where(crossing, x0 + (centers - y0) * (x1 - x0) / (y1 - y0), np.inf)
+    x_crossing.sort(axis=1)
+    nb_crossings = crossing.sum(axis=1)
+
+    # Segments intérieurs : entre la 1ère et la 2ème intersection, la 3ème et la 4ème...
+    pair_rows, pair_index = np.nonzero(np.arange(0, x_crossing.shape[1], 2)[None, :] < nb_crossings[:, None] - 1)
+    x_start = x_crossing[pair_rows, 2 * pair_index]
+    x_end = x_crossing[pair_rows, 2 * pair_index + 1]
+    col_start = np.clip(np.ceil((x_start - origin[0]) / resolution - 0.5), 0, nb_cols).astype(np.int64)
+    col_end = np.clip(np.floor((x_end - origin[0]) / resolution - 0.5) + 1, 0, nb_cols).astype(np.int64)
+    keep = col_end > col_start
+
+    inside = np.zeros((len(rows), nb_cols + 1), dtype=np.int32)
+    np.add.at(inside, (pair_rows[keep], col_start[keep]), 1)
+    np.add.at(inside, (pair_rows[keep], col_end[keep]), -1)
+    mask = np.cumsum(inside[:, :nb_cols], axis=1) > 0
+    grid[row_start:row_end + 1][mask] = value
+
+
+def _polygon_rings(geojson):
+    """
+    Anneaux des polygones d'une géométrie GeoJSON (Polygon ou MultiPolygon)
+    """
+    geometry = json.loads(geojson)
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+    return [[np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon] for polygon in polygons]
+
+
+def _integral_images(grid, integral, classes, block_rows=1024):
+    """
+    Remplit les images intégrales par blocs de lignes : integral[i, j, k] = cellules de la classe classes[k]
+    dans grid[:i, :j]. La mémoire utilisée ne dépend que de block_rows et du nombre de colonnes.
+    """
+    integral[0, :, :] = 0
+    integral[:, 0, :] = 0
+    for index, value in enumerate(classes):
+        carry = np.zeros(grid.shape[1], dtype=np.uint32)
+        for row in range(0, grid.shape[0], block_rows):
+            block = np.cumsum(grid[row:row + block_rows] == value, axis=1, dtype=np.uint32)
+            block = np.cumsum(block, axis=0, dtype=np.uint32) + carry
+            integral[row + 1:row + 1 + len(block), 1:, index] = block
+            carry = block[-1]
+
+
+def _evict_lcz_grids(cache_directory, lcz_layer, fingerprint):
+    """
+    Supprime les grilles en cache d'une autre empreinte de la couche LCZ (ou sans empreinte connue),
+    écrites depuis plus de STALE_CACHE_SECONDS
+    """
+    for meta_path in cache_directory.glob("lcz_*.json"):
+        try:
+            if time.time() - meta_path.stat().st_mtime <= STALE_CACHE_SECONDS:
+                continue
+            meta = json.loads(meta_path.read_text())
+            if meta.get("layer", lcz_layer) != lcz_layer or meta.get("fingerprint", "") == fingerprint:
+                continue
+            meta_path.with_suffix(".npy").unlink(missing_ok=True)
+            meta_path.unlink()
+        except FileNotFoundError:
+            pass  # supprimé par un autre calcul
+
+
+def build_lcz_grid(conn, lcz_layer, classes, resolution=5, extent=None, cache_directory=CACHE_DIRECTORY,
+                   max_bytes=MAX_GRID_BYTES):
+    """
+    Rastérise la couche LCZ sur une étendue et calcule les images intégrales des classes présentes
+
+    Le résultat est mis en cache sur disque : il n'est recalculé que si la couche LCZ
+    (empreinte en commentaire de la table, voir prepare_lcz_layer), l'étendue ou la résolution changent.
+    Les grilles des anciennes empreintes de la couche sont supprimées (voir _evict_lcz_grids).
+
+    Args:
+        conn: connexion SQLAlchemy
+        lcz_layer: couche LCZ en 3857 (lcz_primary, the_geom)
+        classes: liste des valeurs de lcz_primary
+        resolution: taille d'une cellule en mètres
+        extent: tuple (xmin, ymin, xmax, ymax) en 3857 (défaut: étendue de la couche)
+        cache_directory: répertoire des fichiers de cache
+        max_bytes: taille maximale des images intégrales, vérifiée avant la rastérisation
+
+    Returns:
+        Tuple (images intégrales memmap (lignes + 1, colonnes + 1, classes présentes + 1), origine (xmin, ymin),
+        classes présentes)
+    """
+    fingerprint = conn.execute(text("SELECT obj_description(to_regclass(:layer), 'pg_class')"),
+                               {"layer": lcz_layer}).scalar()
+    key = hashlib.md5(f"{lcz_layer}|{fingerprint}|{resolution}|{list(classes)}|{extent}".encode()).hexdigest()
+    cache_directory = Path(cache_directory)
+    grid_path = cache_directory / f"lcz_{key}.npy"
+    meta_path = cache_directory / f"lcz_{key}.json"
+
+    if grid_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        return np.load(grid_path, mmap_mode="r"), tuple(meta["origin"]), meta["grid_classes"]
+
+    if extent is None:
+        extent = conn.execute(text(f"""
+                SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+                FROM (SELECT ST_Extent(the_geom) AS e FROM {lcz_layer}) AS foo
+                """)).one()
+    xmin, ymin, xmax, ymax = extent
+    envelope = "ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857)"
+    bounds = {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+
+    present = set(conn.execute(text(f"""
+            SELECT DISTINCT lcz_primary FROM {lcz_layer} WHERE the_geom && {envelope}
+            """), bounds).scalars().all())
+    grid_classes = [lcz for lcz in classes if lcz in present]
+
+    nb_rows = int(math.ceil((ymax - ymin) / resolution))
+    nb_cols = int(math.ceil((xmax - xmin) / resolution))
+    nb_bytes = (nb_rows + 1) * (nb_cols + 1) * (len(grid_classes) + 1) * 4
+    if nb_bytes > max_bytes:
+        raise ValueError(f"Grille LCZ trop grande: {nb_rows} x {nb_cols} cellules, {len(grid_classes)} classes "
+                         f"({nb_bytes / 1e9:.1f} Go > {max_bytes / 1e9:.1f} Go). "
+                         f"Augmenter la résolution ({resolution} m) ou réduire la taille des tuiles.")
+    origin = (float(xmin), float(ymin))
+
+    class_index = {lcz: index for index, lcz in enumerate(grid_classes, start=1)}
+    grid = np.zeros((nb_rows, nb_cols), dtype=np.uint8)
+    result = conn.execution_options(stream_results=True, yield_per=10000).execute(text(f"""
+            SELECT lcz_primary, ST_AsGeoJSON(the_geom) FROM {lcz_layer} WHERE the_geom && {envelope}
+            """), bounds)
+    for rows in result.partitions():
+        for lcz_primary, geojson in rows:
+            if lcz_primary not in class_index:
+                continue
+            for rings in _polygon_rings(geojson):
+                _fill_polygon(grid, rings, class_index[lcz_primary], origin, resolution)
+
+    # Images intégrales : integral[i, j, k] = nombre de cellules de la classe k dans grid[:i, :j]
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    integral = np.lib.format.open_memmap(grid_path, mode="w+", dtype=np.uint32,
+                                         shape=(nb_rows + 1, nb_cols + 1, len(grid_classes) + 1))
+    _integral_images(grid, integral, range(len(grid_classes) + 1))
+    integral.flush()
+    meta_path.write_text(json.dumps({"origin": origin, "resolution": resolution, "classes": list(classes),
+                                     "grid_classes": grid_classes, "layer": lcz_layer,
+                                     "fingerprint": fingerprint or ""}))
+    _evict_lcz_grids(cache_directory, lcz_layer, fingerprint or "")
+
+    return np.load(grid_path, mmap_mode="r"), origin, grid_classes
+
+
+def disc_strips(radius, resolution, nb_strips=DEFAULT_STRIPS):
+    """
+    Approche un disque de rayon radius par nb_strips bandes rectangulaires horizontales
+
+    Chaque bande couvre des lignes consécutives de la grille et sa largeur est choisie pour
+    conserver le nombre de cellules du disque sur ces lignes.
+
+    Returns:
+        Tuple (décalage de la première ligne, décalage après la dernière ligne, demi-largeur) en cellules
+    """
+    radius_cells = radius / resolution
+    offsets = np.arange(-math.floor(radius_cells), math.floor(radius_cells) + 1)
+    half_widths = np.floor(np.sqrt(np.maximum(radius_cells ** 2 - offsets ** 2, 0)))
+
+    bounds = np.unique(np.round(np.linspace(0, len(offsets), min(nb_strips, len(offsets)) + 1)).astype(np.int64))
+    row_start, row_end, half_width = [], [], []
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        cells = (2 * half_widths[lower:upper] + 1).sum()
+        row_start.append(offsets[lower])
+        row_end.append(offsets[upper - 1] + 1)
+        half_width.append(int(round((cells / (upper - lower) - 1) / 2)))
+    return np.array(row_start), np.array(row_end), np.array(half_width)
+
+
+def raster_fractions(integral, origin, resolution, x, y, radius, nb_strips=DEFAULT_STRIPS):
+    """
+    Fractions de chaque classe LCZ dans le disque de rayon radius autour des points (x, y) en 3857
+
+    Returns:
+        np.ndarray: tableau (points, classes) des fractions (la classe 0 « aucune LCZ » est exclue)
+    """
+    nb_rows, nb_cols = integral.shape[0] - 1, integral.shape[1] - 1
+    rows = np.floor((y - origin[1]) / resolution).astype(np.int64)
+    cols = np.floor((x - origin[0]) / resolution).astype(np.int64)
+
+    counts = np.zeros((len(x), integral.shape[2]), dtype=np.float64)
+    total = 0
+    for row_start, row_end, half_width in zip(*disc_strips(radius, resolution, nb_strips)):
+        r0 = np.clip(rows + row_start, 0, nb_rows)
+        r1 = np.clip(rows + row_end, 0, nb_rows)
+        c0 = np.clip(cols - half_width, 0, nb_cols)
+        c1 = np.clip(cols + half_width + 1, 0, nb_cols)
+        counts += (integral[r1, c1].astype(np.int64) - integral[r0, c1] - integral[r1, c0] + integral[r0, c0])
+        total += (row_end - row_start) * (2 * half_width + 1)
+
+    # Les cellules hors de la grille comptent comme « aucune LCZ », comme hors des polygones
+    return counts[:, 1:] / total
+
+
+def lcz_fraction_raster(conn, source_table, output_table, lcz_layer, columns, class_map, radii=(100,),
+                        resolution=5, nb_strips=DEFAULT_STRIPS, batch_size=500000, output_format="wide",
+                        tile_size=TILE_SIZE):
+    """
+    Calcule les fractions LCZ autour des points à partir de la grille LCZ
+
+    La table de sortie a la même structure que lcz_fraction_sensors_temperature.lcz_fraction :
+    large (colonnes suffixées par le rayon s'il y en a plusieurs) ou longue (colonne buffer_size).
+
+    Args:
+        conn: connexion SQLAlchemy
+        source_table: table des points capteurs (id, the_geom)
+        output_table: table de sortie
+        lcz_layer: couche LCZ préparée en 3857 (prepare_lcz_layer)
+        columns: colonnes de source_table conservées
+        class_map: dict {nom de la colonne de fraction: liste de classes LCZ sommées}
+        radii: rayons des buffers en mètres
+        resolution: taille d'une cellule de la grille en mètres
+        nb_strips: nombre de bandes approchant le disque
+        batch_size: nombre de points traités par lot
+        output_format: "wide" ou "long"
+        tile_size: côté des tuiles de la grille en mètres
+    """
+    classes = sorted({lcz for members in class_map.values() for lcz in members})
+
+    print(f"\n📊 Fractions LCZ (grille {resolution} m) pour {source_table}...")
+    start = time.perf_counter()
+
+    radii = sorted(radii)
+
+    # Grilles des tuiles contenant des points, étendues du plus grand rayon
+    margin = radii[-1] + resolution
+    grids = {}
+
+    def tile_grid(tile):
+        if tile not in grids:
+            xmin, ymin = float(tile[0] * tile_size - margin), float(tile[1] * tile_size - margin)
+            grids[tile] = build_lcz_grid(conn, lcz_layer, classes, resolution,
+                                         (xmin, ymin, xmin + tile_size + 2 * margin, ymin + tile_size + 2 * margin))
+        return grids[tile]
+
+    fraction_columns = ["lcz_primary_max", "lcz_primary_max_2"] + list(class_map)
+    if output_format == "long":
+        suffixes = {radius: "" for radius in radii}
+        table_columns = ["buffer_size"] + fraction_columns
+    else:
+        suffixes = {radius: f"_{radius}" if len(radii) > 1 else "" for radius in radii}
+        table_columns = [f"{column}{suffixes[radius]}" for radius in radii for column in fraction_columns]
+
+    fractions_table = f"{output_table}_fractions"
+    column_types = ", ".join(f"{column} {'INTEGER' if column.startswith(('lcz_primary', 'buffer_size')) else 'DOUBLE PRECISION'}"
+                             for column in table_columns)
+    conn.execute(text(f"""
+            DROP TABLE IF EXISTS {fractions_table};
+            CREATE UNLOGGED TABLE {fractions_table} (id INTEGER, {column_types});
+            """))
+
+    classes_array = np.asarray(classes)
+    column_indexes = {column: [classes.index(lcz) for lcz in members] for column, members in class_map.items()}
+
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(f"""
+            SELECT id, ST_X(geom), ST_Y(geom)
+            FROM (SELECT id, ST_Transform(the_geom, 3857) AS geom FROM {source_table}) AS foo
+            """))
+    nb_points = 0
+    for rows in result.partitions():
+        values = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        ids = values[:, 0].astype(np.int32)
+
+        # Fractions de toutes les classes, calculées tuile par tuile sur les classes présentes
+        all_fractions = {radius: np.zeros((len(ids), len(classes))) for radius in radii}
+        tiles = np.floor(values[:, 1:3] / tile_size).astype(np.int64)
+        for tile in map(tuple, np.unique(tiles, axis=0)):
+            in_tile = np.flatnonzero((tiles == tile).all(axis=1))
+            integral, origin, grid_classes = tile_grid(tile)
+            indexes = [classes.index(lcz) for lcz in grid_classes]
+            for radius in radii:
+                all_fractions[radius][np.ix_(in_tile, indexes)] = raster_fractions(
+                    integral, origin, resolution, values[in_tile, 1], values[in_tile, 2], radius, nb_strips)
+
+        by_radius = {}
+        for radius in radii:
+            fractions = all_fractions[radius]
+            ranking = np.argsort(-fractions, axis=1, kind="stable")
+            first = np.where(fractions[np.arange(len(fractions)), ranking[:, 0]] > 0,
+                             classes_array[ranking[:, 0]], np.nan)
+            second = np.where(fractions[np.arange(len(fractions)), ranking[:, 1]] > 0,
+                              classes_array[ranking[:, 1]], np.nan)
+            batch = {"lcz_primary_max": first, "lcz_primary_max_2": second}
+            for column, indexes in column_indexes.items():
+                batch[column] = fractions[:, indexes].sum(axis=1)
+            by_radius[radius] = (fractions.sum(axis=1) > 0, batch)
+
+        # Comme la méthode polygone, seuls les points avec au moins une LCZ sont conservés
+        if output_format == "long":
+            for radius, (covered, batch) in by_radius.items():
+                batch = {"id": ids[covered], "buffer_size": np.full(covered.sum(), radius, dtype=np.int32),
+                         **{column: batch[column][covered] for column in fraction_columns}}
+                copy_to_table(conn, fractions_table, batch)
+                nb_points += int(covered.sum())
+        else:
+            covered = by_radius[radii[-1]][0]
+            batch = {"id": ids[covered]}
+            for radius, (_, fractions) in by_radius.items():
+                for column in fraction_columns:
+                    batch[f"{column}{suffixes[radius]}"] = fractions[column][covered]
+            copy_to_table(conn, fractions_table, batch)
+            nb_points += int(covered.sum())
+
+    join_fractions(conn, source_table, output_table, fractions_table, columns, table_columns)
+    print(f"✅ {nb_points} lignes ({len(grids)} tuiles) en {time.perf_counter() - start:.1f}s")
+
+
+def join_fractions(conn, source_table, output_table, fractions_table, columns, fraction_columns, index_name=None):
+    """
+    Crée la table de sortie en joignant les colonnes conservées de source_table aux fractions LCZ, sur l'id
+
+    Les fractions sont calculées sans les colonnes conservées (table fractions_table, clé id) : ces colonnes
+    ne sont lues qu'une fois, ici, par une seule jointure. fractions_table est supprimée ensuite.
+
+    Args:
+        conn: connexion SQLAlchemy
+        source_table: table des points capteurs (id, the_geom)
+        output_table: table de sortie
+        fractions_table: table des fractions (id, fraction_columns)
+        columns: colonnes de source_table conservées
+        fraction_columns: colonnes de fractions_table conservées
+        index_name: nom de l'index sur l'id de la table de sortie
+    """
+    conn.execute(text(f"""
+            ANALYZE {fractions_table};
+
+            DROP TABLE IF EXISTS {output_table};
+            CREATE TABLE {output_table} AS
+            SELECT s.id, s.the_geom, {", ".join(f"s.{col}" for col in columns)},
+                   {", ".join(f"f.{column}" for column in fraction_columns)}
+            FROM {source_table} AS s
+            JOIN {fractions_table} AS f ON f.id = s.id;
+
+            DROP TABLE {fractions_table};
+            CREATE INDEX {index_name or ""} ON {output_table} (id);
+            ANALYZE {output_table};
+            """))
+    conn.commit()
+
+
+def compare_lcz_fractions(conn, reference_table, candidate_table):
+    """
+    Erreur des fractions LCZ d'une table (ex: méthode raster) par rapport à une table de référence (polygones)
+
+    Toutes les colonnes de fractions (lcz_*) communes aux deux tables sont comparées.
+    Les tables longues sont appariées sur l'id et le rayon (buffer_size).
+
+    Returns:
+        dict: {colonne: (erreur absolue moyenne, erreur absolue maximale)} et
+              {colonne lcz_primary_max*: part des points ayant la même LCZ principale}
+    """
+    table_columns = []
+    for table_name in (reference_table, candidate_table):
+        table_columns.append(conn.execute(text("""
+                SELECT attname FROM pg_attribute
+                WHERE attrelid = to_regclass(:table_name) AND attnum > 0 AND NOT attisdropped
+                ORDER BY attnum
+                """), {"table_name": table_name}).scalars().all())
+    common = [column for column in table_columns[0] if column in table_columns[1]]
+    primary_columns = [column for column in common if column.startswith("lcz_primary_max")
+                       and not column.startswith("lcz_primary_max_2")]
+    columns = [column for column in common if column.startswith("lcz_") and not column.startswith("lcz_primary")]
+    join_condition = "c.id = r.id" + (" AND c.buffer_size = r.buffer_size" if "buffer_size" in common else "")
+
+    row = conn.execute(text(f"""
+            SELECT COUNT(*) AS nb_points,
+                   {", ".join([f"AVG((r.{col} = c.{col})::int) AS same_{col}" for col in primary_columns] +
+                              [f"AVG(ABS(r.{col} - c.{col})) AS mae_{col}, MAX(ABS(r.{col} - c.{col})) AS max_{col}"
+                               for col in columns])}
+            FROM {reference_table} AS r
+            JOIN {candidate_table} AS c ON {join_condition}
+            """)).mappings().one()
+
+    print(f"\n📊 Comparaison {candidate_table} / {reference_table} ({row['nb_points']} lignes)")
+    errors = {}
+    for col in primary_columns:
+        errors[col] = row[f"same_{col}"]
+        print(f"   {col} identique: {row[f'same_{col}'] or 0:.1%}")
+    for col in columns:
+        errors[col] = (row[f"mae_{col}"], row[f"max_{col}"])
+        if row[f"max_{col}"]:
+            print(f"   {col:20s} erreur moyenne {row[f'mae_{col}']:.4f}, max {row[f'max_{col}']:.4f}")
+    return errors
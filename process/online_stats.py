@@ -0,0 +1,373 @@
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import text
+
+from process.sensors_data_stats import POSITIVE_ONLY_COLUMNS, _range_hours, _range_name
+from process.utils import create_engine_from_config
+
+# Statistiques en flux des tables capteurs
+#
+# La table est lue une seule fois avec un curseur côté serveur, par lots.
+# Pour chaque plage horaire et chaque colonne, un accumulateur conserve :
+# - l'effectif, la moyenne et la somme des carrés des écarts (Welford / Chan, par lot)
+# - le minimum et le maximum
+# - un t-digest pour les percentiles approchés
+# La mémoire utilisée ne dépend pas de la taille de la table. Les accumulateurs peuvent être
+# fusionnés (workers parallèles, résultats de journées précédentes) et sérialisés en dict.
+
+# Percentiles calculés par défaut
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+class RunningStats:
+    """
+    Effectif, moyenne, variance, minimum et maximum mis à jour par lots (algorithme de Chan)
+    """
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, min_value=math.inf, max_value=-math.inf):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+        self.min = min_value
+        self.max = max_value
+
+    def _combine(self, n, mean, m2, min_value, max_value):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.min = min(self.min, min_value)
+        self.max = max(self.max, max_value)
+
+    def update(self, values):
+        """
+        Ajoute un tableau de valeurs (sans NaN)
+        """
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        self._combine(len(values), mean, float(((values - mean) ** 2).sum()),
+                      float(values.min()), float(values.max()))
+
+    def merge(self, other):
+        self._combine(other.n, other.mean, other.m2, other.min, other.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else None
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["n"], values["mean"], values["m2"], values["min"], values["max"])
+
+
+class TDigest:
+    """
+    t-digest fusionnant (merging digest) pour les percentiles approchés
+
+    Les valeurs sont accumulées dans un tampon puis fusionnées avec les centroïdes existants :
+    les centroïdes sont triés et regroupés de sorte que chaque groupe couvre un intervalle de
+    longueur 1 de la fonction d'échelle k(q) = compression / (2π) · arcsin(2q - 1).
+    Les centroïdes sont donc plus fins aux extrémités de la distribution, et leur nombre
+    reste de l'ordre de compression.
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def update(self, values):
+        """
+        Ajoute un tableau de valeurs (sans NaN)
+        """
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._buffer.append(np.asarray(values, dtype=np.float64))
+        self._buffered += len(values)
+        if self._buffered >= 20 * self.compression:
+            self._compress()
+
+    def _compress(self, means=None, weights=None):
+        all_means = [self.means] + self._buffer + ([means] if means is not None else [])
+        all_weights = ([self.weights] + [np.ones(len(values)) for values in self._buffer]
+                       + ([weights] if weights is not None else []))
+        self._buffer = []
+        self._buffered = 0
+
+        means = np.concatenate(all_means)
+        weights = np.concatenate(all_weights)
+        if len(means) == 0:
+            return
+
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+
+        # Numéro de groupe de chaque valeur selon la position de son centre dans la distribution
+        total = weights.sum()
+        centers = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(np.clip(2 * centers - 1, -1, 1))
+        groups = np.floor(k)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def merge(self, other):
+        other._compress()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(other.means, other.weights)
+        return self
+
+    def quantile(self, q):
+        """
+        Valeur approchée du quantile q (entre 0 et 1), ou None si le digest est vide
+        """
+        self._compress()
+        if len(self.means) == 0:
+            return None
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * total, np.r_[0.0, centers, total], np.r_[self.min, self.means, self.max]))
+
+    def to_dict(self):
+        self._compress()
+        return {"compression": self.compression, "means": self.means.tolist(), "weights": self.weights.tolist(),
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, values):
+        digest = cls(values["compression"])
+        digest.means = np.asarray(values["means"], dtype=np.float64)
+        digest.weights = np.asarray(values["weights"], dtype=np.float64)
+        digest.min = values["min"]
+        digest.max = values["max"]
+        return digest
+
+
+class OnlineStats:
+    """
+    Accumulateur d'une colonne sur une plage horaire : RunningStats et TDigest
+    """
+
+    def __init__(self, compression=100):
+        self.stats = RunningStats()
+        self.digest = TDigest(compression)
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        self.stats.update(values)
+        self.digest.update(values)
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.digest.merge(other.digest)
+        return self
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Returns:
+            dict: n, mean, std, min, max et p{percentile}
+        """
+        empty = self.stats.n == 0
+        result = {
+            "n": self.stats.n,
+            "mean": None if empty else self.stats.mean,
+            "std": None if self.stats.variance is None else math.sqrt(self.stats.variance),
+            "min": None if empty else self.stats.min,
+            "max": None if empty else self.stats.max,
+        }
+        for percentile in percentiles:
+            result[f"p{percentile}"] = self.digest.quantile(percentile / 100)
+        return result
+
+    def to_dict(self):
+        return {"stats": self.stats.to_dict(), "digest": self.digest.to_dict()}
+
+    @classmethod
+    def from_dict(cls, values):
+        accumulator = cls(values["digest"]["compression"])
+        accumulator.stats = RunningStats.from_dict(values["stats"])
+        accumulator.digest = TDigest.from_dict(values["digest"])
+        return accumulator
+
+
+def merge_accumulators(results):
+    """
+    Fusionne des résultats de stream_online_stats (workers, journées précédentes)
+
+    Args:
+        results: liste de dict {(plage, colonne): OnlineStats}
+
+    Returns:
+        dict: {(plage, colonne): OnlineStats}
+    """
+    merged = {}
+    for result in results:
+        for key, accumulator in result.items():
+            if key in merged:
+                merged[key].merge(accumulator)
+            else:
+                merged[key] = accumulator
+    return merged
+
+
+def stream_online_stats(conn, table_name, columns, hours_ranges, batch_size=50000, partition=None,
+                        compression=100, time_window=None):
+    """
+    Lit une table en flux et accumule les statistiques par plage horaire et par colonne
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: nom de la table (ex: 'veloclimat.labsticc_sensors_raw')
+        columns: liste des colonnes
+        hours_ranges: liste de tuples (start_hour, end_hour) en heure locale (Europe/Paris),
+                      les plages peuvent passer minuit (ex: (21, 6))
+        batch_size: nombre de lignes lues par lot
+        partition: tuple optionnel (k, nb) pour ne lire que les lignes telles que id % nb = k
+        compression: compression des t-digests
+        time_window: tuple optionnel (début, fin) de timestamptz limitant la lecture à [début, fin)
+
+    Returns:
+        dict: {(nom de la plage, colonne): OnlineStats}
+    """
+    range_names = [_range_name(start_hour, end_hour) for start_hour, end_hour in hours_ranges]
+
+    # Appartenance de chaque heure locale à chaque plage
+    in_range = np.zeros((len(hours_ranges), 25), dtype=bool)
+    for range_id, (start_hour, end_hour) in enumerate(hours_ranges):
+        in_range[range_id, _range_hours(start_hour, end_hour)] = True
+
+    accumulators = {(range_name, col): OnlineStats(compression) for range_name in range_names for col in columns}
+
+    conditions = []
+    if partition:
+        conditions.append(f"id % {int(partition[1])} = {int(partition[0])}")
+    if time_window:
+        conditions.append('"timestamp" >= CAST(:window_start AS timestamptz) '
+                          'AND "timestamp" < CAST(:window_end AS timestamptz)')
+    window_params = {"window_start": time_window[0], "window_end": time_window[1]} if time_window else {}
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(f"""
+            SELECT EXTRACT(HOUR FROM "timestamp" AT TIME ZONE 'Europe/Paris')::float8 AS hour,
+                   {", ".join(f'"{col}"::float8' for col in columns)}
+            FROM {table_name}
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            """), window_params)
+
+    for rows in result.partitions():
+        values = np.array(rows, dtype=np.float64).reshape(-1, len(columns) + 1)
+        hours = values[:, 0]
+        valid_hours = ~np.isnan(hours)
+        hours = np.where(valid_hours, hours, 24).astype(np.int64)
+
+        for range_id, range_name in enumerate(range_names):
+            mask = in_range[range_id, hours]
+            for i, col in enumerate(columns, start=1):
+                column_values = values[mask, i]
+                if col in POSITIVE_ONLY_COLUMNS:
+                    column_values = column_values[column_values > 0]
+                accumulators[(range_name, col)].update(column_values)
+
+    return accumulators
+
+
+def compute_online_stats(config_path, table_name, columns, hours_ranges, workers=1, batch_size=50000,
+                         percentiles=DEFAULT_PERCENTILES, compression=100, time_window=None):
+    """
+    Calcule moyenne, écart-type, min, max et percentiles approchés par plage horaire en une lecture de la table
+
+    Avec workers > 1, la table est répartie par id entre plusieurs connexions et les
+    accumulateurs des workers sont fusionnés.
+
+    Args:
+        config_path: chemin vers le fichier config.json
+        table_name: nom de la table (ex: 'schema.table')
+        columns: liste des colonnes (ex: ['temperature', 'humidity'])
+        hours_ranges: liste de tuples (start_hour, end_hour)
+        workers: nombre de lectures parallèles
+        batch_size: nombre de lignes lues par lot
+        percentiles: percentiles à calculer
+        compression: compression des t-digests
+        time_window: tuple optionnel (début, fin) de timestamptz limitant la lecture à [début, fin)
+
+    Returns:
+        dict: {(nom de la plage, colonne): dict de statistiques}, ou None en cas d'erreur
+    """
+    for part in table_name.split('.'):
+        if not part.isidentifier():
+            raise ValueError(f"Invalid table name: {table_name}")
+    valid_cols = [col.strip() for col in columns if col.strip().isidentifier()]
+    if not valid_cols:
+        raise ValueError("Aucune colonne valide spécifiée")
+
+    engine = create_engine_from_config(config_path)
+
+    def run(partition):
+        with engine.connect() as conn:
+            return stream_online_stats(conn, table_name, valid_cols, hours_ranges, batch_size, partition,
+                                       compression, time_window)
+
+    try:
+        start = time.perf_counter()
+        if workers <= 1:
+            accumulators = run(None)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                accumulators = merge_accumulators(executor.map(run, [(k, workers) for k in range(workers)]))
+
+        summaries = {key: accumulator.summary(percentiles) for key, accumulator in accumulators.items()}
+
+        print("\n" + "=" * 70)
+        print(f"📊 STATISTIQUES EN FLUX : {table_name} ({time.perf_counter() - start:.1f}s)")
+        print("=" * 70)
+        for start_hour, end_hour in hours_ranges:
+            range_name = _range_name(start_hour, end_hour)
+            print(f"\n⏰ Plage {range_name}")
+            print("-" * 70)
+            for col in valid_cols:
+                summary = summaries[(range_name, col)]
+                values = ", ".join(f"{name}={value:.2f}" if value is not None else f"{name}=N/A"
+                                   for name, value in summary.items() if name != "n")
+                print(f"  {col.upper()} (n={summary['n']}): {values}")
+
+        return summaries
+
+    except Exception as e:
+        print(f"❌ Erreur : {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistiques en flux par plage horaire")
+    parser.add_argument("--table", default="veloclimat.labsticc_sensors_raw")
+    parser.add_argument("--columns", nargs="+", default=["temperature", "humidity"])
+    parser.add_argument("--ranges", nargs="+", default=["0-24"], help="plages horaires, ex: 12-18 21-6")
+    parser.add_argument("--workers", type=int, default=1, help="nombre de lectures parallèles")
+    args = parser.parse_args()
+
+    hours_ranges = [tuple(int(hour) for hour in hours_range.split("-")) for hours_range in args.ranges]
+    return compute_online_stats("config.json", args.table, args.columns, hours_ranges, workers=args.workers) is not None
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,250 @@
+import argparse
+import time
+
+from sqlalchemy import text
+
+from process.utils import create_engine_from_config
+
+# Partitionnement des tables brutes des capteurs par plage de "timestamp"
+#
+# Les tables brutes contiennent l'historique de toutes les campagnes. Une fois partitionnées
+# par jour ou par semaine (PARTITION BY RANGE ("timestamp")), les requêtes filtrées sur une
+# fenêtre de temps (campagne, time_window des statistiques) ne lisent que les partitions concernées.
+#
+# La migration bloque les écritures sur la table d'origine, crée une table partitionnée, y copie
+# les données, échange les noms puis recrée les index de la table d'origine (sous les mêmes noms)
+# sur la table partitionnée, dans une seule transaction.
+# La table d'origine est conservée sous le nom {table}_unpartitioned (sauf --drop-old).
+
+RAW_TABLES = ["veloclimat.labsticc_sensors_raw", "veloclimat.veloclimatmeter_meteo_raw"]
+
+# Les bornes des partitions sont alignées sur les jours / semaines en heure locale
+PARTITION_TIMEZONE = "Europe/Paris"
+
+INTERVALS = {"day": "1 day", "week": "1 week"}
+
+
+def _partition_bounds(conn, interval, start, end):
+    """
+    Bornes [début, fin) des partitions couvrant l'intervalle [start, end]
+
+    Returns:
+        list: liste de tuples (nom de suffixe, début, fin) avec des bornes timestamptz en texte
+    """
+    rows = conn.execute(text(f"""
+            SELECT to_char(b, 'YYYYMMDD'),
+                   (b AT TIME ZONE '{PARTITION_TIMEZONE}')::text,
+                   ((b + INTERVAL '{INTERVALS[interval]}') AT TIME ZONE '{PARTITION_TIMEZONE}')::text
+            FROM generate_series(
+                date_trunc(:interval, CAST(:start AS timestamptz) AT TIME ZONE '{PARTITION_TIMEZONE}'),
+                date_trunc(:interval, CAST(:end AS timestamptz) AT TIME ZONE '{PARTITION_TIMEZONE}'),
+                INTERVAL '{INTERVALS[interval]}') AS b
+            """), {"interval": interval, "start": start, "end": end}).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def ensure_partitions(conn, table_name, start, end, interval="week"):
+    """
+    Crée les partitions manquantes d'une table partitionnée pour l'intervalle [start, end]
+
+    À appeler avant de charger une nouvelle campagne : les lignes hors partition sont
+    sinon rangées dans la partition par défaut.
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: table partitionnée (ex: 'veloclimat.labsticc_sensors_raw')
+        start: début de la période (timestamptz ou texte)
+        end: fin de la période
+        interval: "day" ou "week"
+
+    Returns:
+        int: nombre de partitions créées
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"interval invalide: {interval} (attendu: 'day' ou 'week')")
+
+    existing = set(conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits AS i
+            JOIN pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table_name)
+            """), {"table_name": table_name}).scalars().all())
+
+    schema = f"{table_name.split('.')[0]}." if "." in table_name else ""
+    base_name = table_name.split('.')[-1]
+
+    nb_created = 0
+    for suffix, lower, upper in _partition_bounds(conn, interval, start, end):
+        partition_name = f"{base_name}_p{suffix}"
+        if partition_name in existing:
+            continue
+        conn.execute(text(f"""
+                CREATE TABLE {schema}{partition_name} PARTITION OF {table_name}
+                    FOR VALUES FROM ('{lower}') TO ('{upper}')
+                """))
+        nb_created += 1
+    return nb_created
+
+
+def partition_table(conn, table_name, interval="week", drop_old=False):
+    """
+    Convertit une table brute en table partitionnée par plage de "timestamp"
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: table brute (ex: 'veloclimat.labsticc_sensors_raw')
+        interval: "day" ou "week"
+        drop_old: supprime la table d'origine au lieu de la renommer en {table}_unpartitioned
+
+    Returns:
+        int: nombre de partitions créées
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"interval invalide: {interval} (attendu: 'day' ou 'week')")
+
+    print(f"\n📊 Partitionnement de {table_name} par {interval}...")
+    start_time = time.perf_counter()
+
+    is_partitioned = conn.execute(text("""
+            SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table_name)
+            """), {"table_name": table_name}).scalar()
+    if is_partitioned is None:
+        raise ValueError(f"Table introuvable: {table_name}")
+    if is_partitioned:
+        print(f"⚠️ {table_name} est déjà partitionnée")
+        return 0
+
+    schema = f"{table_name.split('.')[0]}." if "." in table_name else ""
+    base_name = table_name.split('.')[-1]
+    new_table = f"{table_name}_partitioned"
+
+    # Les écritures sont bloquées jusqu'à l'échange des tables : aucune ligne insérée pendant
+    # la copie n'est perdue (les lectures restent possibles)
+    conn.execute(text(f"LOCK TABLE {table_name} IN EXCLUSIVE MODE"))
+
+    # Index de la table d'origine, recréés sous le même nom sur la table partitionnée
+    indexes = [tuple(row) for row in conn.execute(text("""
+            SELECT c.relname, regexp_replace(pg_get_indexdef(i.indexrelid), '^.* USING ', 'USING ')
+            FROM pg_index AS i
+            JOIN pg_class AS c ON c.oid = i.indexrelid
+            WHERE i.indrelid = to_regclass(:table_name) AND NOT i.indisunique
+            """), {"table_name": table_name}).fetchall()]
+    if not any(definition == 'USING btree ("timestamp")' for _, definition in indexes):
+        indexes.append((f"idx_{base_name}_timestamp", 'USING btree ("timestamp")'))
+
+    # Les index uniques (dont la clé primaire) doivent contenir la clé de partitionnement :
+    # ils sont recréés sur leurs colonnes et "timestamp" (ex: (id, "timestamp"))
+    unique_indexes = conn.execute(text("""
+            SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indexprs IS NOT NULL OR i.indpred IS NOT NULL,
+                   ARRAY(SELECT a.attname::text
+                         FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+                         JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                         ORDER BY k.ord)
+            FROM pg_index AS i
+            JOIN pg_class AS c ON c.oid = i.indexrelid
+            WHERE i.indrelid = to_regclass(:table_name) AND i.indisunique
+            """), {"table_name": table_name}).fetchall()
+    unique_columns = []
+    for index_name, definition, is_expression, columns in unique_indexes:
+        if is_expression:
+            raise ValueError(f"Index unique sur une expression ou partiel, non transposable sur {table_name}: "
+                             f"{definition}")
+        columns = [f'"{column}"' for column in columns]
+        if '"timestamp"' not in columns:
+            columns.append('"timestamp"')
+            print(f"⚠️ Unicité de ({', '.join(columns[:-1])}) remplacée par ({', '.join(columns)}) "
+                  f"sur la table partitionnée")
+        unique_columns.append((index_name, columns))
+
+    min_ts, max_ts = conn.execute(text(f'SELECT MIN("timestamp"), MAX("timestamp") FROM {table_name}')).one()
+
+    conn.execute(text(f"""
+            DROP TABLE IF EXISTS {new_table};
+            CREATE TABLE {new_table} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING COMMENTS)
+                PARTITION BY RANGE ("timestamp");
+            CREATE TABLE {new_table}_default PARTITION OF {new_table} DEFAULT;
+            """))
+
+    nb_partitions = 0
+    if min_ts is not None:
+        for suffix, lower, upper in _partition_bounds(conn, interval, min_ts, max_ts):
+            conn.execute(text(f"""
+                    CREATE TABLE {schema}{base_name}_p{suffix} PARTITION OF {new_table}
+                        FOR VALUES FROM ('{lower}') TO ('{upper}')
+                    """))
+            nb_partitions += 1
+
+    nb_rows = conn.execute(text(f"INSERT INTO {new_table} SELECT * FROM {table_name}")).rowcount
+
+    # La séquence de id (serial) suit la nouvelle table
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table_name, 'id')"),
+                            {"table_name": table_name}).scalar()
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {new_table}.id"))
+
+    # Les noms des index de la table d'origine sont libérés avant de les recréer :
+    # un CREATE INDEX IF NOT EXISTS ultérieur porte alors sur la table partitionnée
+    if drop_old:
+        conn.execute(text(f"DROP TABLE {table_name}"))
+    else:
+        conn.execute(text(f"""
+                DROP TABLE IF EXISTS {table_name}_unpartitioned;
+                ALTER TABLE {table_name} RENAME TO {base_name}_unpartitioned;
+                """))
+        for index_name in [name for name, _ in indexes] + [name for name, _ in unique_columns]:
+            conn.execute(text(f"""
+                    ALTER INDEX IF EXISTS {schema}"{index_name}" RENAME TO "{index_name[:49]}_unpartitioned"
+                    """))
+    conn.execute(text(f"""
+            ALTER TABLE {new_table} RENAME TO {base_name};
+            ALTER TABLE {new_table}_default RENAME TO {base_name}_default;
+            """))
+
+    # Les index créés sur la table partitionnée sont créés sur chaque partition
+    for index_name, definition in indexes:
+        conn.execute(text(f'CREATE INDEX "{index_name}" ON {table_name} {definition}'))
+    for index_name, columns in unique_columns:
+        conn.execute(text(f'CREATE UNIQUE INDEX "{index_name}" ON {table_name} ({", ".join(columns)})'))
+
+    conn.execute(text(f"ANALYZE {table_name}"))
+    conn.commit()
+
+    print(f"✅ {nb_rows} lignes réparties dans {nb_partitions} partitions en {time.perf_counter() - start_time:.1f}s")
+    return nb_partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitionnement des tables brutes par plage de timestamp")
+    parser.add_argument("--tables", nargs="+", default=RAW_TABLES, help="tables à partitionner")
+    parser.add_argument("--interval", choices=list(INTERVALS), default="week", help="taille des partitions")
+    parser.add_argument("--drop-old", action="store_true", help="supprime les tables d'origine")
+    args = parser.parse_args()
+
+    # Créer l'engine
+    engine = create_engine_from_config("config.json")
+
+    try:
+        with engine.connect() as conn:
+            # Tester la connexion
+            conn.execute(text("SELECT 1"))
+            print("✅ Connexion à PostgreSQL réussie !")
+
+            for table_name in args.tables:
+                partition_table(conn, table_name, args.interval, args.drop_old)
+
+            print("\n" + "=" * 70)
+            print("✅ Partitionnement terminé avec succès !")
+            print("=" * 70)
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,355 @@
+import argparse
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from sqlalchemy import text
+
+from process import (interpolate_labsticc_sensors_reference_temperature, interpolate_labsticc_sensors_temperature,
+                     interpolate_veloclimatmeter_meteo_temperature)
+from process.interpolation import METHODS, SOURCES, WEIGHTS_TABLE
+from process.lcz_fraction_sensors_temperature import LCZ_TARGETS, lcz_fraction
+from process.prepare_weather_stations_delaunay import prepare_barycentric_weights, prepare_MF_data
+from process.preprocess_data_sensors import clean_labsticc_sensors_data, clean_veloclimatmeter_data
+from process.utils import ENGINE_DEFAULTS, create_engine_from_config
+
+# Orchestrateur des étapes 1 à 6 (python -m process.pipeline)
+#
+# Chaque étape déclare les tables qu'elle lit (inputs) et celles qu'elle écrit (outputs) :
+# les dépendances entre étapes sont déduites de ces tables.
+# Avant de lancer une étape, ses tables d'entrée sont résumées par une empreinte de leur contenu
+# (nombre de lignes, id maximum et somme des hashtext des lignes). L'étape n'est relancée que si
+# cette empreinte diffère de celle enregistrée dans STATE_TABLE lors de sa dernière exécution,
+# ou si une de ses tables de sortie n'existe pas.
+# Les étapes indépendantes (ex: les trois interpolations) sont exécutées en parallèle,
+# chacune sur sa propre connexion.
+
+# Empreinte des entrées de chaque étape lors de sa dernière exécution réussie
+STATE_TABLE = "veloclimat.pipeline_state"
+
+# Fonction d'interpolation de chaque famille de capteurs (interpolation.SOURCES)
+INTERPOLATIONS = {
+    "veloclimatmeter": interpolate_veloclimatmeter_meteo_temperature.interpolate_temperature,
+    "labsticc_sensors": interpolate_labsticc_sensors_temperature.interpolate_temperature_MF_stations,
+    "labsticc_sensors_reference": interpolate_labsticc_sensors_reference_temperature.interpolate_temperature,
+}
+
+
+def _run_preprocess(conn, options):
+    clean_veloclimatmeter_data(conn, incremental=options["incremental"])
+    clean_labsticc_sensors_data(conn, incremental=options["incremental"])
+
+
+def _run_delaunay(conn, options):
+    # La méthode scipy interpole avec sa propre triangulation : elle est aussi écrite dans les tables
+    prepare_MF_data(conn, method="scipy" if options["method"] == "scipy" else "postgis")
+    # Seule la méthode weights lit la table des poids barycentriques
+    if options["method"] == "weights":
+        for source in SOURCES.values():
+            prepare_barycentric_weights(conn, source["source_table"])
+
+
+def _interpolation_runner(key):
+    def run(conn, options):
+        INTERPOLATIONS[key](conn, method=options["method"], workers=options["workers"])
+    return run
+
+
+def _lcz_runner(target):
+    def run(conn, options):
+        if not lcz_fraction(conn, **target):
+            raise RuntimeError(f"Calcul des fractions LCZ en erreur pour {target['output_table']}")
+    return run
+
+
+def build_stages(method="weights"):
+    """
+    Déclare les étapes du traitement, dans l'ordre du README
+
+    La table des poids barycentriques (WEIGHTS_TABLE) n'est écrite et lue que par la méthode weights.
+
+    Args:
+        method: méthode d'interpolation (voir interpolation.interpolate)
+
+    Returns:
+        dict: {nom de l'étape: {"inputs": [...], "outputs": [...], "run": fonction(conn, options)}}
+    """
+    weights_tables = [WEIGHTS_TABLE] if method == "weights" else []
+    stages = {
+        "preprocess": {
+            "inputs": ["veloclimat.veloclimatmeter_meteo_raw", "veloclimat.labsticc_sensors_raw"],
+            "outputs": [source["source_table"] for source in SOURCES.values()],
+            "run": _run_preprocess,
+        },
+        "delaunay": {
+            "inputs": ["veloclimat.weather_stations_mf"] + [source["source_table"] for source in SOURCES.values()],
+            "outputs": ["veloclimat.weather_stations_mf_delaunay", "veloclimat.weather_stations_mf_delaunay_pts"]
+                       + weights_tables,
+            "run": _run_delaunay,
+        },
+    }
+
+    for key, source in SOURCES.items():
+        stages[f"interpolate_{key}"] = {
+            "inputs": [source["source_table"], "veloclimat.weather_stations_mf_delaunay",
+                       "veloclimat.weather_stations_mf_delaunay_pts", "veloclimat.weather_data_stations_mf"]
+                      + weights_tables,
+            "outputs": [source["output_table"]],
+            "run": _interpolation_runner(key),
+        }
+
+    for target in LCZ_TARGETS:
+        stages[f"lcz_{target['output_table'].split('.')[-1]}"] = {
+            "inputs": [target["source_table"], target["lcz_table"]],
+            "outputs": [target["output_table"]],
+            "run": _lcz_runner(target),
+        }
+
+    return stages
+
+
+def stage_dependencies(stages):
+    """
+    Étapes dont dépend chaque étape : celles qui écrivent une de ses tables d'entrée
+
+    Returns:
+        dict: {nom de l'étape: ensemble des étapes amont}
+    """
+    return {
+        name: {other for other, upstream in stages.items()
+               if other != name and set(upstream["outputs"]) & set(stage["inputs"])}
+        for name, stage in stages.items()
+    }
+
+
+def table_fingerprint(conn, table_name):
+    """
+    Empreinte du contenu d'une table
+
+    - COUNT(*) et MAX(id) si la table a une colonne id : lignes ajoutées ou supprimées
+    - somme des hashtext des lignes : valeurs modifiées sur place
+
+    L'empreinte ne dépend que des lignes : elle est stable après un VACUUM, une remise à zéro
+    des statistiques ou un redémarrage du serveur. Chaque table est lue une fois par exécution.
+
+    Returns:
+        str: empreinte, ou None si la table n'existe pas
+    """
+    has_id = conn.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM pg_attribute
+                           WHERE attrelid = c.oid AND attname = 'id' AND NOT attisdropped)
+            FROM pg_class AS c
+            WHERE c.oid = to_regclass(:table_name)
+            """), {"table_name": table_name}).scalar()
+    if has_id is None:
+        return None
+
+    nb_rows, checksum, max_id = conn.execute(text(f"""
+            SELECT COUNT(*), COALESCE(SUM(hashtext(t::text)::bigint), 0), {"MAX(t.id)" if has_id else "NULL"}
+            FROM {table_name} AS t
+            """)).one()
+    return f"{nb_rows}:{checksum}:{max_id}"
+
+
+def _stage_fingerprint(conn, stage, fingerprints=None):
+    """
+    Empreinte des entrées d'une étape (md5 des empreintes de ses tables d'entrée)
+
+    Args:
+        fingerprints: dict optionnel {table: empreinte} partagé par les étapes d'une exécution :
+                      chaque table n'est résumée qu'une fois tant qu'aucune étape ne l'écrit
+    """
+    fingerprints = {} if fingerprints is None else fingerprints
+    for table_name in stage["inputs"]:
+        if table_name not in fingerprints:
+            fingerprints[table_name] = table_fingerprint(conn, table_name)
+    return hashlib.md5("\n".join(f"{table_name}={fingerprints[table_name]}"
+                                  for table_name in stage["inputs"]).encode()).hexdigest()
+
+
+def _outputs_exist(conn, stage):
+    return all(conn.execute(text("SELECT to_regclass(:table_name)"), {"table_name": table_name}).scalar()
+               for table_name in stage["outputs"])
+
+
+def _run_stage(engine, name, stage, options, force=False, dry_run=False, fingerprints=None):
+    """
+    Exécute une étape si ses entrées ont changé depuis sa dernière exécution
+
+    Les empreintes des tables écrites par l'étape sont retirées de fingerprints : elles sont
+    recalculées par les étapes aval.
+
+    Returns:
+        str: "done", "skipped", "pending" (dry_run) ou "failed"
+    """
+    try:
+        with engine.connect() as conn:
+            fingerprint = _stage_fingerprint(conn, stage, fingerprints)
+            stored = conn.execute(text(f"SELECT fingerprint FROM {STATE_TABLE} WHERE stage = :stage"),
+                                  {"stage": name}).scalar()
+            up_to_date = stored == fingerprint and _outputs_exist(conn, stage)
+            conn.commit()
+
+            if up_to_date and not force:
+                print(f"⏭️  {name} : entrées inchangées, étape ignorée")
+                return "skipped"
+            if dry_run:
+                print(f"🔄 {name} : à exécuter")
+                return "pending"
+
+            print(f"\n▶️  {name}...")
+            start = time.perf_counter()
+            try:
+                stage["run"](conn, options)
+            finally:
+                for table_name in stage["outputs"]:
+                    if fingerprints is not None:
+                        fingerprints.pop(table_name, None)
+            duration = time.perf_counter() - start
+
+            conn.execute(text(f"""
+                    INSERT INTO {STATE_TABLE} (stage, fingerprint, duration_s, updated_at)
+                    VALUES (:stage, :fingerprint, :duration, now())
+                    ON CONFLICT (stage) DO UPDATE
+                        SET fingerprint = EXCLUDED.fingerprint,
+                            duration_s = EXCLUDED.duration_s,
+                            updated_at = EXCLUDED.updated_at
+                    """), {"stage": name, "fingerprint": fingerprint, "duration": duration})
+            conn.commit()
+            print(f"✅ {name} terminé en {duration:.1f}s")
+            return "done"
+
+    except Exception as e:
+        print(f"❌ {name} : {e}")
+        return "failed"
+
+
+def run_pipeline(engine, stage_names=None, force=False, dry_run=False, max_parallel=3, method="weights",
+                 workers=1, incremental=False):
+    """
+    Exécute les étapes du traitement dans l'ordre des dépendances
+
+    Une étape démarre dès que ses étapes amont sont terminées ou ignorées. Si une étape échoue,
+    les étapes qui en dépendent ne sont pas lancées.
+
+    Args:
+        engine: engine SQLAlchemy
+        stage_names: étapes à exécuter (défaut: toutes). Les étapes amont non sélectionnées
+                     sont considérées comme terminées.
+        force: exécute les étapes même si leurs entrées n'ont pas changé
+        dry_run: affiche seulement les étapes à exécuter
+        max_parallel: nombre maximal d'étapes exécutées en même temps. Le pool de l'engine doit
+                      permettre max_parallel * (workers + 1) connexions (voir pool_options).
+        method: méthode d'interpolation (voir interpolation.interpolate)
+        workers: nombre de lots traités en parallèle par chaque interpolation
+        incremental: nettoyage incrémental des données brutes (Step 1)
+
+    Returns:
+        dict: {nom de l'étape: statut}
+    """
+    stages = build_stages(method)
+    dependencies = stage_dependencies(stages)
+    selected = list(stages) if stage_names is None else [name for name in stages if name in stage_names]
+    options = {"method": method, "workers": workers, "incremental": incremental}
+    # Empreintes des tables, calculées une fois par exécution
+    fingerprints = {}
+
+    with engine.connect() as conn:
+        conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                    stage TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    duration_s DOUBLE PRECISION,
+                    updated_at TIMESTAMPTZ
+                )
+                """))
+        conn.commit()
+
+    statuses = {}
+    pending = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while pending or running:
+            finished = {name for name, status in statuses.items() if status in ("done", "skipped", "pending")}
+            ready = [name for name in pending if dependencies[name] & set(selected) <= finished]
+            for name in ready:
+                pending.remove(name)
+                if dry_run and any(statuses[upstream] == "pending" for upstream in dependencies[name] & finished):
+                    # Les entrées seront modifiées par une étape amont
+                    print(f"🔄 {name} : à exécuter (étape amont à exécuter)")
+                    statuses[name] = "pending"
+                    continue
+                running[executor.submit(_run_stage, engine, name, stages[name], options, force, dry_run,
+                                               fingerprints)] = name
+
+            if not running:
+                # En dry_run, des étapes peuvent être marquées sans être lancées
+                if ready:
+                    continue
+                break
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                statuses[running.pop(future)] = future.result()
+
+    for name in pending:
+        print(f"⛔ {name} : non exécuté (étape amont en erreur)")
+        statuses[name] = "blocked"
+    return statuses
+
+
+def pool_options(max_parallel, workers):
+    """
+    Taille du pool de connexions pour max_parallel étapes simultanées
+
+    Une étape d'interpolation utilise sa propre connexion et en ouvre workers autres pour ses lots.
+
+    Returns:
+        dict: options pool_size et max_overflow de create_engine_from_config
+    """
+    return {"pool_size": max(ENGINE_DEFAULTS["pool_size"], max_parallel * (workers + 1)),
+            "max_overflow": ENGINE_DEFAULTS["max_overflow"]}
+
+
+def main():
+    stage_names = list(build_stages())
+
+    parser = argparse.ArgumentParser(description="Traitement complet des données VeloClimat (étapes 1 à 6)")
+    parser.add_argument("--stages", nargs="+", choices=stage_names, help="étapes à exécuter (défaut: toutes)")
+    parser.add_argument("--force", action="store_true", help="exécute les étapes même si leurs entrées n'ont pas changé")
+    parser.add_argument("--dry-run", action="store_true", help="affiche seulement les étapes à exécuter")
+    parser.add_argument("--parallel", type=int, default=3, help="nombre maximal d'étapes exécutées en même temps")
+    parser.add_argument("--method", choices=METHODS, default="weights",
+                        help="méthode d'interpolation")
+    parser.add_argument("--workers", type=int, default=1, help="lots traités en parallèle par interpolation")
+    parser.add_argument("--incremental", action="store_true",
+                        help="nettoyage incrémental des données brutes")
+    args = parser.parse_args()
+
+    # Le pool doit contenir les connexions des étapes parallèles et de leurs lots
+    engine = create_engine_from_config("config.json", **pool_options(args.parallel, args.workers))
+
+    try:
+        start = time.perf_counter()
+        statuses = run_pipeline(engine, args.stages, force=args.force, dry_run=args.dry_run,
+                                max_parallel=args.parallel, method=args.method, workers=args.workers,
+                                incremental=args.incremental)
+
+        print("\n" + "=" * 70)
+        for name in [name for name in stage_names if name in statuses]:
+            status = statuses[name]
+            print(f"   {name:55s} {status}")
+        print(f"⏱️  Durée totale : {time.perf_counter() - start:.1f}s")
+        print("=" * 70)
+        return all(status != "failed" and status != "blocked" for status in statuses.values())
+
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -1,8 +1,51 @@
+import argparse
+
+import numpy as np
 from sqlalchemy import text
 
-from process.utils import create_engine_from_config
+from process.interpolation import SOURCES, WEIGHTS_TABLE, barycentric_weights, select_complete_triangles
+from process.station_cache import load_triangulation, locate_points, stations_hash
+from process.utils import copy_to_table, create_engine_from_config
+
+def _write_delaunay_tables(conn, delaunay, station_ids):
+    """
+    Écrit la triangulation scipy dans les tables weather_stations_mf_delaunay et weather_stations_mf_delaunay_pts
 
-def prepare_MF_data(conn):
+    Les sommets portent directement le numer_insee de leur station. Comme avec ST_DumpPoints,
+    chaque triangle a 4 points (le 4ème ferme l'anneau) et id_triangle commence à 1.
+    """
+    nb_triangles = len(delaunay.simplices)
+    vertices = np.column_stack([delaunay.simplices, delaunay.simplices[:, 0]])
+    copy_to_table(conn, "pg_temp.delaunay_vertices", {
+        "id_triangle": np.repeat(np.arange(1, nb_triangles + 1), 4),
+        "id_pt": np.tile(np.arange(1, 5), nb_triangles),
+        "x": delaunay.points[vertices.ravel(), 0],
+        "y": delaunay.points[vertices.ravel(), 1],
+        "numer_insee": station_ids[vertices.ravel()],
+    }, types={"id_triangle": "integer", "id_pt": "integer", "numer_insee": "integer"})
+
+    conn.execute(text("""
+            drop table if exists veloclimat.weather_stations_mf_delaunay_pts;
+
+            create table veloclimat.weather_stations_mf_delaunay_pts as
+            SELECT ST_SetSRID(ST_MakePoint(x, y), (SELECT ST_SRID(the_geom) FROM veloclimat.weather_stations_mf LIMIT 1))
+                       As the_geom,
+                   id_pt, id_triangle, numer_insee
+            FROM pg_temp.delaunay_vertices;
+
+            drop table if exists veloclimat.weather_stations_mf_delaunay;
+
+            create table veloclimat.weather_stations_mf_delaunay as
+            SELECT ST_MakePolygon(ST_MakeLine(the_geom ORDER BY id_pt)) As the_geom, id_triangle
+            FROM veloclimat.weather_stations_mf_delaunay_pts
+            GROUP BY id_triangle;
+
+            create index on veloclimat.weather_stations_mf_delaunay_pts using GIST(THE_GEOM);
+            create index on veloclimat.weather_stations_mf_delaunay using GIST(THE_GEOM);
+            """))
+
+
+def prepare_MF_data(conn, method="postgis"):
     """
     Prepare Météo-France weather station data.
 
@@ -18,11 +61,26 @@ def prepare_MF_data(conn):
     - veloclimat.weather_stations_mf_delaunay that contains the delaunay triangles
     - veloclimat.weather_stations_mf_delaunay_pts delaunay points with the station identifier (numer_insee/numer_stat)
 
+    With method="scipy", the stations are triangulated in Python (scipy.spatial.Delaunay, see station_cache):
+    the vertices are station indices, so numer_insee is written directly without the ST_Intersects update.
+    The triangulation is cached on disk; the 6-minute weather_data_stations_mf series are cached
+    by the first scipy interpolation, once delta_t is filled.
+
     Args:
         conn: SQLAlchemy connection
+        method: "postgis" (ST_DelaunayTriangles) or "scipy"
     """
     print("\n📊 Start delaunay triangulation...")
 
+    if method == "scipy":
+        delaunay, station_ids = load_triangulation(conn)
+        _write_delaunay_tables(conn, delaunay, station_ids)
+        conn.commit()
+        print(f"✅ Tables de triangulation créées avec succès ({len(delaunay.simplices)} triangles) !")
+        return
+    if method != "postgis":
+        raise ValueError(f"method invalide: {method} (attendu: 'postgis' ou 'scipy')")
+
     query = """
             -- 1 Triangulate the weather stations in order to interpolate the veloclimaeter location
             drop table if exists veloclimat.weather_stations_mf_delaunay;
@@ -58,7 +116,144 @@ def prepare_MF_data(conn):
     conn.commit()
     print("✅ Tables de triangulation créées avec succès !")
 
+def prepare_barycentric_weights(conn, source_table, weights_table=WEIGHTS_TABLE, triangulation=None):
+    """
+    Prepare the barycentric weights of each sensor point in its Delaunay triangle.
+
+    Input:
+    - The sensor table (source_table) with id and the_geom
+    - veloclimat.weather_stations_mf_delaunay and veloclimat.weather_stations_mf_delaunay_pts
+
+    Output:
+    - weights_table (source_table, id, id_triangle, w1, w2, w3, station1, station2, station3, stations_hash,
+      geom_hash)
+
+    The rows are keyed on the hash of the station set and of the triangulation method ("postgis" or
+    "scipy" number the triangles differently): they are only recomputed when the station network
+    or the method changes. Each row also stores the md5 of the point geometry (geom_hash): the rows whose id
+    no longer exists in source_table, or whose geometry changed (rebuilt preprocess table), are deleted.
+    Points already present are skipped, so a rerun only computes the weights of the new or moved points.
+
+    With a triangulation (station_cache.load_triangulation), the points are located in Python with
+    find_simplex instead of the ST_Intersects join on the triangle tables.
+
+    Args:
+        conn: SQLAlchemy connection
+        source_table: sensor table (ex: 'veloclimat.labsticc_sensors_preprocess')
+        weights_table: output weights table
+        triangulation: optional tuple (delaunay, station_ids) returned by station_cache.load_triangulation
+    """
+    print(f"\n📊 Poids barycentriques pour {source_table}...")
+
+    method = "postgis" if triangulation is None else "scipy"
+    current_hash = f"{method}:{stations_hash(conn)}"
+
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {weights_table} (
+                source_table TEXT NOT NULL,
+                id BIGINT NOT NULL,
+                id_triangle INTEGER NOT NULL,
+                w1 DOUBLE PRECISION,
+                w2 DOUBLE PRECISION,
+                w3 DOUBLE PRECISION,
+                station1 BIGINT,
+                station2 BIGINT,
+                station3 BIGINT,
+                stations_hash TEXT NOT NULL,
+                geom_hash TEXT,
+                PRIMARY KEY (source_table, id)
+            );
+
+            ALTER TABLE {weights_table} ADD COLUMN IF NOT EXISTS geom_hash TEXT;
+            ALTER TABLE {weights_table} ALTER COLUMN id TYPE BIGINT;
+            """))
+
+    # Supprime les poids calculés avec un autre réseau de stations
+    deleted = conn.execute(text(f"""
+            DELETE FROM {weights_table}
+            WHERE source_table = :source_table AND stations_hash != :stations_hash
+            """), {"source_table": source_table, "stations_hash": current_hash}).rowcount
+    if deleted:
+        print(f"   {deleted} poids obsolètes supprimés (réseau de stations ou méthode modifiés)")
+
+    # Supprime les poids des points supprimés ou déplacés depuis le dernier calcul
+    deleted = conn.execute(text(f"""
+            DELETE FROM {weights_table} AS w
+            WHERE w.source_table = :source_table
+              AND NOT EXISTS (
+                  SELECT 1 FROM {source_table} AS a
+                  WHERE a.id = w.id AND md5(ST_AsEWKB(a.the_geom)) = w.geom_hash)
+            """), {"source_table": source_table}).rowcount
+    if deleted:
+        print(f"   {deleted} poids obsolètes supprimés (points supprimés ou déplacés)")
+
+    # Seuls les points sans poids sont lus
+    if triangulation is not None:
+        rows = conn.execute(text(f"""
+                SELECT a.id, ST_X(a.the_geom) AS x, ST_Y(a.the_geom) AS y, md5(ST_AsEWKB(a.the_geom)) AS geom_hash
+                FROM {source_table} AS a
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {weights_table} AS w
+                    WHERE w.source_table = :source_table AND w.id = a.id)
+                """), {"source_table": source_table}).fetchall()
+        geom_hashes = np.array([row[3] for row in rows], dtype=object)
+        points = np.array([row[:3] for row in rows], dtype=np.float64).reshape(-1, 3)
+        id_triangles, stations, weights = locate_points(*triangulation, points[:, 1], points[:, 2])
+
+        # Colonnes id et id_triangle lues ci-dessous, comme pour la jointure PostGIS
+        samples = np.column_stack([points[:, 0], id_triangles])
+        first = np.flatnonzero(id_triangles >= 0)
+        weights, stations = weights[first], stations[first]
+    else:
+        rows = conn.execute(text(f"""
+                SELECT a.id, b.id_triangle, pts.id_pt,
+                       ST_X(a.the_geom) AS x, ST_Y(a.the_geom) AS y,
+                       ST_X(pts.the_geom) AS vx, ST_Y(pts.the_geom) AS vy,
+                       pts.numer_insee, md5(ST_AsEWKB(a.the_geom)) AS geom_hash
+                FROM {source_table} AS a
+                JOIN veloclimat.weather_stations_mf_delaunay AS b ON ST_Intersects(a.the_geom, b.the_geom)
+                JOIN veloclimat.weather_stations_mf_delaunay_pts AS pts
+                    ON pts.id_triangle = b.id_triangle AND pts.id_pt <= 3
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {weights_table} AS w
+                    WHERE w.source_table = :source_table AND w.id = a.id)
+                ORDER BY a.id, b.id_triangle, pts.id_pt
+                """), {"source_table": source_table}).fetchall()
+
+        geom_hashes = np.array([row[8] for row in rows], dtype=object)
+        samples = np.array([row[:8] for row in rows], dtype=np.float64).reshape(-1, 8)
+        first = select_complete_triangles(samples[:, 0], samples[:, 1])
+        vertices = first[:, None] + np.arange(3)
+
+        weights = barycentric_weights(samples[first, 3], samples[first, 4],
+                                      samples[vertices, 5], samples[vertices, 6])
+        stations = samples[vertices, 7].astype(np.int64)
+
+    if len(first):
+        copy_to_table(conn, weights_table, {
+            "source_table": np.full(len(first), source_table, dtype=object),
+            "id": samples[first, 0].astype(np.int64),
+            "id_triangle": samples[first, 1].astype(np.int32),
+            "w1": weights[:, 0],
+            "w2": weights[:, 1],
+            "w3": weights[:, 2],
+            "station1": stations[:, 0],
+            "station2": stations[:, 1],
+            "station3": stations[:, 2],
+            "stations_hash": np.full(len(first), current_hash, dtype=object),
+            "geom_hash": geom_hashes[first],
+        })
+
+    conn.commit()
+    print(f"✅ {len(first)} nouveaux poids calculés pour {source_table}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Triangulation des stations Météo-France et poids barycentriques")
+    parser.add_argument("--method", choices=["postgis", "scipy"], default="postgis",
+                        help="triangulation PostGIS ou scipy (cache sur disque)")
+    args = parser.parse_args()
+
       # Créer l'engine
     engine = create_engine_from_config("config.json")
 
@@ -69,7 +264,12 @@ def main():
             print("✅ Connexion à PostgreSQL réussie !")
 
             # Prépare les données
-            prepare_MF_data(conn)
+            prepare_MF_data(conn, method=args.method)
+
+            # Calcule les poids barycentriques des points capteurs
+            triangulation = load_triangulation(conn) if args.method == "scipy" else None
+            for source in SOURCES.values():
+                prepare_barycentric_weights(conn, source["source_table"], triangulation=triangulation)
 
             print("\n" + "=" * 70)
             print("✅ Préparation de stations météo terminée avec succès !")
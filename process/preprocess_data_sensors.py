@@ -1,5 +1,8 @@
+import argparse
+import time
+
 from sqlalchemy import text
-from utils import  create_engine_from_config
+from process.utils import create_engine_from_config
 
 
 # This script is used to clean the tables :
@@ -17,7 +20,150 @@ from utils import  create_engine_from_config
 #     }
 # }
 
-def clean_veloclimatmeter_data(conn):
+# Campaign window of the veloclimatmeter data. The bounds are timestamptz literals
+# so that the planner can prune the partitions of a partitioned raw table.
+CAMPAIGN_START = "2025-06-27 06:00:00+02"
+CAMPAIGN_END = "2025-07-03 23:00:00+02"
+
+# Track key of the preprocess tables, computed from a raw row (NULL if one of the parts is NULL)
+UNIQUE_ID_TRACK = "encode(digest(id_track::TEXT || '|' || sensor_name || '|' || thermo_name, 'md5'), 'hex')"
+
+# High-water mark of the raw tables already preprocessed (max id)
+WATERMARK_TABLE = "veloclimat.preprocess_watermarks"
+
+
+def _read_watermark(conn, raw_table):
+    """
+    Return the last raw id already preprocessed, or None if the table was never preprocessed
+
+    Args:
+        conn: connexion SQLAlchemy
+        raw_table: raw table name (ex: 'veloclimat.labsticc_sensors_raw')
+    """
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                raw_table TEXT PRIMARY KEY,
+                last_id BIGINT NOT NULL,
+                updated_at TIMESTAMPTZ DEFAULT now()
+            )
+            """))
+    return conn.execute(text(f"SELECT last_id FROM {WATERMARK_TABLE} WHERE raw_table = :raw_table"),
+                        {"raw_table": raw_table}).scalar()
+
+
+def _write_watermark(conn, raw_table, last_id):
+    """
+    Store the last raw id preprocessed
+
+    Args:
+        conn: connexion SQLAlchemy
+        raw_table: raw table name
+        last_id: max id of the raw rows processed
+    """
+    conn.execute(text(f"""
+            INSERT INTO {WATERMARK_TABLE} (raw_table, last_id) VALUES (:raw_table, :last_id)
+            ON CONFLICT (raw_table) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = now()
+            """), {"raw_table": raw_table, "last_id": last_id})
+
+
+def _collect_new_tracks(conn, raw_table, last_id, max_id):
+    """
+    Store in the temporary table new_tracks the keys (unique_id_track) of the tracks
+    that received raw rows with an id above the watermark. The tracks with a NULL key part
+    share the NULL key, as in the preprocess tables.
+
+    Args:
+        conn: connexion SQLAlchemy
+        raw_table: raw table name
+        last_id: watermark (last raw id already preprocessed)
+        max_id: max raw id processed by this run
+
+    Returns:
+        int: number of new or updated tracks
+    """
+    conn.execute(text(f"""
+            DROP TABLE IF EXISTS new_tracks;
+            CREATE TEMPORARY TABLE new_tracks AS
+            SELECT DISTINCT {UNIQUE_ID_TRACK} AS unique_id_track
+            FROM {raw_table}
+            WHERE id > :last_id AND id <= :max_id;
+            ANALYZE new_tracks;
+            """), {"last_id": last_id, "max_id": max_id})
+    return conn.execute(text("SELECT COUNT(*) FROM new_tracks")).scalar()
+
+
+def _new_tracks_filter(track_key):
+    """
+    SQL condition selecting the rows of the tracks listed in new_tracks
+
+    Indexable form of track_key IS NOT DISTINCT FROM new_tracks.unique_id_track: = ANY(ARRAY(...))
+    on the non NULL keys and IS NULL if new_tracks contains the NULL key, both answered by the
+    index on unique_id_track (BitmapOr).
+
+    Args:
+        track_key: SQL expression of the track key (unique_id_track or UNIQUE_ID_TRACK on a raw table)
+    """
+    return (f"({track_key} = ANY(ARRAY(SELECT unique_id_track FROM new_tracks WHERE unique_id_track IS NOT NULL))"
+            f" OR ({track_key} IS NULL AND EXISTS (SELECT 1 FROM new_tracks WHERE unique_id_track IS NULL)))")
+
+
+def _incremental_scope(conn, raw_table, preprocess_tables, incremental):
+    """
+    Prepare the scope of a preprocessing run
+
+    In incremental mode, only the tracks with raw rows above the watermark are processed:
+    they are listed in the temporary table new_tracks and deleted from the preprocess tables
+    before being recomputed (upsert by track). A full run is done if one of the preprocess
+    tables is missing.
+
+    Args:
+        conn: connexion SQLAlchemy
+        raw_table: raw table name
+        preprocess_tables: preprocess table name or list of the tables written from raw_table
+        incremental: True to only process the new tracks
+
+    Returns:
+        Tuple (mode, max_id, nb_tracks) where mode is "full", "incremental" or "up_to_date"
+    """
+    max_id = conn.execute(text(f"SELECT MAX(id) FROM {raw_table}")).scalar() or 0
+    last_id = _read_watermark(conn, raw_table)
+    if isinstance(preprocess_tables, str):
+        preprocess_tables = [preprocess_tables]
+    tables_exist = all(conn.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"),
+                                    {"table_name": table_name}).scalar()
+                       for table_name in preprocess_tables)
+
+    if not incremental or last_id is None or not tables_exist:
+        return "full", max_id, None
+
+    nb_tracks = _collect_new_tracks(conn, raw_table, last_id, max_id)
+    if nb_tracks == 0:
+        return "up_to_date", max_id, 0
+    return "incremental", max_id, nb_tracks
+
+
+def _report_table(conn, table_name, start):
+    """
+    Print the duration of a preprocessing step and the size of the table it produced
+
+    The number of rows is the planner estimate (pg_class.reltuples), "unknown" if the table
+    has never been analyzed.
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: table name
+        start: time.perf_counter() value at the beginning of the step
+    """
+    size, nb_rows = conn.execute(text("""
+            SELECT pg_size_pretty(pg_total_relation_size(to_regclass(:table_name))),
+                   (SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table_name))
+            """), {"table_name": table_name}).one()
+    # reltuples vaut -1 tant que la table n'a pas été analysée (VACUUM / ANALYZE)
+    rows = f"~{nb_rows} rows" if nb_rows is not None and nb_rows >= 0 else "unknown rows"
+    print(f"   {table_name}: {time.perf_counter() - start:.1f}s, {size} ({rows})")
+
+
+def clean_veloclimatmeter_data(conn, incremental=False):
     """
     Clean and create a new table called veloclimatmeter_meteo_preprocess
 
@@ -26,16 +172,37 @@ def clean_veloclimatmeter_data(conn):
     - Exclu les points avec des vitesses < 1 m/s
     - Set a unique_id_track based on sensor_name, thermo_name and id_track
 
+    In incremental mode, only the tracks with new raw rows (id above the watermark) are
+    recomputed and upserted into the existing table.
+
     Args:
         conn: connexion SQLAlchemy
+        incremental: only process the tracks with new raw rows (default: False)
     """
     print("\n📊 Clean veloclimatmeter_meteo_raw data...")
+    start = time.perf_counter()
+
+    mode, max_id, nb_tracks = _incremental_scope(conn, "veloclimat.veloclimatmeter_meteo_raw",
+                                                 "veloclimat.veloclimatmeter_meteo_preprocess", incremental)
+    if mode == "up_to_date":
+        print("✅ Table veloclimatmeter_meteo_preprocess already up to date !")
+        return
+
+    if mode == "incremental":
+        print(f"   {nb_tracks} new or updated tracks")
+        target = f"""DELETE FROM veloclimat.veloclimatmeter_meteo_preprocess
+                WHERE {_new_tracks_filter("unique_id_track")};
+            INSERT INTO veloclimat.veloclimatmeter_meteo_preprocess"""
+        track_filter = f"AND {_new_tracks_filter(UNIQUE_ID_TRACK)}"
+    else:
+        target = """DROP TABLE IF EXISTS veloclimat.veloclimatmeter_meteo_preprocess;
+            CREATE TABLE veloclimat.veloclimatmeter_meteo_preprocess AS"""
+        track_filter = ""
 
     # Create and populate table veloclimatmeter_preprocess
     # filter with speed value. To be computed before
-    query = """
-            DROP TABLE IF EXISTS veloclimat.veloclimatmeter_meteo_preprocess;
-            CREATE TABLE veloclimat.veloclimatmeter_meteo_preprocess AS
+    query = f"""
+            {target}
             SELECT
                 max(id) as id,
                 id_track,
@@ -58,84 +225,54 @@ def clean_veloclimatmeter_data(conn):
                 avg(niveau_sonore_db_a) as niveau_sonore_db_a,
                 avg(distancegauche) as distancegauche,
                 avg(distancedroite) as distancedroite,
-                avg(elevation) as elevation
+                avg(elevation) as elevation,
+                encode(digest(
+                               id_track::TEXT || '|' || sensor_name || '|' || thermo_name,
+                               'md5'
+                       ), 'hex') AS unique_id_track
             FROM (select * from veloclimat.veloclimatmeter_meteo_raw where vitesse/3.6 >= 1) AS FOO
-            WHERE "timestamp" > CAST('2025-06-27 06:00:00.000 +0200' as timestamp)
-              AND "timestamp" < CAST('2025-07-03 23:00:00.000 +0200' as timestamp)
+            WHERE "timestamp" > TIMESTAMPTZ '{CAMPAIGN_START}'
+              AND "timestamp" < TIMESTAMPTZ '{CAMPAIGN_END}'
               AND thermo_name != 'Saint-Jean La Poterie'
+              {track_filter}
             GROUP BY "timestamp", sensor_name, thermo_name, id_track;
-                
-            ALTER TABLE veloclimat.veloclimatmeter_meteo_preprocess ADD COLUMN unique_id_track TEXT;
-
-            UPDATE veloclimat.veloclimatmeter_meteo_preprocess
-            SET unique_id_track = encode(digest(
-                                                 id_track::TEXT || '|' || sensor_name || '|' || thermo_name,
-                                                 'md5'
-                                         ), 'hex');
-            CREATE INDEX idx_veloclimatmeter_meteo_preprocess_unique_id_track
+
+            CREATE INDEX IF NOT EXISTS idx_veloclimatmeter_meteo_preprocess_unique_id_track
                 ON veloclimat.veloclimatmeter_meteo_preprocess (unique_id_track);
 
-            CREATE INDEX idx_veloclimatmeter_meteo_preprocess_id
+            CREATE INDEX IF NOT EXISTS idx_veloclimatmeter_meteo_preprocess_id
                 ON veloclimat.veloclimatmeter_meteo_preprocess (id);
 
-            CREATE INDEX idx_veloclimatmeter_meteo_preprocess_timestamp
+            CREATE INDEX IF NOT EXISTS idx_veloclimatmeter_meteo_preprocess_timestamp
                 ON veloclimat.veloclimatmeter_meteo_preprocess ("timestamp");
 
-            CREATE INDEX idx_veloclimatmeter_meteo_preprocess_the_geom
+            CREATE INDEX IF NOT EXISTS idx_veloclimatmeter_meteo_preprocess_the_geom
                 ON veloclimat.veloclimatmeter_meteo_preprocess using GIST (the_geom);
             """
 
     conn.execute(text(query))
+    _write_watermark(conn, "veloclimat.veloclimatmeter_meteo_raw", max_id)
     conn.commit()
+    _report_table(conn, "veloclimat.veloclimatmeter_meteo_preprocess", start)
 
     print("✅ Table veloclimatmeter_meteo_preprocess created !")
 
 
-def clean_labsticc_sensors_data(conn):
+def _labsticc_speed_select(unique_table):
     """
-    Clean and create two tables: labsticc_sensors_preprocess and labsticc_sensors_reference_preprocess.
-
-    labsticc_sensors_preprocess contains the data collected during mobile thermal measurements.
-
-    The following processes are applied:
-    - Remove duplicate entries in the input data.
-    - Aggregate data by second (using DATE_TRUNC).
-    - Exclude data with GPS accuracy > 25 meters.
-    - Calculate speeds between consecutive points and using a sliding window.
+    Query computing the final speed and the smoothed speed of the labsticc mobile points in one pass
 
-    labsticc_sensors_reference_preprocess stores the data for reference sensors (fixed stations).
-    The following processes are applied:
-    - Aggregate data by second (using DATE_TRUNC).
+    The exact duplicates and the stationary points are removed, the speeds are computed between the
+    consecutive points kept (by unique_id_track) and smoothed with a 5-point sliding window. The query
+    is used by clean_labsticc_sensors_data and by benchmark_preprocess_speed.
 
     Args:
-    conn: SQLAlchemy connection.
-    """
-    print("\n📊 Clean labsticc_sensors_raw...")
-
-    query = """
-            -- 1. Drop temporary tables if they exist
-            DROP TABLE IF EXISTS veloclimat.labsticc_sensors_unique;
-            DROP TABLE IF EXISTS veloclimat.labsticc_sensors_preprocess;
-
-            -- 2. First step: Deduplication and aggregation of raw data
-            CREATE TABLE veloclimat.labsticc_sensors_unique AS
-            SELECT
-                max(id) as id,
-                sensor_name,
-                thermo_name,
-                id_track,
-                DATE_TRUNC('second', "timestamp") as "timestamp",
-                avg(temperature) as temperature,
-                avg(humidity) as humidity,
-                st_centroid(st_collect(THE_GEOM)) as THE_GEOM,
-                avg(accuracy) as accuracy,
-                avg(elevation) as elevation
-            FROM veloclimat.labsticc_sensors_raw
-            WHERE accuracy <= 25 AND thermo_name NOT ILIKE '%reference%' and temperature is not null
-            GROUP BY DATE_TRUNC('second', "timestamp"), sensor_name, thermo_name, id_track;
+        unique_table: table of the points aggregated by second (see clean_labsticc_sensors_data)
 
-            -- 3. Second step: Remove exact duplicates and stationary points
-            CREATE TABLE veloclimat.labsticc_sensors_preprocess AS
+    Returns:
+        str: SELECT query (WITH ... SELECT)
+    """
+    return f"""
             WITH unique_rows AS (
                 SELECT
                     id,
@@ -151,7 +288,7 @@ def clean_labsticc_sensors_data(conn):
                     ROW_NUMBER() OVER (
             PARTITION BY sensor_name, thermo_name, the_geom, "timestamp"
             ORDER BY id) AS row_num
-                FROM veloclimat.labsticc_sensors_unique
+                FROM {unique_table}
                 WHERE thermo_name NOT ILIKE '%reference%'),
 
             -- 4. Calculate speeds between consecutive points
@@ -195,10 +332,53 @@ def clean_labsticc_sensors_data(conn):
 
             -- 5. Remove stationary points (identical geometry and speed = 0)
         filtered_data AS (
-            SELECT *
+            SELECT *, {UNIQUE_ID_TRACK} AS unique_id_track
             FROM speed_data
             WHERE NOT (ST_Equals(the_geom, prev_the_geom) AND (speed_m_s = 0 OR speed_m_s IS NULL))
-        )
+        ),
+
+            -- 6. Calculate speeds between the consecutive points kept after the filter
+            -- We use the unique_id_track as identifier
+            filtered_ranked_data AS (
+                SELECT
+                    id,
+                    id_track,
+                    sensor_name,
+                    thermo_name,
+                    the_geom,
+                    "timestamp",
+                    temperature,
+                    humidity,
+                    accuracy,
+                    elevation,
+                    unique_id_track,
+                    LAG(the_geom) OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_the_geom,
+                    LAG("timestamp") OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_timestamp
+                FROM filtered_data),
+
+            filtered_speed_data AS (
+            SELECT
+                id,
+                id_track,
+                sensor_name,
+                thermo_name,
+                the_geom,
+                "timestamp",
+                temperature,
+                humidity,
+                accuracy,
+                elevation,
+                unique_id_track,
+                CASE
+                    WHEN prev_the_geom IS NOT NULL AND prev_timestamp IS NOT NULL
+                        AND EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp)) > 0
+                    THEN ST_Distance(the_geom, prev_the_geom, TRUE) / EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp))
+                    ELSE NULL
+                END AS speed_m_s
+            FROM filtered_ranked_data)
+
+            -- 7. Smoothed speed, by unique_id_track
+            -- sliding window average on 5 points : ROWS BETWEEN 4 PRECEDING AND CURRENT ROW
             SELECT
                 id,
                 id_track,
@@ -210,79 +390,105 @@ def clean_labsticc_sensors_data(conn):
                 humidity,
                 accuracy,
                 elevation,
-                speed_m_s
-            FROM filtered_data;
+                speed_m_s,
+                unique_id_track,
+                AVG(speed_m_s) OVER (
+                    PARTITION BY unique_id_track
+                    ORDER BY "timestamp"
+                    ROWS BETWEEN 4 PRECEDING AND CURRENT ROW
+                ) AS speed_m_s_smooth
+            FROM filtered_speed_data
+            """
+
+
+def clean_labsticc_sensors_data(conn, incremental=False):
+    """
+    Clean and create two tables: labsticc_sensors_preprocess and labsticc_sensors_reference_preprocess.
 
-            -- 6. Add unique key column and create indexes
-            ALTER TABLE veloclimat.labsticc_sensors_preprocess ADD COLUMN unique_id_track TEXT;
+    labsticc_sensors_preprocess contains the data collected during mobile thermal measurements.
+
+    The following processes are applied:
+    - Remove duplicate entries in the input data.
+    - Aggregate data by second (using DATE_TRUNC).
+    - Exclude data with GPS accuracy > 25 meters.
+    - Calculate speeds between consecutive points and using a sliding window.
+
+    labsticc_sensors_reference_preprocess stores the data for reference sensors (fixed stations).
+    The following processes are applied:
+    - Aggregate data by second (using DATE_TRUNC).
+
+    In incremental mode, only the tracks with new raw rows (id above the watermark) are
+    recomputed (including the speeds and the smoothed speed) and upserted into both tables.
+
+    Args:
+    conn: SQLAlchemy connection.
+    incremental: only process the tracks with new raw rows (default: False)
+    """
+    print("\n📊 Clean labsticc_sensors_raw...")
+    start = time.perf_counter()
+
+    mode, max_id, nb_tracks = _incremental_scope(conn, "veloclimat.labsticc_sensors_raw",
+                                                 ["veloclimat.labsticc_sensors_preprocess",
+                                                  "veloclimat.labsticc_sensors_reference_preprocess"],
+                                                 incremental)
+    if mode == "up_to_date":
+        print("✅ Tables labsticc_sensors_preprocess and labsticc_sensors_reference_preprocess already up to date !")
+        return
+
+    track_filter = ""
+    target = """DROP TABLE IF EXISTS veloclimat.labsticc_sensors_preprocess;
+            CREATE TABLE veloclimat.labsticc_sensors_preprocess AS"""
+    target_reference = """DROP TABLE IF EXISTS veloclimat.labsticc_sensors_reference_preprocess;
+            CREATE TABLE veloclimat.labsticc_sensors_reference_preprocess AS"""
+
+    if mode == "incremental":
+        print(f"   {nb_tracks} new or updated tracks")
+        new_tracks = _new_tracks_filter("unique_id_track")
+        track_filter = f"AND {_new_tracks_filter(UNIQUE_ID_TRACK)}"
+        target = f"""DELETE FROM veloclimat.labsticc_sensors_preprocess WHERE {new_tracks};
+            INSERT INTO veloclimat.labsticc_sensors_preprocess"""
+        target_reference = f"""DELETE FROM veloclimat.labsticc_sensors_reference_preprocess WHERE {new_tracks};
+            INSERT INTO veloclimat.labsticc_sensors_reference_preprocess"""
+
+    query = f"""
+            -- 1. Drop temporary tables if they exist
+            DROP TABLE IF EXISTS veloclimat.labsticc_sensors_unique;
+
+            -- 2. First step: Deduplication and aggregation of raw data
+            CREATE TABLE veloclimat.labsticc_sensors_unique AS
+            SELECT
+                max(id) as id,
+                sensor_name,
+                thermo_name,
+                id_track,
+                DATE_TRUNC('second', "timestamp") as "timestamp",
+                avg(temperature) as temperature,
+                avg(humidity) as humidity,
+                st_centroid(st_collect(THE_GEOM)) as THE_GEOM,
+                avg(accuracy) as accuracy,
+                avg(elevation) as elevation
+            FROM veloclimat.labsticc_sensors_raw
+            WHERE accuracy <= 25 AND thermo_name NOT ILIKE '%reference%' and temperature is not null
+              {track_filter}
+            GROUP BY DATE_TRUNC('second', "timestamp"), sensor_name, thermo_name, id_track;
 
-            UPDATE veloclimat.labsticc_sensors_preprocess
-            SET unique_id_track = encode(digest(
-                                                 id_track::TEXT || '|' || sensor_name || '|' || thermo_name,
-                                                 'md5'
-                                         ), 'hex');
+            -- 3. to 7. Second step: Remove exact duplicates and stationary points, compute the speeds
+            -- and the smoothed speed in one pass (see _labsticc_speed_select)
+            {target}
+            {_labsticc_speed_select("veloclimat.labsticc_sensors_unique")};
 
-            CREATE INDEX idx_labsticc_sensors_preprocess_unique_id_track
+            -- 8. Create indexes
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_preprocess_unique_id_track
                 ON veloclimat.labsticc_sensors_preprocess (unique_id_track);
 
-            CREATE INDEX idx_labsticc_sensors_preprocess_timestamp
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_preprocess_timestamp
                 ON veloclimat.labsticc_sensors_preprocess ("timestamp");
 
-            CREATE INDEX idx_labsticc_sensors_preprocess_the_geom
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_preprocess_the_geom
                 ON veloclimat.labsticc_sensors_preprocess using GIST (the_geom);
 
-            CREATE INDEX idx_labsticc_sensors_preprocess_id
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_preprocess_id
                 ON veloclimat.labsticc_sensors_preprocess (id);
-
-            -- Update the speed_m_s column with the new points
-            -- We use the unique_id_track as identifier
-            UPDATE veloclimat.labsticc_sensors_preprocess AS target
-            SET speed_m_s = speed_data.speed_m_s
-                FROM (
-                -- Calculate speeds between consecutive points
-                WITH ranked_data AS (
-                    SELECT
-                        id,
-                        id_track,
-                        the_geom,
-                        "timestamp",
-                        LAG(the_geom) OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_the_geom,
-                        LAG("timestamp") OVER (PARTITION BY unique_id_track ORDER BY "timestamp") AS prev_timestamp
-                    FROM veloclimat.labsticc_sensors_preprocess
-                ),
-                speed_data AS (
-                    SELECT
-                        id,
-                        CASE
-                            WHEN prev_the_geom IS NOT NULL AND prev_timestamp IS NOT NULL
-                                AND EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp)) > 0
-                            THEN ST_Distance(the_geom, prev_the_geom, TRUE) / EXTRACT(EPOCH FROM ("timestamp" - prev_timestamp))
-                            ELSE NULL
-                        END AS speed_m_s
-                    FROM ranked_data
-                )
-                SELECT id, speed_m_s FROM speed_data
-            ) AS speed_data WHERE target.id = speed_data.id;
-
-            -- Add a column to compute the smoothed speed
-            ALTER TABLE veloclimat.labsticc_sensors_preprocess ADD COLUMN speed_m_s_smooth DOUBLE PRECISION;
-
-            -- Update the speed_m_s_smooth column with a sliding window average
-            -- We use the unique_id_track as identifier
-            -- 5 points : ROWS BETWEEN 4 PRECEDING AND CURRENT ROW
-            UPDATE veloclimat.labsticc_sensors_preprocess AS target
-            SET speed_m_s_smooth = speed_smooth.speed_m_s_smooth
-                FROM (
-                SELECT
-                    id,
-                    AVG(speed_m_s) OVER (
-                        PARTITION BY unique_id_track
-                        ORDER BY "timestamp"
-                        ROWS BETWEEN 4 PRECEDING AND CURRENT ROW
-                    ) AS speed_m_s_smooth
-                FROM veloclimat.labsticc_sensors_preprocess
-            ) AS speed_smooth
-                        WHERE target.id = speed_smooth.id;
                 
             --Clean db
             DROP TABLE IF EXISTS veloclimat.labsticc_sensors_unique;            
@@ -290,13 +496,14 @@ def clean_labsticc_sensors_data(conn):
 
     conn.execute(text(query))
     conn.commit()
+    _report_table(conn, "veloclimat.labsticc_sensors_preprocess", start)
+    start = time.perf_counter()
 
     # Create the reference table
     # data are merge to second
     # Keep reference sensors
-    query = """
-            DROP TABLE IF EXISTS veloclimat.labsticc_sensors_reference_preprocess;
-            CREATE TABLE veloclimat.labsticc_sensors_reference_preprocess AS
+    query = f"""
+            {target_reference}
             SELECT
                 max(id) as id,
                 sensor_name, thermo_name, id_track,
@@ -305,34 +512,35 @@ def clean_labsticc_sensors_data(conn):
                 avg(humidity) as humidity,
                 st_centroid(st_collect(THE_GEOM)) as THE_GEOM,
                 avg(accuracy) as accuracy,
-                avg(elevation) as elevation
+                avg(elevation) as elevation,
+                encode(digest(
+                               id_track::TEXT || '|' || sensor_name || '|' || thermo_name,
+                               'md5'
+                       ), 'hex') AS unique_id_track
             FROM veloclimat.labsticc_sensors_raw
             WHERE  thermo_name  ilike '%reference%' and temperature is not null
+              {track_filter}
             GROUP BY DATE_TRUNC('second', "timestamp"), sensor_name, thermo_name, id_track;
 
-            -- Add unique key column and create indexes
-            ALTER TABLE veloclimat.labsticc_sensors_reference_preprocess ADD COLUMN unique_id_track TEXT;
-            UPDATE veloclimat.labsticc_sensors_reference_preprocess
-            SET unique_id_track = encode(digest(
-                                                 id_track::TEXT || '|' || sensor_name || '|' || thermo_name,
-                                                 'md5'
-                                         ), 'hex');
+            -- Create indexes
 
-            CREATE INDEX idx_labsticc_sensors_reference_preprocess_unique_id_track
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_reference_preprocess_unique_id_track
                 ON veloclimat.labsticc_sensors_reference_preprocess (unique_id_track);
 
-            CREATE INDEX idx_labsticc_sensors_reference_preprocess_timestamp
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_reference_preprocess_timestamp
                 ON veloclimat.labsticc_sensors_reference_preprocess ("timestamp");
 
-            CREATE INDEX idx_labsticc_sensors_reference_preprocess_the_geom
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_reference_preprocess_the_geom
                 ON veloclimat.labsticc_sensors_reference_preprocess using GIST (the_geom);
 
-            CREATE INDEX idx_labsticc_sensors_reference_preprocess_id
+            CREATE INDEX IF NOT EXISTS idx_labsticc_sensors_reference_preprocess_id
                 ON veloclimat.labsticc_sensors_reference_preprocess (id);
             """
 
     conn.execute(text(query))
+    _write_watermark(conn, "veloclimat.labsticc_sensors_raw", max_id)
     conn.commit()
+    _report_table(conn, "veloclimat.labsticc_sensors_reference_preprocess", start)
 
     print("✅ Tables labsticc_sensors_preprocess and labsticc_sensors_reference_preprocess created !")
 
@@ -341,6 +549,10 @@ def main():
     """
     Fonction principale pour nettoyer les données des capteurs
     """
+    parser = argparse.ArgumentParser(description="Nettoyage des données des capteurs")
+    parser.add_argument("--incremental", action="store_true",
+                        help="ne traite que les traces ayant de nouvelles données brutes")
+    args = parser.parse_args()
 
     # Créer l'engine
     engine = create_engine_from_config("config.json")
@@ -352,8 +564,8 @@ def main():
             print("✅ Connexion à PostgreSQL réussie !")
 
             # Nettoyer les deux tables
-            clean_veloclimatmeter_data(conn)
-            clean_labsticc_sensors_data(conn)
+            clean_veloclimatmeter_data(conn, incremental=args.incremental)
+            clean_labsticc_sensors_data(conn, incremental=args.incremental)
 
             print("\n" + "=" * 70)
             print("✅ Nettoyage des données terminé avec succès !")
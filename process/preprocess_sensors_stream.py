@@ -0,0 +1,357 @@
+import argparse
+import hashlib
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from process.utils import copy_to_table, create_engine_from_config, ewkb_points
+
+# Version Python du nettoyage de labsticc_sensors_raw (preprocess_data_sensors.clean_labsticc_sensors_data)
+#
+# Les données brutes sont lues en flux avec un curseur côté serveur, triées par trace.
+# Chaque trace (sensor_name, thermo_name, id_track) est nettoyée par des noyaux NumPy
+# sur des tableaux contigus puis écrite avec COPY au format binaire (utils.copy_to_table).
+# La mémoire utilisée est bornée par la plus grande trace et non par la table.
+
+# Précision GPS maximale acceptée (mètres)
+MAX_ACCURACY = 25
+
+# Nombre de points de la moyenne glissante de la vitesse
+SMOOTH_WINDOW = 5
+
+EARTH_RADIUS = 6371008.8
+
+RAW_COLUMNS = ["id", "epoch", "temperature", "humidity", "x", "y", "accuracy", "elevation"]
+
+OUTPUT_COLUMNS = ["id", "id_track", "sensor_name", "thermo_name", "the_geom", "timestamp", "temperature",
+                  "humidity", "accuracy", "elevation", "speed_m_s", "unique_id_track", "speed_m_s_smooth"]
+
+
+def stream_tracks(conn, raw_table="veloclimat.labsticc_sensors_raw", chunk_size=50000):
+    """
+    Lit la table brute en flux et retourne les traces une par une
+
+    Args:
+        conn: connexion SQLAlchemy
+        raw_table: table brute des capteurs labsticc
+        chunk_size: nombre de lignes lues par aller-retour avec le serveur
+
+    Yields:
+        Tuple ((sensor_name, thermo_name, id_track), dict de tableaux NumPy RAW_COLUMNS triés par timestamp)
+    """
+    result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(f"""
+            SELECT sensor_name, thermo_name, id_track,
+                   id, EXTRACT(EPOCH FROM "timestamp")::float8 AS epoch,
+                   temperature, humidity, ST_X(the_geom) AS x, ST_Y(the_geom) AS y, accuracy, elevation
+            FROM {raw_table}
+            WHERE thermo_name NOT ILIKE '%reference%'
+            ORDER BY sensor_name, thermo_name, id_track, "timestamp"
+            """))
+
+    current_key = None
+    buffer = []
+    for rows in result.partitions():
+        for row in rows:
+            key = (row[0], row[1], row[2])
+            if key != current_key:
+                if buffer:
+                    yield current_key, _to_arrays(buffer)
+                current_key = key
+                buffer = []
+            buffer.append(row[3:])
+    if buffer:
+        yield current_key, _to_arrays(buffer)
+
+
+def geometry_srid(conn, table_name, geometry_column="the_geom"):
+    """
+    SRID de la colonne géométrique d'une table
+
+    Le SRID est lu dans le type de la colonne (geometry(Point, 4326)) ou, à défaut,
+    sur la première ligne de la table.
+
+    Returns:
+        int: SRID (0 si inconnu)
+    """
+    srid = conn.execute(text("""
+            SELECT postgis_typmod_srid(atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass(:table_name) AND attname = :column AND NOT attisdropped
+            """), {"table_name": table_name, "column": geometry_column}).scalar()
+    if not srid:
+        srid = conn.execute(text(f"SELECT ST_SRID({geometry_column}) FROM {table_name} LIMIT 1")).scalar()
+    return srid or 0
+
+
+def _to_arrays(rows):
+    """
+    Convertit les lignes d'une trace en tableaux NumPy contigus (NULL -> NaN)
+    """
+    values = np.array(rows, dtype=np.float64).reshape(-1, len(RAW_COLUMNS))
+    return {name: np.ascontiguousarray(values[:, i]) for i, name in enumerate(RAW_COLUMNS)}
+
+
+def _group_mean(values, starts):
+    """
+    Moyenne par groupe de lignes consécutives en ignorant les NaN (comme AVG en SQL)
+    """
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def filter_accuracy(track):
+    """
+    Exclut les points sans température ou avec une précision GPS > MAX_ACCURACY mètres
+    """
+    keep = (track["accuracy"] <= MAX_ACCURACY) & ~np.isnan(track["temperature"])
+    return {name: values[keep] for name, values in track.items()}
+
+
+def aggregate_by_second(track):
+    """
+    Agrège les points d'une même seconde (DATE_TRUNC('second')) : moyenne des valeurs,
+    centroïde des positions et identifiant maximum
+    """
+    if len(track["epoch"]) == 0:
+        return track
+
+    seconds = np.floor(track["epoch"])
+    starts = np.flatnonzero(np.r_[True, seconds[1:] != seconds[:-1]])
+
+    aggregated = {name: _group_mean(track[name], starts)
+                  for name in ("temperature", "humidity", "x", "y", "accuracy", "elevation")}
+    aggregated["id"] = np.maximum.reduceat(track["id"], starts)
+    aggregated["epoch"] = seconds[starts]
+    return aggregated
+
+
+def haversine_speed(x, y, epoch):
+    """
+    Vitesse (m/s) entre chaque point et le point précédent de la trace
+
+    Returns:
+        np.ndarray: vitesses, NaN pour le premier point ou si l'intervalle de temps est nul
+    """
+    speed = np.full(len(x), np.nan)
+    if len(x) < 2:
+        return speed
+
+    lon1, lat1 = np.radians(x[:-1]), np.radians(y[:-1])
+    lon2, lat2 = np.radians(x[1:]), np.radians(y[1:])
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+    dt = np.diff(epoch)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed[1:] = np.where(dt > 0, distance / dt, np.nan)
+    return speed
+
+
+def remove_stationary(track):
+    """
+    Supprime les points immobiles : même position que le point précédent et vitesse nulle
+
+    Comme dans la version SQL, le premier point de la trace (sans point précédent) est aussi exclu.
+    """
+    speed = haversine_speed(track["x"], track["y"], track["epoch"])
+    same_position = np.zeros(len(speed), dtype=bool)
+    same_position[1:] = (track["x"][1:] == track["x"][:-1]) & (track["y"][1:] == track["y"][:-1])
+
+    keep = ~(same_position & ((speed == 0) | np.isnan(speed)))
+    if len(keep):
+        keep[0] = False
+    return {name: values[keep] for name, values in track.items()}
+
+
+def rolling_mean(values, window=SMOOTH_WINDOW):
+    """
+    Moyenne glissante sur les window derniers points (ROWS BETWEEN window-1 PRECEDING AND CURRENT ROW),
+    en ignorant les NaN
+    """
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0))
+    counts = np.cumsum(valid.astype(np.int64))
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def clean_track(track):
+    """
+    Applique l'ensemble des noyaux de nettoyage à une trace
+
+    Returns:
+        dict: tableaux de la trace nettoyée avec speed_m_s et speed_m_s_smooth
+    """
+    track = filter_accuracy(track)
+    track = aggregate_by_second(track)
+    track = remove_stationary(track)
+    track["speed_m_s"] = haversine_speed(track["x"], track["y"], track["epoch"])
+    track["speed_m_s_smooth"] = rolling_mean(track["speed_m_s"])
+    return track
+
+
+def _unique_id_track(id_track, sensor_name, thermo_name):
+    """
+    md5(id_track::TEXT || '|' || sensor_name || '|' || thermo_name), None si une des valeurs est NULL
+    (comme la concaténation SQL)
+    """
+    if id_track is None or sensor_name is None or thermo_name is None:
+        return None
+    return hashlib.md5(f"{id_track}|{sensor_name}|{thermo_name}".encode()).hexdigest()
+
+
+def _track_columns(key, track, srid=4326):
+    """
+    Colonnes de sortie d'une trace nettoyée, dans l'ordre de OUTPUT_COLUMNS
+
+    Les valeurs NULL de la clé de la trace sont des None (tableaux object) écrits en NULL par COPY.
+    """
+    sensor_name, thermo_name, id_track = key
+    nb_points = len(track["epoch"])
+
+    return {
+        "id": track["id"].astype(np.int32),
+        "id_track": np.full(nb_points, id_track, dtype=object),
+        "sensor_name": np.full(nb_points, sensor_name, dtype=object),
+        "thermo_name": np.full(nb_points, thermo_name, dtype=object),
+        "the_geom": ewkb_points(track["x"], track["y"], srid),
+        "timestamp": track["epoch"].astype(np.int64).astype("datetime64[s]"),
+        "temperature": track["temperature"],
+        "humidity": track["humidity"],
+        "accuracy": track["accuracy"],
+        "elevation": track["elevation"],
+        "speed_m_s": track["speed_m_s"],
+        "unique_id_track": np.full(nb_points, _unique_id_track(id_track, sensor_name, thermo_name), dtype=object),
+        "speed_m_s_smooth": track["speed_m_s_smooth"],
+    }
+
+
+def _copy_tracks(conn, output_table, tracks):
+    """
+    Envoie les traces en attente dans output_table avec COPY (format binaire)
+    """
+    columns = {name: np.concatenate([track[name] for track in tracks]) for name in OUTPUT_COLUMNS}
+    copy_to_table(conn, output_table, columns)
+
+
+def clean_labsticc_sensors_stream(conn, output_table="veloclimat.labsticc_sensors_preprocess",
+                                  raw_table="veloclimat.labsticc_sensors_raw", chunk_size=50000):
+    """
+    Nettoie labsticc_sensors_raw en Python, trace par trace, et écrit le résultat avec COPY
+
+    Traitements (identiques à clean_labsticc_sensors_data) :
+    - Exclusion des points avec une précision GPS > 25 mètres ou sans température
+    - Agrégation des points par seconde
+    - Calcul des vitesses entre points consécutifs (distance haversine)
+    - Suppression des points immobiles
+    - Recalcul des vitesses et moyenne glissante sur 5 points
+
+    Différences avec la version SQL :
+    - la distance est calculée sur la sphère (haversine) et non sur l'ellipsoïde
+    - les doublons sont recherchés à l'intérieur d'une trace et non entre traces
+
+    La géométrie de sortie a le SRID de raw_table ; les distances haversine supposent des
+    coordonnées en degrés (longitude, latitude).
+
+    Args:
+        conn: connexion SQLAlchemy
+        output_table: table de sortie (même structure que labsticc_sensors_preprocess)
+        raw_table: table brute
+        chunk_size: nombre de lignes lues et écrites par lot
+    """
+    print(f"\n📊 Nettoyage en flux de {raw_table}...")
+    start = time.perf_counter()
+
+    srid = geometry_srid(conn, raw_table)
+    conn.execute(text(f"""
+            DROP TABLE IF EXISTS {output_table};
+            CREATE TABLE {output_table} (
+                id INTEGER,
+                id_track INTEGER,
+                sensor_name VARCHAR,
+                thermo_name VARCHAR,
+                the_geom GEOMETRY(POINT, {srid}),
+                "timestamp" TIMESTAMPTZ,
+                temperature DOUBLE PRECISION,
+                humidity DOUBLE PRECISION,
+                accuracy DOUBLE PRECISION,
+                elevation DOUBLE PRECISION,
+                speed_m_s DOUBLE PRECISION,
+                unique_id_track TEXT,
+                speed_m_s_smooth DOUBLE PRECISION
+            );
+            """))
+
+    nb_tracks = 0
+    nb_rows = 0
+    pending = []
+    buffered_rows = 0
+
+    for key, track in stream_tracks(conn, raw_table, chunk_size):
+        track = clean_track(track)
+        pending.append(_track_columns(key, track, srid))
+        nb_tracks += 1
+        nb_rows += len(track["epoch"])
+        buffered_rows += len(track["epoch"])
+
+        if buffered_rows >= chunk_size:
+            _copy_tracks(conn, output_table, pending)
+            pending = []
+            buffered_rows = 0
+
+    if buffered_rows:
+        _copy_tracks(conn, output_table, pending)
+
+    # Les index sont créés après le chargement
+    conn.execute(text(f"""
+            CREATE INDEX ON {output_table} (unique_id_track);
+            CREATE INDEX ON {output_table} ("timestamp");
+            CREATE INDEX ON {output_table} USING GIST (the_geom);
+            CREATE INDEX ON {output_table} (id);
+            """))
+    conn.commit()
+
+    print(f"✅ {nb_tracks} traces, {nb_rows} points écrits dans {output_table} "
+          f"en {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nettoyage en flux des données labsticc")
+    parser.add_argument("--output-table", default="veloclimat.labsticc_sensors_preprocess")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="nombre de lignes par lot")
+    args = parser.parse_args()
+
+    # Créer l'engine
+    engine = create_engine_from_config("config.json")
+
+    try:
+        with engine.connect() as conn:
+            # Tester la connexion
+            conn.execute(text("SELECT 1"))
+            print("✅ Connexion à PostgreSQL réussie !")
+
+            clean_labsticc_sensors_stream(conn, output_table=args.output_table, chunk_size=args.chunk_size)
+
+            print("\n" + "=" * 70)
+            print("✅ Nettoyage des données terminé avec succès !")
+            print("=" * 70)
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur SQL : {e}")
+        return False
+
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
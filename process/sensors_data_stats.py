@@ -1,6 +1,9 @@
-from sqlalchemy import  text
+from sqlalchemy import (TIMESTAMP, Date, Integer, Text, and_, any_, bindparam, case, cast, column, extract, func,
+                        literal_column, null, select, table, text, tuple_, values)
+from sqlalchemy.dialects.postgresql import ARRAY
 
-from process.utils import create_engine_from_config
+from process.sources import SourceSpec
+from process.utils import create_engine_from_config, create_table_as
 
 
 # Config file structure
@@ -14,10 +17,286 @@ from process.utils import create_engine_from_config
 #     }
 # }
 
-def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges, output_table=None):
+# Colonnes disponibles pour le détail des statistiques (breakdowns)
+BREAKDOWN_COLUMNS = {
+    "sensor_name": "sensor_name",
+    "thermo_name": "thermo_name",
+    "day": "local_day",
+}
+
+
+# Colonnes dont les valeurs <= 0 sont ignorées (capteurs non renseignés)
+POSITIVE_ONLY_COLUMNS = ['temperature_top', 'temperature_bot']
+
+# Agrégats horaires persistants des tables capteurs
+ROLLUP_TABLE = "veloclimat.sensor_stats_hourly"
+
+# Dernier id agrégé par table source et par colonne
+ROLLUP_WATERMARK_TABLE = "veloclimat.sensor_stats_hourly_watermarks"
+
+# Fuseau horaire des heures locales des plages horaires
+LOCAL_TIMEZONE = literal_column("'Europe/Paris'")
+
+ROLLUP = table("sensor_stats_hourly", column("source_table"), column("local_day"), column("local_hour"),
+               column("sensor_name"), column("thermo_name"), column("column_name"), column("nb_rows"),
+               column("n"), column("sum_value"), column("min_value"), column("max_value"), schema="veloclimat")
+
+
+def _column_value(col, preparer):
+    """
+    Expression SQL de la valeur d'une colonne prise en compte dans les statistiques
+
+    Args:
+        col: colonne vérifiée dans le catalogue (voir SourceSpec.reflect)
+        preparer: IdentifierPreparer du dialecte, qui échappe le nom de la colonne
+    """
+    quoted = preparer.quote(col)
+    if col in POSITIVE_ONLY_COLUMNS:
+        return f'CASE WHEN {quoted} > 0 THEN {quoted} END'
+    return quoted
+
+
+def _value_expression(source_column):
+    """
+    Valeur d'une colonne prise en compte dans les statistiques (requêtes SQLAlchemy Core)
+    """
+    if source_column.name in POSITIVE_ONLY_COLUMNS:
+        return case((source_column > literal_column("0"), source_column))
+    return source_column
+
+
+def refresh_hourly_rollup(conn, table_name, columns, rebuild=False):
+    """
+    Met à jour les agrégats horaires d'une table capteurs dans ROLLUP_TABLE
+
+    Une ligne par (table source, jour local, heure locale, sensor_name, thermo_name, colonne) avec
+    le nombre de lignes, le nombre de valeurs, leur somme, la somme de leurs carrés, le minimum et le maximum.
+    Seules les lignes dont l'id dépasse le dernier id agrégé pour la colonne sont lues : elles sont
+    fusionnées avec les agrégats existants (la table source ne doit recevoir que des ajouts).
+    Une colonne absente des agrégats est calculée sur toute la table.
+    La table et les colonnes sont vérifiées dans le catalogue avant d'être écrites (échappées) dans la requête ;
+    les noms des colonnes agrégées sont des paramètres liés.
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: table source (ex: 'veloclimat.labsticc_sensors_raw')
+        columns: liste des colonnes à agréger
+        rebuild: supprime et recalcule les agrégats de ces colonnes
+
+    Returns:
+        int: nombre de lignes d'agrégats insérées ou mises à jour
+    """
+    # Vérifier la table et les colonnes dans le catalogue
+    source_table, = SourceSpec(table_name, ["id", "sensor_name", "thermo_name"] + list(columns)).reflect(conn)
+    preparer = conn.dialect.identifier_preparer
+    quoted_table = preparer.format_table(source_table)
+
+    conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+                source_table TEXT NOT NULL,
+                local_day DATE NOT NULL,
+                local_hour INTEGER NOT NULL,
+                sensor_name TEXT NOT NULL,
+                thermo_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                nb_rows BIGINT NOT NULL,
+                n BIGINT NOT NULL,
+                sum_value DOUBLE PRECISION,
+                sum_sq DOUBLE PRECISION,
+                min_value DOUBLE PRECISION,
+                max_value DOUBLE PRECISION,
+                PRIMARY KEY (source_table, column_name, local_day, local_hour, sensor_name, thermo_name)
+            );
+
+            CREATE TABLE IF NOT EXISTS {ROLLUP_WATERMARK_TABLE} (
+                source_table TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                last_id BIGINT NOT NULL,
+                updated_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (source_table, column_name)
+            );
+            """))
+
+    if rebuild:
+        conn.execute(text(f"""
+                DELETE FROM {ROLLUP_TABLE} WHERE source_table = :source_table AND column_name = ANY(:columns);
+                DELETE FROM {ROLLUP_WATERMARK_TABLE} WHERE source_table = :source_table AND column_name = ANY(:columns);
+                """), {"source_table": table_name, "columns": list(columns)})
+
+    watermarks = dict(conn.execute(text(f"""
+            SELECT column_name, last_id FROM {ROLLUP_WATERMARK_TABLE} WHERE source_table = :source_table
+            """), {"source_table": table_name}).fetchall())
+    max_id = conn.execute(select(func.max(source_table.c.id))).scalar()
+    if max_id is None:
+        return 0
+
+    # Les colonnes au même dernier id sont agrégées en une seule lecture
+    columns_by_watermark = {}
+    for col in columns:
+        columns_by_watermark.setdefault(watermarks.get(col, 0), []).append(col)
+
+    nb_groups = 0
+    for last_id, watermark_columns in columns_by_watermark.items():
+        if last_id >= max_id:
+            continue
+
+        values = ", ".join(f"(CAST(:column_{i} AS text), {_column_value(col, preparer)})"
+                           for i, col in enumerate(watermark_columns))
+        parameters = {f"column_{i}": col for i, col in enumerate(watermark_columns)}
+        nb_groups += conn.execute(text(f"""
+                INSERT INTO {ROLLUP_TABLE} AS r
+                    (source_table, local_day, local_hour, sensor_name, thermo_name, column_name,
+                     nb_rows, n, sum_value, sum_sq, min_value, max_value)
+                SELECT :source_table, local_day, local_hour, sensor_key, thermo_key, v.column_name,
+                       COUNT(*), COUNT(v.value), SUM(v.value), SUM(v.value * v.value), MIN(v.value), MAX(v.value)
+                FROM (
+                    SELECT *,
+                           CAST(local_ts AS DATE) AS local_day,
+                           EXTRACT(HOUR FROM local_ts)::integer AS local_hour
+                    FROM (
+                        SELECT *,
+                               "timestamp" AT TIME ZONE 'Europe/Paris' AS local_ts,
+                               COALESCE(sensor_name::text, '') AS sensor_key,
+                               COALESCE(thermo_name::text, '') AS thermo_key
+                        FROM {quoted_table}
+                        WHERE id > :last_id AND id <= :max_id
+                    ) AS t
+                ) AS p
+                CROSS JOIN LATERAL (VALUES {values}) AS v(column_name, value)
+                GROUP BY local_day, local_hour, sensor_key, thermo_key, v.column_name
+                ON CONFLICT (source_table, column_name, local_day, local_hour, sensor_name, thermo_name)
+                DO UPDATE SET
+                    nb_rows = r.nb_rows + EXCLUDED.nb_rows,
+                    n = r.n + EXCLUDED.n,
+                    sum_value = COALESCE(r.sum_value, 0) + COALESCE(EXCLUDED.sum_value, 0),
+                    sum_sq = COALESCE(r.sum_sq, 0) + COALESCE(EXCLUDED.sum_sq, 0),
+                    min_value = LEAST(r.min_value, EXCLUDED.min_value),
+                    max_value = GREATEST(r.max_value, EXCLUDED.max_value)
+                """), {"source_table": table_name, "last_id": last_id, "max_id": max_id, **parameters}).rowcount
+
+        conn.execute(text(f"""
+                INSERT INTO {ROLLUP_WATERMARK_TABLE} (source_table, column_name, last_id)
+                SELECT :source_table, unnest(CAST(:columns AS text[])), :max_id
+                ON CONFLICT (source_table, column_name) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = now()
+                """), {"source_table": table_name, "columns": watermark_columns, "max_id": max_id})
+
+    conn.commit()
+    return nb_groups
+
+
+def _range_name(start_hour, end_hour):
+    return f"{start_hour:02d}h_{end_hour:02d}h"
+
+
+def _range_hours(start_hour, end_hour):
+    """
+    Heures locales couvertes par une plage (ex: (21, 6) → 21h-23h et 0h-5h)
+    """
+    if start_hour < end_hour:
+        return list(range(start_hour, end_hour))
+    return list(range(start_hour, 24)) + list(range(0, end_hour))
+
+
+def _source_select(spec, source_table, columns, breakdown_columns):
+    """
+    Mesures de la table source avec leur heure et leur jour locaux, dans la fenêtre de temps de la source
+    """
+    local_ts = func.timezone(LOCAL_TIMEZONE, source_table.c[spec.time_column])
+    measures = select(*[source_table.c[col] for col in columns + breakdown_columns], local_ts.label("local_ts"))
+    if spec.time_filter(source_table) is not None:
+        measures = measures.where(spec.time_filter(source_table))
+    measures = measures.subquery("t")
+
+    return select(
+        *[measures.c[col] for col in columns + breakdown_columns],
+        cast(extract("hour", measures.c.local_ts), Integer).label("hour"),
+        cast(measures.c.local_ts, Date).label("local_day"),
+    ).subquery("p")
+
+
+def _rollup_select(table_name, columns, time_window):
+    """
+    Agrégats horaires (ROLLUP_TABLE) d'une table source et de ses colonnes, dans la fenêtre de temps
+    """
+    conditions = [ROLLUP.c.source_table == bindparam("source_table", table_name),
+                  ROLLUP.c.column_name == any_(bindparam("columns", columns, type_=ARRAY(Text)))]
+    if time_window:
+        local_hour = func.timezone(LOCAL_TIMEZONE,
+                                   ROLLUP.c.local_day + ROLLUP.c.local_hour * literal_column("INTERVAL '1 hour'"))
+        window_start = bindparam("window_start", time_window[0], type_=TIMESTAMP(timezone=True))
+        conditions += [local_hour >= func.date_trunc(literal_column("'hour'"), window_start),
+                       local_hour < bindparam("window_end", time_window[1], type_=TIMESTAMP(timezone=True))]
+
+    return select(
+        ROLLUP.c.local_day, ROLLUP.c.local_hour.label("hour"), ROLLUP.c.sensor_name, ROLLUP.c.thermo_name,
+        ROLLUP.c.column_name, ROLLUP.c.nb_rows, ROLLUP.c.n, ROLLUP.c.sum_value, ROLLUP.c.min_value,
+        ROLLUP.c.max_value,
+    ).where(and_(*conditions)).subquery("p")
+
+
+def _groups_select(source, aggregates, hours_ranges, breakdowns):
+    """
+    Statistiques par groupe (total, plage horaire, plage et détail) en une seule lecture avec GROUPING SETS
+
+    Args:
+        source: sous-requête des mesures (colonnes hour, local_day et colonnes des détails)
+        aggregates: agrégats calculés pour chaque groupe
+        hours_ranges: liste de tuples (start_hour, end_hour)
+        breakdowns: liste de détails (clés de BREAKDOWN_COLUMNS)
+    """
+    # Association heure locale -> plage horaire (les plages peuvent se chevaucher)
+    hours, range_ids = [], []
+    for range_id, (start_hour, end_hour) in enumerate(hours_ranges):
+        range_hours = _range_hours(start_hour, end_hour)
+        hours += range_hours
+        range_ids += [range_id] * len(range_hours)
+    hour_ranges = func.unnest(bindparam("hours", hours, type_=ARRAY(Integer)),
+                              bindparam("range_ids", range_ids, type_=ARRAY(Integer))
+                              ).table_valued("hour", "range_id").render_derived(name="h")
+
+    breakdown_columns = [source.c[BREAKDOWN_COLUMNS[breakdown]] for breakdown in breakdowns]
+    is_grouped = [func.grouping(breakdown_column) == literal_column("0") for breakdown_column in breakdown_columns]
+    level = case(
+        (func.grouping(hour_ranges.c.range_id) == literal_column("1"), literal_column("'total'")),
+        *[(grouped, literal_column(f"'{breakdown}'")) for grouped, breakdown in zip(is_grouped, breakdowns)],
+        else_=literal_column("'range'"),
+    )
+    breakdown_value = case(
+        *[(grouped, func.nullif(cast(breakdown_column, Text), literal_column("''")))
+          for grouped, breakdown_column in zip(is_grouped, breakdown_columns)]
+    ) if breakdowns else cast(null(), Text)
+
+    return (
+        select(
+            level.label("level"),
+            breakdown_value.label("breakdown_value"),
+            hour_ranges.c.range_id,
+            func.count(source.c.local_day.distinct()).label("nombre_jours"),
+            func.min(source.c.hour).label("heure_min"),
+            func.max(source.c.hour).label("heure_max"),
+            *aggregates,
+        )
+        .select_from(source.outerjoin(hour_ranges, hour_ranges.c.hour == source.c.hour))
+        .group_by(func.grouping_sets(
+            tuple_(),
+            tuple_(hour_ranges.c.range_id),
+            *[tuple_(hour_ranges.c.range_id, breakdown_column) for breakdown_column in breakdown_columns]))
+    )
+
+
+def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges, output_table=None,
+                                 breakdowns=None, use_rollup=False, time_window=None):
     """
     Calcule les stats pour plusieurs plages horaires en une seule requête
 
+    L'heure locale (Europe/Paris) est calculée une fois par ligne puis associée aux plages qui la
+    contiennent par une jointure sur une table heure -> plage (les plages peuvent se chevaucher).
+    Toutes les statistiques sont calculées en une seule lecture de la table avec GROUPING SETS :
+    par plage et, si demandé, par capteur, par thermo_name et par jour.
+
+    Les requêtes sont construites avec SQLAlchemy Core : la table et les colonnes sont vérifiées dans le
+    catalogue et les valeurs (plages horaires, fenêtre de temps) sont des paramètres liés.
+
     Args:
         config_path: chemin vers le fichier config.json
         table_name: nom de la table (ex: 'schema.table')
@@ -26,6 +305,14 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
                      ex: [(8, 12), (14, 18), (20, 24)]
                      ex: [(21, 6)] → capture 21:00-23:59 ET 00:00-05:59
         output_table: nom optionnel de la table de sortie. Si None, affiche seulement les résultats.
+        breakdowns: liste optionnelle de détails parmi 'sensor_name', 'thermo_name' et 'day'.
+                    Les statistiques détaillées sont écrites dans {output_table}_breakdown
+                    (une ligne par détail et par plage) ou affichées si output_table est None.
+        use_rollup: calcule les statistiques à partir des agrégats horaires (ROLLUP_TABLE), mis à jour
+                    au préalable avec les nouvelles lignes de la table, au lieu de lire toute la table.
+        time_window: tuple optionnel (début, fin) de timestamptz (datetime ou texte) limitant les
+                     mesures à [début, fin). Sur une table partitionnée par "timestamp", seules les
+                     partitions de la fenêtre sont lues. Avec use_rollup, la fenêtre est arrondie à l'heure.
 
     Returns:
         Row object avec les statistiques, ou None en cas d'erreur
@@ -34,32 +321,22 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
     # Charger la configuration
     engine = create_engine_from_config(config_path)
 
-    # Valider table_name pour éviter SQL injection
-    table_parts = table_name.split('.')
-    for part in table_parts:
-        if not part.isidentifier():
-            raise ValueError(f"Invalid table name: {table_name}")
-
-    # Valider output_table si fourni
+    # Valider output_table si fourni (la table source et les colonnes sont vérifiées dans le catalogue)
     if output_table:
         output_parts = output_table.split('.')
         for part in output_parts:
             if not part.isidentifier():
                 raise ValueError(f"Invalid output table name: {output_table}")
 
-    valid_cols = [col.strip() for col in columns if col.strip().isidentifier()]
+    valid_cols = list(dict.fromkeys(col.strip() for col in columns if col.strip()))
     if not valid_cols:
         raise ValueError("Aucune colonne valide spécifiée")
 
-    select_clauses = []
+    breakdowns = list(breakdowns or [])
+    for breakdown in breakdowns:
+        if breakdown not in BREAKDOWN_COLUMNS:
+            raise ValueError(f"Détail invalide: {breakdown} (attendu: {', '.join(BREAKDOWN_COLUMNS)})")
 
-    # Ajouter les stats globales UNE SEULE FOIS (en dehors de la boucle)
-    # Utiliser 'Europe/Paris' pour les heures et les dates
-    select_clauses.append('COUNT(DISTINCT CAST("timestamp" AT TIME ZONE \'Europe/Paris\' AS DATE)) as nombre_jours')
-    select_clauses.append('MIN(EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\')) as heure_min')
-    select_clauses.append('MAX(EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\')) as heure_max')
-
-    # Pour chaque plage horaire
     for start_hour, end_hour in hours_ranges:
         # Validation: heures entre 0 et 24
         if not (0 <= start_hour <= 24 and 0 <= end_hour <= 24):
@@ -68,50 +345,103 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
         if start_hour == end_hour:
             raise ValueError(f"start_hour ne peut pas être égal à end_hour: {start_hour}")
 
-        range_name = f"{start_hour:02d}h_{end_hour:02d}h"
-
-        # Prise en compte des plages cross-midnight (ex: 21-6 = 21h à 23h59 ET 0h à 5h59)
-        if start_hour < end_hour:
-            # Plage normale (ex: 12-18)
-            where_clause = f'EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\') >= {start_hour} AND EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\') < {end_hour}'
-        else:
-            # Plage cross-midnight (ex: 21-6 = 21h ou plus OU moins de 6h)
-            where_clause = f'(EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\') >= {start_hour} OR EXTRACT(HOUR FROM "timestamp" AT TIME ZONE \'Europe/Paris\') < {end_hour})'
-
-        for col in valid_cols:
-            # Ajouter un filtre supplémentaire pour TEMPERATURE_TOP et TEMPERATURE_BOT (ignorer <= 0)
-            if col in ['temperature_top', 'temperature_bot']:
-                col_where_clause = f'{where_clause} AND "{col}" > 0'
-            else:
-                col_where_clause = where_clause
-
-            select_clauses.append(f'max("{col}") FILTER (WHERE {col_where_clause}) as max_{col}_{range_name}')
-            select_clauses.append(f'min("{col}") FILTER (WHERE {col_where_clause}) as min_{col}_{range_name}')
-            select_clauses.append(f'avg("{col}") FILTER (WHERE {col_where_clause}) as avg_{col}_{range_name}')
-
-        select_clauses.append(f'count(*) FILTER (WHERE {where_clause}) as count_{range_name}')
-
-    query = f"SELECT {', '.join(select_clauses)} FROM {table_name}"
+    # Colonnes des détails lues dans la table source (le jour est calculé à partir de "timestamp")
+    breakdown_columns = [BREAKDOWN_COLUMNS[breakdown] for breakdown in breakdowns
+                         if BREAKDOWN_COLUMNS[breakdown] != "local_day"]
+    rollup_columns = ["id", "sensor_name", "thermo_name"] if use_rollup else []
+    spec = SourceSpec(table_name, valid_cols + breakdown_columns + rollup_columns, time_window=time_window)
 
     try:
         with engine.connect() as conn:
+            # Vérifier la table et les colonnes dans le catalogue
+            source_table, = spec.reflect(conn)
+
+            if use_rollup:
+                refresh_hourly_rollup(conn, table_name, valid_cols)
+
+                # Fusion des agrégats horaires : la moyenne est la somme des sommes sur la somme des effectifs
+                source = _rollup_select(table_name, valid_cols, time_window)
+                nb_rows = func.sum(source.c.nb_rows).filter(source.c.column_name == valid_cols[0])
+                aggregates = [nb_rows.label("nb_rows")]
+                for col in valid_cols:
+                    is_column = source.c.column_name == col
+                    aggregates += [
+                        func.max(source.c.max_value).filter(is_column).label(f"max_{col}"),
+                        func.min(source.c.min_value).filter(is_column).label(f"min_{col}"),
+                        (func.sum(source.c.sum_value).filter(is_column)
+                         / func.nullif(func.sum(source.c.n).filter(is_column), literal_column("0"))).label(f"avg_{col}"),
+                    ]
+            else:
+                source = _source_select(spec, source_table, valid_cols, breakdown_columns)
+                aggregates = [func.count().label("nb_rows")]
+                for col in valid_cols:
+                    value = _value_expression(source.c[col])
+                    aggregates += [func.max(value).label(f"max_{col}"),
+                                   func.min(value).label(f"min_{col}"),
+                                   func.avg(value).label(f"avg_{col}")]
+
+            # Statistiques par groupe, calculées en une seule lecture de la table
+            groups = _groups_select(source, aggregates, hours_ranges, breakdowns)
+            create_table_as(conn, "stats_groups", groups, temporary=True)
+            stats_groups = table("stats_groups", *[column(col.name) for col in groups.selected_columns])
+
+            # Mise en forme d'une ligne par table (colonnes {stat}_{colonne}_{plage}) à partir des groupes
+            is_total = stats_groups.c.level == literal_column("'total'")
+            select_clauses = [
+                func.max(stats_groups.c.nombre_jours).filter(is_total).label("nombre_jours"),
+                func.min(stats_groups.c.heure_min).filter(is_total).label("heure_min"),
+                func.max(stats_groups.c.heure_max).filter(is_total).label("heure_max"),
+            ]
+            for range_id, (start_hour, end_hour) in enumerate(hours_ranges):
+                range_name = _range_name(start_hour, end_hour)
+                is_range = and_(stats_groups.c.level == literal_column("'range'"),
+                                stats_groups.c.range_id == literal_column(str(range_id)))
+                for col in valid_cols:
+                    for stat in ("max", "min", "avg"):
+                        select_clauses.append(func.max(stats_groups.c[f"{stat}_{col}"]).filter(is_range)
+                                              .label(f"{stat}_{col}_{range_name}"))
+                select_clauses.append(func.coalesce(func.max(stats_groups.c.nb_rows).filter(is_range),
+                                                    literal_column("0")).label(f"count_{range_name}"))
+            query = select(*select_clauses)
+
+            range_names = values(column("range_id", Integer), column("range_name", Text), name="r").data(
+                [(range_id, _range_name(start_hour, end_hour))
+                 for range_id, (start_hour, end_hour) in enumerate(hours_ranges)])
+            breakdown_query = (
+                select(stats_groups.c.level.label("breakdown"), stats_groups.c.breakdown_value,
+                       range_names.c.range_name, stats_groups.c.nb_rows.label("count"),
+                       *[stats_groups.c[f"{stat}_{col}"] for col in valid_cols for stat in ("max", "min", "avg")])
+                .select_from(stats_groups.join(range_names, range_names.c.range_id == stats_groups.c.range_id))
+                .where(stats_groups.c.level.not_in([literal_column("'total'"), literal_column("'range'")]))
+                .order_by(stats_groups.c.level, stats_groups.c.breakdown_value, stats_groups.c.range_id)
+            )
 
             # Si une table de sortie est spécifiée, créer et remplir la table
             if output_table:
                 print(f"📝 Création de la table {output_table}...")
-                conn.execute(text(f"DROP TABLE IF EXISTS {output_table}"))
-                conn.execute(text(f"CREATE TABLE {output_table} AS {query}"))
+                create_table_as(conn, output_table, query)
                 conn.commit()
                 print(f"✅ Table {output_table} créée avec succès")
 
+                if breakdowns:
+                    create_table_as(conn, f"{output_table}_breakdown", breakdown_query)
+                    conn.commit()
+                    print(f"✅ Table {output_table}_breakdown créée avec succès")
+
                 # Récupérer les données pour affichage
                 result = conn.execute(text(f"SELECT * FROM {output_table}"))
             else:
                 # Sinon, exécuter la requête directement
-                result = conn.execute(text(query))
+                result = conn.execute(query)
 
             row = result.mappings().fetchone()
 
+            breakdown_rows = []
+            if breakdowns and not output_table:
+                breakdown_rows = conn.execute(breakdown_query).mappings().fetchall()
+            conn.execute(text("DROP TABLE IF EXISTS stats_groups"))
+            conn.commit()
+
             if row is None:
                 print("⚠️ Aucune donnée trouvée")
                 return None
@@ -143,7 +473,7 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
 
             # Afficher les stats par plage horaire
             for start_hour, end_hour in hours_ranges:
-                range_name = f"{start_hour:02d}h_{end_hour:02d}h"
+                range_name = _range_name(start_hour, end_hour)
                 print(f"\n⏰ Plage {range_name}")
                 print("-" * 70)
 
@@ -160,6 +490,17 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
                 count = row[f'count_{range_name}']
                 print(f"  Nombre de mesures: {count if count else 0}")
 
+            # Afficher les stats détaillées
+            if breakdown_rows:
+                print("\n🔎 Détail par " + ", ".join(breakdowns))
+                print("-" * 70)
+                for breakdown_row in breakdown_rows:
+                    averages = ", ".join(
+                        f"{col}={breakdown_row[f'avg_{col}']:.2f}" if breakdown_row[f'avg_{col}'] is not None
+                        else f"{col}=N/A" for col in valid_cols)
+                    print(f"  {breakdown_row['breakdown']} {breakdown_row['breakdown_value']} "
+                          f"[{breakdown_row['range_name']}] n={breakdown_row['count']} : {averages}")
+
             print("\n" + "=" * 70)
             return row
 
@@ -167,9 +508,6 @@ def compute_stats_multiple_hours(config_path, table_name, columns, hours_ranges,
         print(f"❌ Erreur : {e}")
         return None
 
-    finally:
-        engine.dispose()
-
 
 # Run
 if __name__ == "__main__":
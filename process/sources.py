@@ -0,0 +1,112 @@
+from sqlalchemy import TIMESTAMP, MetaData, Table, and_, bindparam, select, union_all
+from sqlalchemy.exc import NoSuchTableError
+
+# Description des sources de mesures lues par les calculs (IBM, statistiques)
+#
+# Une source est un ensemble de tables ayant les mêmes colonnes, une colonne de temps et une
+# fenêtre de temps optionnelle. Les requêtes sont construites avec SQLAlchemy Core : les noms de
+# tables et de colonnes sont validés par le catalogue (réflexion) et les valeurs (bornes de la fenêtre,
+# heures, ...) sont des paramètres liés, échappés par le pilote : aucune valeur n'est insérée
+# dans le texte SQL par formatage de chaînes.
+
+
+class SourceSpec:
+    """
+    Tables, colonnes et fenêtre de temps d'une source de mesures
+
+    Args:
+        tables: nom d'une table ou liste de tables (ex: 'veloclimat.labsticc_sensors_preprocess')
+        columns: colonnes lues dans chaque table
+        time_column: colonne de temps (timestamptz)
+        time_window: tuple optionnel (début, fin) limitant les lignes à [début, fin)
+
+    Example:
+        >>> spec = SourceSpec(["veloclimat.labsticc_sensors_preprocess",
+        ...                    "veloclimat.veloclimatmeter_meteo_preprocess"], ["temperature", "timestamp"])
+        >>> source = spec.selectable(conn)
+        >>> conn.execute(select(func.max(source.c.temperature))).scalar()
+    """
+
+    def __init__(self, tables, columns, time_column="timestamp", time_window=None):
+        self.tables = [tables] if isinstance(tables, str) else list(tables)
+        self.columns = list(dict.fromkeys(columns))
+        self.time_column = time_column
+        self.time_window = time_window
+        self._reflected = None
+
+        if not self.tables:
+            raise ValueError("Aucune table source spécifiée")
+        if not self.columns:
+            raise ValueError("Aucune colonne spécifiée")
+
+    @classmethod
+    def from_input(cls, source, columns, **kwargs):
+        """
+        SourceSpec à partir d'un nom de table, d'une liste de tables ou d'une SourceSpec existante
+        """
+        if isinstance(source, SourceSpec):
+            return source
+        return cls(source, columns, **kwargs)
+
+    def reflect(self, conn):
+        """
+        Lit la définition des tables dans le catalogue et vérifie que les colonnes existent
+
+        Returns:
+            list: objets Table, dans l'ordre de self.tables
+        """
+        if self._reflected is None:
+            metadata = MetaData()
+            tables = []
+            for name in self.tables:
+                schema, _, table_name = name.rpartition(".")
+                try:
+                    table = Table(table_name, metadata, schema=schema or None, autoload_with=conn)
+                except NoSuchTableError:
+                    raise ValueError(f"Table introuvable: {name}")
+
+                missing = [col for col in self.columns + [self.time_column] if col not in table.c]
+                if missing:
+                    raise ValueError(f"Colonnes absentes de {name}: {', '.join(missing)}")
+                tables.append(table)
+            self._reflected = tables
+        return self._reflected
+
+    def time_filter(self, table):
+        """
+        Condition sur la colonne de temps d'une table (fenêtre de temps en paramètres liés), ou None
+        """
+        if not self.time_window:
+            return None
+        time_column = table.c[self.time_column]
+        return and_(time_column >= bindparam("window_start", self.time_window[0], type_=TIMESTAMP(timezone=True)),
+                    time_column < bindparam("window_end", self.time_window[1], type_=TIMESTAMP(timezone=True)))
+
+    def selects(self, conn, columns=None):
+        """
+        Une requête SELECT par table : à exécuter séparément pour paralléliser la lecture
+
+        Args:
+            conn: connexion SQLAlchemy (réflexion des tables)
+            columns: colonnes lues (défaut: self.columns)
+
+        Returns:
+            list: tuples (nom de la table, Table, Select)
+        """
+        columns = self.columns if columns is None else columns
+        selects = []
+        for name, table in zip(self.tables, self.reflect(conn)):
+            statement = select(*[table.c[col] for col in columns])
+            condition = self.time_filter(table)
+            if condition is not None:
+                statement = statement.where(condition)
+            selects.append((name, table, statement))
+        return selects
+
+    def selectable(self, conn, columns=None, name="source"):
+        """
+        Toutes les tables de la source en une seule sous-requête (UNION ALL)
+        """
+        statements = [statement for _, _, statement in self.selects(conn, columns)]
+        statement = statements[0] if len(statements) == 1 else union_all(*statements)
+        return statement.subquery(name)
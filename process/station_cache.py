@@ -0,0 +1,197 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from process.utils import CACHE_DIRECTORY, STALE_CACHE_SECONDS
+
+# Triangulation des stations Météo-France et séries de 6 minutes en mémoire
+#
+# Les stations (veloclimat.weather_stations_mf) sont lues une seule fois et triangulées avec
+# scipy.spatial.Delaunay : les sommets des triangles sont les indices des stations, donc
+# station_ids[delaunay.simplices] donne directement les numer_insee de chaque triangle,
+# sans ST_DumpPoints ni ST_Intersects. Les points sont localisés avec find_simplex.
+#
+# Les stations et les séries de veloclimat.weather_data_stations_mf sont conservées dans des
+# fichiers .npz du répertoire de cache : les interpolations suivantes ne relisent pas la base.
+# scipy est une dépendance optionnelle, importée uniquement par load_triangulation.
+#
+# Plusieurs interpolations peuvent lire le cache en même temps (pipeline) : les fichiers sont écrits
+# dans un fichier temporaire renommé ensuite (os.replace), et les anciennes séries ne sont supprimées
+# qu'après STALE_CACHE_SECONDS.
+
+
+def _save_npz(cache_path, **arrays):
+    """
+    Écrit un fichier .npz de façon atomique : les lecteurs voient l'ancien fichier ou le nouveau, jamais un fichier partiel
+    """
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=f".{cache_path.stem}_", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as temp_file:
+            np.savez(temp_file, **arrays)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _load_npz(cache_path):
+    """
+    Lit un fichier .npz du cache en mémoire
+
+    Returns:
+        dict des tableaux, ou None si le fichier n'existe pas (ou plus)
+    """
+    try:
+        with np.load(cache_path) as cached:
+            return {name: cached[name] for name in cached.files}
+    except FileNotFoundError:
+        return None
+
+
+def stations_hash(conn):
+    """
+    Calcule l'empreinte du réseau de stations Météo-France
+
+    La triangulation (et donc les poids barycentriques) ne change que si une station
+    est ajoutée, supprimée ou déplacée.
+
+    Args:
+        conn: SQLAlchemy connection
+
+    Returns:
+        str: hash md5 des identifiants et positions des stations
+    """
+    return conn.execute(text("""
+            SELECT md5(string_agg(numer_insee::text || ':' || ST_AsText(the_geom), ',' ORDER BY numer_insee, id))
+            FROM veloclimat.weather_stations_mf
+            """)).scalar()
+
+
+def load_triangulation(conn, cache_directory=CACHE_DIRECTORY):
+    """
+    Triangulation de Delaunay des stations Météo-France (scipy.spatial.Delaunay)
+
+    Les positions et les numer_insee des stations sont mis en cache sous l'empreinte du réseau
+    (stations_hash) : le cache n'est relu que tant qu'aucune station n'a changé. La triangulation
+    est recalculée à partir des positions en cache (quelques millisecondes pour quelques centaines de stations).
+
+    Args:
+        conn: connexion SQLAlchemy
+        cache_directory: répertoire des fichiers de cache
+
+    Returns:
+        Tuple (delaunay, station_ids) : objet Delaunay et tableau (m,) des numer_insee de ses sommets
+    """
+    try:
+        from scipy.spatial import Delaunay
+    except ImportError:
+        raise ImportError("scipy est requis pour la triangulation en Python (pip install scipy)")
+
+    cache_path = cache_directory / f"stations_delaunay_{stations_hash(conn)}.npz"
+    cached = _load_npz(cache_path)
+    if cached is not None:
+        points, station_ids = cached["points"], cached["station_ids"]
+    else:
+        rows = conn.execute(text("""
+                SELECT numer_insee, ST_X(the_geom), ST_Y(the_geom)
+                FROM veloclimat.weather_stations_mf
+                ORDER BY numer_insee, id
+                """)).fetchall()
+        stations = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        station_ids = stations[:, 0].astype(np.int64)
+        points = stations[:, 1:]
+        _save_npz(cache_path, points=points, station_ids=station_ids)
+
+    return Delaunay(points), station_ids
+
+
+def locate_points(delaunay, station_ids, x, y):
+    """
+    Triangle, stations et poids barycentriques de chaque point (find_simplex)
+
+    Args:
+        delaunay: objet Delaunay retourné par load_triangulation
+        station_ids: tableau (m,) des numer_insee des sommets
+        x: tableau (n,) des abscisses des points
+        y: tableau (n,) des ordonnées des points
+
+    Returns:
+        Tuple (id_triangles, stations, weights) de tableaux (n,), (n, 3) et (n, 3).
+        id_triangle vaut -1 pour les points hors de la triangulation (stations et poids à 0).
+    """
+    points = np.column_stack([x, y]).astype(np.float64)
+    simplices = delaunay.find_simplex(points)
+    inside = simplices >= 0
+
+    # Coordonnées barycentriques à partir des transformations affines des triangles
+    transform = delaunay.transform[simplices[inside]]
+    barycentric = np.einsum("nij,nj->ni", transform[:, :2], points[inside] - transform[:, 2])
+
+    weights = np.zeros((len(points), 3))
+    weights[inside, :2] = barycentric
+    weights[inside, 2] = 1.0 - barycentric.sum(axis=1)
+    stations = np.zeros((len(points), 3), dtype=np.int64)
+    stations[inside] = station_ids[delaunay.simplices[simplices[inside]]]
+
+    return np.where(inside, simplices + 1, -1), stations, weights
+
+
+def load_station_series(conn, refresh=False, cache_directory=CACHE_DIRECTORY):
+    """
+    Séries de 6 minutes des stations Météo-France (veloclimat.weather_data_stations_mf)
+
+    Le cache est identifié par le nombre de relevés, les dates du premier et du dernier relevé et
+    la somme des hashtext des lignes (station, date, t_ground_0, delta_t) : une valeur corrigée ou
+    calculée après coup (delta_t) invalide le cache. Le calcul de l'empreinte parcourt la table,
+    sans transférer les relevés. refresh=True force la relecture.
+
+    Args:
+        conn: connexion SQLAlchemy
+        refresh: relit la table et remplace le cache
+        cache_directory: répertoire des fichiers de cache
+
+    Returns:
+        dict: tableaux station_ids, epochs (secondes depuis l'epoch), t_ground_0 et delta_t,
+              triés par station et par date
+    """
+    fingerprint = conn.execute(text("""
+            SELECT COUNT(*), MIN("date"), MAX("date"),
+                   SUM(hashtext(ROW(numer_sta, "date", t_ground_0, delta_t)::text)::bigint)
+            FROM veloclimat.weather_data_stations_mf
+            """)).one()
+    key = hashlib.md5(repr(tuple(fingerprint)).encode()).hexdigest()
+    cache_path = cache_directory / f"weather_data_stations_mf_{key}.npz"
+
+    cached = None if refresh else _load_npz(cache_path)
+    if cached is not None:
+        return cached
+
+    rows = conn.execute(text("""
+            SELECT numer_sta, EXTRACT(EPOCH FROM "date")::bigint, t_ground_0::float8, delta_t::float8
+            FROM veloclimat.weather_data_stations_mf
+            ORDER BY numer_sta, "date"
+            """)).fetchall()
+    values = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    series = {
+        "station_ids": values[:, 0].astype(np.int64),
+        "epochs": values[:, 1].astype(np.int64),
+        "t_ground_0": values[:, 2],
+        "delta_t": values[:, 3],
+    }
+
+    _save_npz(cache_path, **series)
+
+    # Les anciennes séries récentes peuvent encore être lues par un autre calcul
+    for previous in cache_directory.glob("weather_data_stations_mf_*.npz"):
+        try:
+            if previous != cache_path and time.time() - previous.stat().st_mtime > STALE_CACHE_SECONDS:
+                previous.unlink()
+        except FileNotFoundError:
+            pass  # supprimé par un autre calcul
+    print(f"📊 {len(values)} relevés Météo-France mis en cache")
+    return series
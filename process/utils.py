@@ -3,20 +3,86 @@ Utilitaires  pour les scripts de traitement des données veloclimat
 
 Ce module fournit des fonctions communes pour:
 - Charger la configuration depuis un fichier JSON
-- Se connecter à la base de données
+- Se connecter à la base de données (engines partagés par processus)
+- Écrire des résultats calculés en Python avec COPY (format binaire)
 """
 
+import atexit
+import functools
+import io
 import json
+import sys
+import threading
 from pathlib import Path
 from urllib.parse import quote_plus
+
+import numpy as np
 from sqlalchemy import create_engine, text
 
 
+# Engines partagés par le processus, indexés par fichier de configuration et options de pool
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+# Répertoire des fichiers de cache (grilles LCZ, stations et séries Météo-France)
+CACHE_DIRECTORY = Path(__file__).parent / "cache"
+
+# Âge à partir duquel un ancien fichier de cache peut être supprimé (aucun calcul ne le lit encore)
+STALE_CACHE_SECONDS = 3600
+
+# Options par défaut des engines (surchargées par la section 'database' de config.json
+# ou par les arguments de create_engine_from_config)
+ENGINE_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+    "statement_timeout": None,
+    "application_name": "veloclimat",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _read_config(config_path):
+    """
+    Lit la section 'database' d'un fichier de configuration (mise en cache par chemin)
+    """
+    try:
+        with open(config_path) as f:
+            return json.load(f)['database']
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"❌ Fichier de configuration non trouvé: {config_path}\n"
+            f"   Assurez-vous que '{config_path.name}' existe dans: {config_path.parent}"
+        )
+    except json.JSONDecodeError as e:
+        raise json.JSONDecodeError(
+            f"❌ Configuration JSON invalide dans {config_path}: {e}",
+            e.doc,
+            e.pos
+        )
+    except KeyError:
+        raise KeyError(
+            f"❌ Clé 'database' manquante dans {config_path}\n"
+            f"   La structure doit être: {{'database': {{'host': '...', 'port': 5432, ...}}}}"
+        )
+
+
+def _resolve_config_path(config_filename, base_directory):
+    """
+    Chemin absolu du fichier de configuration, relatif à base_directory s'il n'est pas absolu
+    """
+    config_path = Path(config_filename)
+    if not config_path.is_absolute():
+        config_path = Path(base_directory) / config_path
+    return config_path.resolve()
+
+
 def load_config(config_filename="config.json"):
     """
     Charge la configuration depuis un fichier JSON
 
     Le fichier est cherché dans le même répertoire que le script appelant.
+    Le contenu est mis en cache : un fichier n'est lu qu'une fois par processus.
 
     Args:
         config_filename (str): nom du fichier de configuration (défaut: "config.json")
@@ -34,53 +100,32 @@ def load_config(config_filename="config.json"):
         >>> print(config['host'])
         'localhost'
     """
-    # Remonte 2 niveaux pour trouver le répertoire du script appelant
-    # car ce fichier (utils.py) se trouve dans le même répertoire
-    caller_frame = None
-    try:
-        import inspect
-        frame = inspect.currentframe()
-        if frame is not None and frame.f_back is not None:
-            caller_file = frame.f_back.f_globals.get('__file__')
-            if caller_file:
-                caller_frame = Path(caller_file).parent
-    except:
-        pass
+    # Répertoire du script appelant, un seul niveau de pile
+    caller_file = sys._getframe(1).f_globals.get('__file__')
+    caller_directory = Path(caller_file).parent if caller_file else Path(__file__).parent
 
-    # Fallback: utilise le répertoire du script courant
-    if caller_frame is None:
-        caller_frame = Path(__file__).parent
+    return dict(_read_config(_resolve_config_path(config_filename, caller_directory)))
 
-    config_path = caller_frame / config_filename
 
-    try:
-        with open(config_path) as f:
-            config = json.load(f)['database']
-            return config
-    except FileNotFoundError:
-        raise FileNotFoundError(
-            f"❌ Fichier de configuration non trouvé: {config_path}\n"
-            f"   Assurez-vous que '{config_filename}' existe dans: {caller_frame}"
-        )
-    except json.JSONDecodeError as e:
-        raise json.JSONDecodeError(
-            f"❌ Configuration JSON invalide dans {config_path}: {e}",
-            e.doc,
-            e.pos
-        )
-    except KeyError:
-        raise KeyError(
-            f"❌ Clé 'database' manquante dans {config_path}\n"
-            f"   La structure doit être: {{'database': {{'host': '...', 'port': 5432, ...}}}}"
-        )
+def create_engine_from_config(config_path="config.json", **engine_options):
+    """
+    Retourne l'engine SQLAlchemy partagé pour une configuration
 
+    Un seul engine est créé par processus pour un fichier de configuration et des options
+    données : les appels successifs et les workers parallèles réutilisent le même pool de
+    connexions. Utiliser dispose_engines() pour fermer les connexions.
 
-def create_engine_from_config(config_path="config.json"):
-    """
-    Crée un engine SQLAlchemy depuis la configuration
+    Les options de pool peuvent être définies dans la section 'database' de config.json
+    ou passées en argument (prioritaires) :
+    - pool_size: nombre de connexions conservées dans le pool (défaut: 5)
+    - max_overflow: connexions supplémentaires autorisées au-delà du pool (défaut: 10)
+    - pool_pre_ping: vérifie la connexion avant de la réutiliser (défaut: True)
+    - statement_timeout: durée maximale d'une requête en millisecondes (défaut: aucune)
+    - application_name: nom affiché dans pg_stat_activity (défaut: "veloclimat")
 
     Args:
         config_path (str): chemin vers le fichier config.json
+        **engine_options: options de pool ci-dessus
 
     Returns:
         sqlalchemy.engine.Engine: engine PostgreSQL
@@ -90,26 +135,302 @@ def create_engine_from_config(config_path="config.json"):
         KeyError: si des clés manquent dans la configuration
 
     Example:
-        >>> engine = create_engine_from_config("config.json")
+        >>> engine = create_engine_from_config("config.json", pool_size=8)
         >>> with engine.connect() as conn:
         ...     result = conn.execute(text("SELECT 1"))
     """
-    try:
-        config = load_config(config_path)
-    except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
-        raise e
+    unknown = set(engine_options) - set(ENGINE_DEFAULTS)
+    if unknown:
+        raise TypeError(f"❌ Options d'engine inconnues: {sorted(unknown)}")
 
-    try:
-        url = (
-            f"postgresql://{quote_plus(config['user'])}:"
-            f"{quote_plus(config['password'])}@"
-            f"{config['host']}:{config['port']}/"
-            f"{config['database']}"
+    resolved_path = _resolve_config_path(config_path, Path(__file__).parent)
+    config = _read_config(resolved_path)
+
+    options = {name: engine_options.get(name, config.get(name, default))
+               for name, default in ENGINE_DEFAULTS.items()}
+    key = (resolved_path, tuple(sorted(options.items())))
+
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is not None:
+            return engine
+
+        try:
+            url = (
+                f"postgresql://{quote_plus(config['user'])}:"
+                f"{quote_plus(config['password'])}@"
+                f"{config['host']}:{config['port']}/"
+                f"{config['database']}"
+            )
+        except KeyError as e:
+            raise KeyError(f"❌ Clé manquante dans la configuration: {e}")
+
+        connect_args = {"application_name": options["application_name"]}
+        if options["statement_timeout"]:
+            connect_args["options"] = f"-c statement_timeout={int(options['statement_timeout'])}"
+
+        engine = create_engine(
+            url,
+            pool_size=options["pool_size"],
+            max_overflow=options["max_overflow"],
+            pool_pre_ping=options["pool_pre_ping"],
+            connect_args=connect_args,
         )
-        return create_engine(url)
-    except KeyError as e:
-        raise KeyError(f"❌ Clé manquante dans la configuration: {e}")
+        _ENGINES[key] = engine
+        return engine
+
+
+def dispose_engines():
+    """
+    Ferme les connexions de tous les engines partagés et vide le registre
+
+    Appelée automatiquement à la fin du processus.
+    """
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+atexit.register(dispose_engines)
+
 
+# En-tête et fin du format binaire de COPY
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+_PGCOPY_TRAILER = b"\xff\xff"
 
+# Origine des dates PostgreSQL (2000-01-01) en microsecondes depuis l'epoch Unix
+_PG_EPOCH_US = 946684800 * 1000000
 
+# Types PostgreSQL à taille fixe : format NumPy big-endian du format binaire
+_FIXED_WIDTH_TYPES = {
+    "double precision": ">f8",
+    "real": ">f4",
+    "bigint": ">i8",
+    "integer": ">i4",
+    "smallint": ">i2",
+    "boolean": "?",
+}
 
+_TEXT_TYPES = ("text", "character varying", "character", "varchar")
+
+
+def ewkb_points(x, y, srid=4326):
+    """
+    Encode des points en EWKB (petit boutiste) de façon vectorisée
+
+    Args:
+        x: tableau des abscisses
+        y: tableau des ordonnées
+        srid: système de coordonnées
+
+    Returns:
+        np.ndarray: tableau de type 'S25' utilisable pour une colonne geometry avec copy_to_table
+    """
+
+    points = np.empty(len(x), dtype=[("order", "u1"), ("type", "<u4"), ("srid", "<u4"), ("x", "<f8"), ("y", "<f8")])
+    points["order"] = 1
+    points["type"] = 0x20000001  # Point avec SRID
+    points["srid"] = srid
+    points["x"] = x
+    points["y"] = y
+    return points.view("S25")
+
+
+def _infer_pg_type(values):
+    """
+    Type PostgreSQL correspondant au dtype d'un tableau NumPy
+    """
+    kind = values.dtype.kind
+    if kind == "f":
+        return "double precision" if values.dtype.itemsize == 8 else "real"
+    if kind in "iu":
+        return "bigint" if values.dtype.itemsize == 8 else "integer"
+    if kind == "b":
+        return "boolean"
+    if kind == "M":
+        return "timestamp with time zone"
+    if kind == "S":
+        return "geometry"
+    return "text"
+
+
+def _encode_column(values, pg_type):
+    """
+    Encode une colonne au format binaire de COPY
+
+    Returns:
+        Tuple (longueurs int32 par ligne, -1 pour NULL ; octets concaténés des valeurs non NULL)
+    """
+
+    base_type = pg_type.split("(")[0].strip()
+
+    if base_type in _FIXED_WIDTH_TYPES:
+        values = np.asarray(values)
+        if values.dtype == object:
+            mask = np.array([v is None for v in values])
+            values = np.where(mask, 0, values)
+        elif values.dtype.kind == "f":
+            mask = np.isnan(values)
+        else:
+            mask = np.zeros(len(values), dtype=bool)
+        encoded = values[~mask].astype(_FIXED_WIDTH_TYPES[base_type])
+        lengths = np.where(mask, -1, encoded.dtype.itemsize)
+        return lengths, encoded.view(np.uint8).ravel()
+
+    if base_type in ("timestamp with time zone", "timestamp without time zone", "date"):
+        values = np.asarray(values)
+        if values.dtype.kind != "M":
+            values = values.astype("datetime64[us]")
+        mask = np.isnat(values)
+        if base_type == "date":
+            days = values[~mask].astype("datetime64[D]").astype(np.int64) - 10957
+            encoded = days.astype(">i4")
+        else:
+            encoded = (values[~mask].astype("datetime64[us]").astype(np.int64) - _PG_EPOCH_US).astype(">i8")
+        lengths = np.where(mask, -1, encoded.dtype.itemsize)
+        return lengths, encoded.view(np.uint8).ravel()
+
+    values_array = np.asarray(values)
+    if base_type == "geometry" and values_array.dtype.kind == "S":
+        # EWKB à taille fixe (ex: ewkb_points)
+        lengths = np.full(len(values_array), values_array.dtype.itemsize)
+        return lengths, np.ascontiguousarray(values_array).view(np.uint8).ravel()
+
+    if base_type in _TEXT_TYPES or base_type in ("geometry", "bytea"):
+        chunks = [None if v is None else (v if isinstance(v, bytes) else str(v).encode("utf-8"))
+                  for v in values_array.tolist()]
+        lengths = np.array([-1 if c is None else len(c) for c in chunks], dtype=np.int64)
+        data = np.frombuffer(b"".join(c for c in chunks if c is not None), dtype=np.uint8)
+        return lengths, data
+
+    raise ValueError(f"❌ Type PostgreSQL non supporté par copy_to_table: {pg_type}")
+
+
+def _encode_binary_copy(columns, pg_types):
+    """
+    Construit le flux binaire de COPY pour un lot de lignes (en-tête, lignes, fin)
+
+    Args:
+        columns: liste de tableaux de même longueur
+        pg_types: liste des types PostgreSQL des colonnes
+
+    Returns:
+        bytes: contenu à envoyer à COPY ... FROM STDIN (FORMAT binary)
+    """
+
+    nb_rows = len(columns[0])
+    encoded = [_encode_column(values, pg_type) for values, pg_type in zip(columns, pg_types)]
+
+    # Taille de chaque ligne : nombre de champs (int16) puis longueur (int32) + données de chaque champ
+    row_sizes = np.full(nb_rows, 2, dtype=np.int64)
+    for lengths, _ in encoded:
+        row_sizes += 4 + np.maximum(lengths, 0)
+    row_starts = len(_PGCOPY_HEADER) + np.concatenate([[0], np.cumsum(row_sizes)[:-1]]).astype(np.int64)
+    total = len(_PGCOPY_HEADER) + int(row_sizes.sum()) + len(_PGCOPY_TRAILER)
+
+    out = np.empty(total, dtype=np.uint8)
+    out[:len(_PGCOPY_HEADER)] = np.frombuffer(_PGCOPY_HEADER, dtype=np.uint8)
+    out[total - len(_PGCOPY_TRAILER):] = np.frombuffer(_PGCOPY_TRAILER, dtype=np.uint8)
+
+    field_count = np.full(nb_rows, len(columns), dtype=">i2").view(np.uint8).reshape(nb_rows, 2)
+    out[row_starts[:, None] + np.arange(2)] = field_count
+
+    position = row_starts + 2
+    for lengths, data in encoded:
+        out[position[:, None] + np.arange(4)] = lengths.astype(">i4").view(np.uint8).reshape(nb_rows, 4)
+        position = position + 4
+
+        # Copie des données de longueur variable à leur position dans chaque ligne
+        sizes = np.maximum(lengths, 0)
+        if len(data):
+            offsets = np.cumsum(sizes) - sizes
+            destination = np.repeat(position - offsets, sizes) + np.arange(len(data))
+            out[destination] = data
+        position = position + sizes
+
+    return out.tobytes()
+
+
+def copy_to_table(conn, table_name, columns, types=None, unlogged=False, indexes=None, chunk_rows=1000000):
+    """
+    Écrit des colonnes NumPy/pandas dans une table avec COPY ... FROM STDIN au format binaire
+
+    Args:
+        conn: connexion SQLAlchemy (pilote psycopg2)
+        table_name: table de destination (ex: 'veloclimat.ma_table')
+        columns: dict {nom de colonne: tableau} ou DataFrame pandas, dans l'ordre des colonnes
+        types: dict {nom de colonne: type PostgreSQL}. S'il est fourni, la table est recréée
+               (DROP + CREATE) ; les types manquants sont déduits des dtypes NumPy.
+               Sinon la table doit exister et les types sont lus dans le catalogue.
+        unlogged: crée la table en UNLOGGED (tables de travail, pas d'écriture dans le WAL)
+        indexes: liste de définitions d'index créés après le chargement
+                 ex: ["(id)", "USING GIST (the_geom)"]
+        chunk_rows: nombre de lignes encodées et envoyées par COPY
+
+    Returns:
+        int: nombre de lignes écrites
+
+    Example:
+        >>> copy_to_table(conn, "veloclimat.result", {"id": ids, "t_inter": values},
+        ...               types={"id": "integer"}, indexes=["(id)"])
+    """
+
+    names = list(columns.keys())
+    arrays = [np.asarray(columns[name]) for name in names]
+    nb_rows = len(arrays[0]) if arrays else 0
+
+    if types is not None:
+        pg_types = [types.get(name) or _infer_pg_type(values) for name, values in zip(names, arrays)]
+        column_definitions = ", ".join(f'"{name}" {pg_type}' for name, pg_type in zip(names, pg_types))
+        conn.execute(text(f"""
+                DROP TABLE IF EXISTS {table_name};
+                CREATE {'UNLOGGED ' if unlogged else ''}TABLE {table_name} ({column_definitions});
+                """))
+    else:
+        catalog = dict(conn.execute(text("""
+                SELECT attname, format_type(atttypid, atttypmod)
+                FROM pg_attribute
+                WHERE attrelid = to_regclass(:table_name) AND attnum > 0 AND NOT attisdropped
+                """), {"table_name": table_name}).fetchall())
+        missing = [name for name in names if name not in catalog]
+        if missing:
+            raise KeyError(f"❌ Colonnes absentes de {table_name}: {missing}")
+        pg_types = [catalog[name] for name in names]
+
+    column_list = ", ".join(f'"{name}"' for name in names)
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, nb_rows, chunk_rows):
+            payload = _encode_binary_copy([values[start:start + chunk_rows] for values in arrays], pg_types)
+            cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT binary)",
+                               io.BytesIO(payload))
+    finally:
+        cursor.close()
+
+    for index in indexes or []:
+        conn.execute(text(f"CREATE INDEX ON {table_name} {index}"))
+
+    return nb_rows
+
+
+def create_table_as(conn, table_name, statement, temporary=False, unlogged=False):
+    """
+    Crée une table à partir d'une requête SQLAlchemy Core (CREATE TABLE ... AS SELECT)
+
+    Les valeurs de la requête restent des paramètres liés, transmis au pilote avec la requête compilée.
+
+    Args:
+        conn: connexion SQLAlchemy
+        table_name: table créée (supprimée au préalable si elle existe)
+        statement: requête Select
+        temporary: crée une table temporaire
+        unlogged: crée la table en UNLOGGED
+
+    Returns:
+        int: nombre de lignes écrites
+    """
+    compiled = statement.compile(dialect=conn.dialect)
+    kind = "TEMPORARY " if temporary else "UNLOGGED " if unlogged else ""
+    conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    return conn.exec_driver_sql(f"CREATE {kind}TABLE {table_name} AS {compiled}", compiled.params).rowcount